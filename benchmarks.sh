@@ -1,6 +1,11 @@
 #! /bin/bash
 export PYTHONPATH=.:$PYTHONPATH
 
+echo
+echo 'checking memory per stream, streams: 2000'
+python -O examples/net/memory.py -c 2000
+echo 'done memory per stream'
+
 echo
 name='net'
 echo 'checking '${name}', clients: 100, request/client: 1000'
@@ -12,6 +17,21 @@ disown -r
 kill $sid
 echo 'done '${name}', clients: 100, request/client: 1000'
 
+echo
+name='steering'
+address='tcp://127.0.0.1:8999'
+for steer in '' '--steer'; do
+    echo 'checking '${name}' '${steer}', clients/cpu: 10, request/client: 1000'
+    python -O examples/$name/server.py --address $address $steer > /dev/null &
+    sid=$!
+    sleep 0.5
+    python -O examples/$name/client.py --address $address -c 10 -r 1000 \
+        --msize 64 | tail -1
+    disown -r
+    kill $sid
+    echo 'done '${name}' '${steer}', clients/cpu: 10, request/client: 1000'
+done
+
 echo
 name='pb'
 echo 'checking '${name}', clients: 100, request/client: 100'
@@ -1,9 +1,10 @@
 import pymaid
+from pymaid.net.datagram import Datagram
 
 from examples.template import get_client_parser, parse_args
 
 
-class Echo(pymaid.net.datagram.Datagram):
+class Echo(Datagram):
 
     def init(self):
         self.nbytes = 0
@@ -14,37 +15,30 @@ class Echo(pymaid.net.datagram.Datagram):
         self.receive_event.set()
 
     def error_received(self, exc):
-        self.transport.close()
+        self.close(exc)
 
 
-async def wrapper(loop, address, count):
-    if isinstance(address, str):
-        raise ValueError(
-            'does not support unix domain socket with datagram'
-        )
-        # transport, protocol = await pymaid.create_unix_datagram(Echo, addres)
-    else:
-        transport, protocol = await pymaid.create_datagram(Echo, address)
+async def wrapper(address, count):
+    transport = await pymaid.net.dial_datagram(address, transport_class=Echo)
 
-    write = transport.sendto
     req = b'a' * args.msize
-    receive_event = protocol.receive_event = pymaid.Event()
+    receive_event = transport.receive_event
     for _ in range(count):
-        write(req)
+        transport.sendto(req)
         await receive_event.wait()
         receive_event.clear()
+    nbytes = transport.nbytes
     transport.close()
-    assert protocol.nbytes == count * args.msize, \
-        (protocol.nbytes, count * args.msize)
+    assert nbytes == count * args.msize, (nbytes, count * args.msize)
 
 
 async def main():
     global args
     args = parse_args(get_client_parser())
-    loop = pymaid.get_event_loop()
-    tasks = [pymaid.create_task(
-            wrapper(loop, args.address, args.request)
-        ) for _ in range(args.concurrency)]
+    tasks = [
+        pymaid.create_task(wrapper(args.address, args.request))
+        for _ in range(args.concurrency)
+    ]
     await pymaid.gather(*tasks)
 
 
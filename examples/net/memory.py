@@ -0,0 +1,62 @@
+'''Measure memory used per stream, e.g.: python examples/net/memory.py -c 5000
+
+Reports the python heap allocated by creating the transports only, sockets are
+created before measuring.
+'''
+import gc
+import logging
+import socket
+import tracemalloc
+
+from argparse import ArgumentParser
+
+import pymaid
+from pymaid.net.stream import Stream
+
+
+class DictStream(Stream):
+
+    def data_received(self, data):
+        pass
+
+
+class SlottedStream(Stream):
+
+    __slots__ = ()
+
+    def data_received(self, data):
+        pass
+
+
+def measure(transport_class, count):
+    pairs = [socket.socketpair() for _ in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    streams = [transport_class(sock) for sock, _ in pairs]
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    for stream in streams:
+        stream.close()
+    for _, sock in pairs:
+        sock.close()
+    return size / count
+
+
+async def main():
+    parser = ArgumentParser()
+    parser.add_argument(
+        '-c', dest='count', type=int, default=2000, help='streams to create',
+    )
+    args = parser.parse_args()
+    logging.getLogger('pymaid.net').setLevel(logging.WARNING)
+
+    for transport_class in (DictStream, SlottedStream):
+        size = measure(transport_class, args.count)
+        print(f'{transport_class.__name__}: {size:.0f} bytes per stream')
+
+
+if __name__ == "__main__":
+    pymaid.run(main())
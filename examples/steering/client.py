@@ -0,0 +1,94 @@
+'''Latency of request/response on connections made from every cpu.
+
+Clients are pinned to every usable cpu, so the connections are handled by
+different cpus, `local` is the ratio of the connections served by the
+worker on the same cpu as the client.
+'''
+
+import os
+import time
+
+from multiprocessing import get_context
+
+import pymaid
+from pymaid.net.stream import Stream
+from pymaid.utils.prefork import get_cpus
+
+from examples.template import get_client_parser, parse_args
+
+
+class Stream(Stream):
+
+    def init(self):
+        self.replies = pymaid.Queue()
+        self.buf = b''
+
+    def data_received(self, data):
+        *lines, self.buf = (self.buf + data).split(b'\n')
+        for line in lines:
+            self.replies.put_nowait(int(line))
+
+
+async def wrapper(address, count, msize, cpu, latencies):
+    stream = await pymaid.net.dial_stream(address, transport_class=Stream)
+    req = b'a' * (msize - 1) + b'\n'
+    server_cpu = None
+    for _ in range(count):
+        start = time.perf_counter()
+        stream.write_sync(req)
+        server_cpu = await stream.replies.get()
+        latencies.append(time.perf_counter() - start)
+    stream.close()
+    return server_cpu == cpu
+
+
+async def bench(args, cpu, queue):
+    latencies = []
+    local = await pymaid.gather(*(
+        wrapper(args.address, args.request, args.msize, cpu, latencies)
+        for _ in range(args.concurrency)
+    ))
+    queue.put((latencies, sum(local)))
+
+
+def run_client(args, cpu, queue):
+    os.sched_setaffinity(0, {cpu})
+    pymaid.run(bench(args, cpu, queue))
+
+
+def percentile(values, p):
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def main():
+    args = parse_args(get_client_parser())
+    ctx = get_context('fork')
+    queue = ctx.Queue()
+    clients = [
+        ctx.Process(target=run_client, args=(args, cpu, queue))
+        for cpu in get_cpus()
+    ]
+    for client in clients:
+        client.start()
+    latencies = []
+    local = 0
+    for _ in clients:
+        client_latencies, client_local = queue.get()
+        latencies.extend(client_latencies)
+        local += client_local
+    for client in clients:
+        client.join()
+
+    latencies.sort()
+    connections = len(clients) * args.concurrency
+    print(
+        f'connections: {connections}, local: {local / connections:.2%}, '
+        f'requests: {len(latencies)}, '
+        f'p50: {percentile(latencies, 0.5) * 1e6:.0f}us, '
+        f'p99: {percentile(latencies, 0.99) * 1e6:.0f}us, '
+        f'p999: {percentile(latencies, 0.999) * 1e6:.0f}us'
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+'''Prefork echo server replying with the cpu of the worker.
+
+Run with and without `--steer` to compare, see client.py.
+'''
+
+import os
+
+import pymaid
+from pymaid.net.stream import Stream
+from pymaid.utils.prefork import Supervisor
+
+from examples.template import get_server_parser, parse_args
+
+
+class Stream(Stream):
+
+    def init(self):
+        # workers are pinned to one cpu
+        self.reply = f'{min(os.sched_getaffinity(0))}\n'.encode()
+
+    def data_received(self, data):
+        self.write_sync(self.reply * data.count(b'\n'))
+
+
+async def serve(address):
+    ch = await pymaid.net.serve_stream(address, transport_class=Stream)
+    async with ch:
+        await ch.serve_forever()
+
+
+def main():
+    parser = get_server_parser()
+    parser.add_argument(
+        '-w', dest='workers', type=int, default=None,
+        help='number of workers, default to number of cpus',
+    )
+    parser.add_argument(
+        '--steer', action='store_true', default=False,
+        help='steer connections to the worker on the same cpu',
+    )
+    args = parse_args(parser)
+    Supervisor(
+        lambda: pymaid.run(serve(args.address)),
+        args.workers,
+        bind=[args.address],
+        steer_by_cpu=args.steer,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,11 @@ from pathlib import Path
 from psutil import Process, NoSuchProcess
 
 from pymaid.conf import settings
-from pymaid.core import run, run_in_processpool, gather
-from pymaid.core import CancelledError, ProcessPoolExecutor
+from pymaid.core import run
+from pymaid.net.handoff import serve_handoff, take_over
 from pymaid.utils.daemon import daemonize, list_worker
 from pymaid.utils.logger import get_logger
+from pymaid.utils.prefork import Supervisor
 
 from .parser import get_parser
 
@@ -36,12 +37,22 @@ def entry_run(args):
     if args.parallel < 1:
         print(f'-p/--parallel should be positive, got {args.parallel}')
         exit(1)
-    if args.parallel > 1:
-        # enabled REUSE_PORT for parallel workers
+    if args.parallel > 1 and not args.bind:
+        # enabled REUSE_PORT for parallel workers binding their own listeners
         settings.pymaid.update({'REUSE_PORT': True})
 
     main_not_call = getattr(mod, main)
-    if args.daemon:
+    if args.hot_restart:
+        if args.daemon or args.parallel > 1 or args.bind:
+            print('--hot-restart only works with a single foreground worker')
+            exit(1)
+        take_over(args.hot_restart)
+        run(
+            serve_handoff(
+                args.hot_restart, main_not_call(*args.args, **args.kwargs)
+            )
+        )
+    elif args.daemon:
         daemonize(
             lambda: run(
                 main_not_call(*(args.args or ()), **(args.kwargs or {}))
@@ -49,25 +60,16 @@ def entry_run(args):
             name=args.name or args.main,
             count=args.parallel,
         )
-    elif args.parallel == 1:
+    elif args.parallel == 1 and not args.bind:
         run(main_not_call(*args.args, **args.kwargs))
     else:
-        async def wrapper():
-            executor = ProcessPoolExecutor(args.parallel)
-            results = [
-                run_in_processpool(
-                    run,
-                    args=(main_not_call,),
-                    kwargs={'args': args.args, 'kwargs': args.kwargs},
-                    executor=executor,
-                )
-                for _ in range(args.parallel)
-            ]
-            try:
-                await gather(*results, return_exceptions=False)
-            except (SystemExit, KeyboardInterrupt, CancelledError):
-                pass
-        run(wrapper())
+        supervisor = Supervisor(
+            lambda: run(main_not_call(*args.args, **args.kwargs)),
+            args.parallel,
+            bind=args.bind,
+            cpu_affinity=args.cpu_affinity,
+        )
+        exit(supervisor.run())
 
 
 def stop_worker(pid):
@@ -141,7 +143,37 @@ parser_run.add_argument(
     '--parallel',
     type=int,
     default=1,
-    help='run entry parallelly',
+    help=(
+        'run entry parallelly, workers are supervised by a master process, '
+        'see pymaid.utils.prefork'
+    ),
+)
+parser_run.add_argument(
+    '--bind',
+    type=str,
+    action='append',
+    default=[],
+    help=(
+        'uri bound once by master and shared by workers, can be repeated, '
+        'e.g. tcp://0.0.0.0:8888; without it workers bind with REUSE_PORT'
+    ),
+)
+parser_run.add_argument(
+    '--no-cpu-affinity',
+    dest='cpu_affinity',
+    action='store_false',
+    default=True,
+    help='do not pin parallel workers to cpus',
+)
+parser_run.add_argument(
+    '--hot-restart',
+    type=str,
+    metavar='CONTROL_SOCKET',
+    help=(
+        'unix socket path for zero-downtime restart, a new worker started '
+        'with the same path takes the listeners over and the old one drains '
+        'then exits, see pymaid.net.handoff'
+    ),
 )
 parser_run.add_argument(
     '--args',
@@ -43,6 +43,10 @@ LOGGING = {
 # same listening value, it should be set to a lower value.
 MAX_ACCEPT = 64
 MAX_TASKS = 32
+# Pending tasks a connection handler queues before the connection pauses
+# reading, reading is resumed once it drops to a quarter of that, and the
+# peer is throttled by tcp flow control in between.
+MAX_PENDING_TASKS = 1024
 
 #
 # MAX_CONNECTIONS limits the connections
@@ -59,6 +63,65 @@ MAX_CONNECTIONS = 10000
 MAX_CONCURRENCY = 10000
 MAX_METHOD_CONCURRENCY = 10000
 
+# HARD_MAX_CONNECTIONS enables load shedding when greater than MAX_CONNECTIONS,
+# connections accepted beyond MAX_CONNECTIONS are rejected right away with a
+# protocol level "server busy" message, e.g. RPCError.ConnectionLimit for rpc,
+# and accepting pauses only when connections plus the ones being rejected
+# reach HARD_MAX_CONNECTIONS, so that clients fail fast instead of waiting in
+# the kernel backlog.
+# 0 disables shedding, accepting pauses at MAX_CONNECTIONS.
+HARD_MAX_CONNECTIONS = 0
+
+# seconds prefork workers are given to drain their connections when stopped
+# or reloaded, then they are killed, see pymaid.utils.prefork,
+# also the default deadline of Channel.drain
+GRACEFUL_TIMEOUT = 30
+
+# resolved addresses of pymaid.net.raw.getaddrinfo are cached for DNS_CACHE_TTL
+# seconds, failed lookups for DNS_CACHE_NEGATIVE_TTL seconds, up to
+# DNS_CACHE_SIZE addresses, 0 disables the caching
+DNS_CACHE_SIZE = 1024
+DNS_CACHE_TTL = 60
+DNS_CACHE_NEGATIVE_TTL = 5
+
+# seconds per tick of the timer wheel shared by heartbeat, idle and rpc
+# timeouts, they fire at most one tick late, see pymaid.utils.timer
+TIMER_WHEEL_TICK = 0.1
+
+# StreamChannel closes connections received nothing for IDLE_TIMEOUT seconds,
+# checked every IDLE_TIMEOUT seconds, so an idle connection lives for
+# IDLE_TIMEOUT to twice of it, rpc connections with contexts in flight are
+# never idle, 0 disables the reaper
+IDLE_TIMEOUT = 0
+
+# seconds to wait before connecting to the next resolved address while the
+# previous attempt is still in progress (happy eyeballs, RFC 8305),
+# 0 connects to them one after another
+HAPPY_EYEBALLS_DELAY = 0.25
+
 # connection/socket related settings
 PM_WEBSOCKET_TIMEOUT = 15
 MAX_BODY_SIZE = 10 * 1024 * 1024
+
+# max size of rpc messages reassembled from fragments, services and stubs
+# may lower it by `MAX_MESSAGE_SIZE` attribute, see pymaid.rpc.pb.protocol
+MAX_MESSAGE_SIZE = 4 * 1024 * 1024
+# max size of fragments pending reassembly of all messages per connection
+MAX_FRAGMENTS_SIZE = 16 * 1024 * 1024
+
+# rpc payloads of at least COMPRESSION_THRESHOLD bytes are compressed by the
+# first of COMPRESSION accepted by peer, e.g. ('zstd', 'lz4', 'zlib'), the
+# ones of at least COMPRESSION_OFFLOAD_SIZE bytes are compressed in threads,
+# and decompressed in threads by contexts once that large, empty COMPRESSION
+# sends raw payloads, see pymaid.rpc.pb.compression
+COMPRESSION = ()
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_OFFLOAD_SIZE = 256 * 1024
+
+# adaptive receive size of streams with `ADAPTIVE_RECV` enabled, the recv size
+# of each connection moves between RECV_SIZE_MIN and RECV_SIZE_MAX following
+# an exponentially weighted moving average (weight RECV_SIZE_ALPHA) of reads
+RECV_SIZE_MIN = 1024
+RECV_SIZE_INITIAL = 16 * 1024
+RECV_SIZE_MAX = 4 * 1024 * 1024
+RECV_SIZE_ALPHA = 0.25
@@ -15,6 +15,7 @@ logger = get_logger('pymaid')
 
 __all__ = (
     'run',
+    'set_sigterm_handler',
     'sleep',
     'get_event_loop',
     'get_event_loop_policy',
@@ -67,18 +68,42 @@ get_event_loop_policy = asyncio.get_event_loop_policy
 get_running_loop = asyncio.get_running_loop
 
 
+# called on SIGTERM instead of sig_interrupt once, see set_sigterm_handler
+_sigterm_handler = None
+
+
 async def with_context(coro):
     get_running_loop().add_signal_handler(signal.SIGINT, sig_interrupt)
-    get_running_loop().add_signal_handler(signal.SIGTERM, sig_interrupt)
+    get_running_loop().add_signal_handler(signal.SIGTERM, sig_terminate)
     await coro
 
 
+def set_sigterm_handler(handler):
+    '''Handle SIGTERM by `handler` instead of cancelling the tasks.
+
+    e.g. drain the channels first, then call :func:`sig_interrupt`;
+    another SIGTERM meanwhile cancels the tasks right away.
+    '''
+    global _sigterm_handler
+    _sigterm_handler = handler
+
+
 def sig_interrupt():
     logger.info('[pymaid] receive interrupt/terminate signal')
     for task in all_tasks():
         task.cancel()
 
 
+def sig_terminate():
+    global _sigterm_handler
+    handler, _sigterm_handler = _sigterm_handler, None
+    if handler is None:
+        sig_interrupt()
+    else:
+        logger.info('[pymaid] receive terminate signal')
+        handler()
+
+
 def run(main, *, args=None, kwargs=None, debug=None):
     from pymaid.conf import settings
     if settings.get('EVENT_LOOP', ns='pymaid') == 'uvloop':
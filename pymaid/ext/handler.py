@@ -3,6 +3,7 @@ import abc
 from queue import deque
 from typing import Callable, Coroutine, List, Optional, Union
 
+from pymaid.conf import settings
 from pymaid.core import create_task, current_task, Event, Task
 from pymaid.core import get_running_loop, iscoroutine, iscoroutinefunction
 from pymaid.error import BaseEx
@@ -11,7 +12,13 @@ from pymaid.utils.logger import logger_wrapper
 
 
 class Handler(abc.ABC):
-    '''Handle the *received* tasks.'''
+    '''Handle the *received* tasks.
+
+    Pending tasks are soft bounded by `max_pending`, callbacks in
+    `on_saturated` are called once the queue reaches it, and callbacks in
+    `on_drained` are called once it drops to `low_pending` again, e.g.
+    connections pause reading in between.
+    '''
 
     def __init__(
         self,
@@ -19,11 +26,28 @@ class Handler(abc.ABC):
         on_close: Optional[List[Callable[['Handler'], None]]] = None,
         error_handler: Optional[Callable[[Task], Coroutine]] = None,
         close_on_exception: bool = False,
+        max_pending: Optional[int] = None,
+        low_pending: Optional[int] = None,
     ):
         self.task = None
         self.on_close = on_close or []
         self.close_on_exception = close_on_exception
 
+        if max_pending is None:
+            max_pending = settings.pymaid.MAX_PENDING_TASKS
+        if low_pending is None:
+            low_pending = max_pending // 4
+        if not max_pending > low_pending >= 0:
+            raise ValueError(
+                f'max_pending ({max_pending!r}) must be > '
+                f'low_pending ({low_pending!r}) must be >= 0'
+            )
+        self.max_pending = max_pending
+        self.low_pending = low_pending
+        self.saturated = False
+        self.on_saturated = []
+        self.on_drained = []
+
         if error_handler:
             if not iscoroutinefunction(error_handler):
                 raise ValueError('required error_handler as coroutinefunction')
@@ -77,8 +101,20 @@ class Handler(abc.ABC):
 
     def submit(self, task: Callable, *args, **kwargs):
         # self.logger.debug(f'{self!r} get task={task}')
-        self.pending_tasks.append((task, args, kwargs))
+        pending_tasks = self.pending_tasks
+        pending_tasks.append((task, args, kwargs))
         self.new_task_received.set()
+        if not self.saturated and len(pending_tasks) >= self.max_pending:
+            self.saturated = True
+            self.logger.debug(f'{self!r} saturated')
+            for cb in self.on_saturated:
+                cb(self)
+
+    def _drained(self):
+        self.saturated = False
+        self.logger.debug(f'{self!r} drained')
+        for cb in self.on_drained:
+            cb(self)
 
     async def handle_error(self, error: Exception):
         '''Default error handler.
@@ -97,7 +133,7 @@ class Handler(abc.ABC):
     def __repr__(self):
         return (
             f'<{self.__class__.__name__} '
-            f'pending={len(self.pending_tasks)} '
+            f'pending={len(self.pending_tasks)} saturated={self.saturated} '
             f'close_on_exception={self.close_on_exception}'
             f'>'
         )
@@ -126,6 +162,8 @@ class SerialHandler(Handler):
                 if not task:
                     running = False
                     break
+                if self.saturated and len(pending_tasks) <= self.low_pending:
+                    self._drained()
 
                 task, args, kwargs = task
                 try:
@@ -159,11 +197,15 @@ class ParallelHandler(Handler):
         error_handler: Optional[Callable[[Task], Coroutine]] = None,
         close_on_exception: bool = False,
         concurrency: int = 5,
+        max_pending: Optional[int] = None,
+        low_pending: Optional[int] = None,
     ):
         super().__init__(
             on_close=on_close,
             error_handler=error_handler,
             close_on_exception=close_on_exception,
+            max_pending=max_pending,
+            low_pending=low_pending,
         )
         self.worker = AioPool(concurrency)
         self.got_exception = False
@@ -210,6 +252,8 @@ class ParallelHandler(Handler):
                 if not task:
                     running = False
                     break
+                if self.saturated and len(pending_tasks) <= self.low_pending:
+                    self._drained()
 
                 task, args, kwargs = task
                 try:
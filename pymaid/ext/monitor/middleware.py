@@ -1,10 +1,16 @@
-from pymaid.core import get_running_loop
 from pymaid.ext.middleware import BaseMiddleware
+from pymaid.utils.timer import get_timer_wheel
 
 from .error import MonitorError
 
 
 class HeartbeatMiddleware(BaseMiddleware):
+    '''Close connections missing `heartbeat_count` heartbeats in a row.
+
+    Every connection is checked every `heartbeat_interval` seconds by the
+    shared timer wheel, heartbeat only clears the counter, so there is no
+    timer rescheduled per heartbeat.
+    '''
 
     def __init__(self, heartbeat_interval: int, heartbeat_count: int):
         '''
@@ -16,32 +22,30 @@ class HeartbeatMiddleware(BaseMiddleware):
         self.heartbeat_count = heartbeat_count
 
     def on_connection_made(self, channel, transport):
-        loop = get_running_loop()
+        wheel = get_timer_wheel()
 
         def clear_heartbeat_counter():
             transport.heartbeat_count = 0
-            transport.heartbeat_timer.cancel()
-            transport.heartbeat_timer = loop.call_later(
-                self.heartbeat_timer, heartbeat_timeout,
-            )
 
         def heartbeat_timeout():
             transport.heartbeat_count += 1
             if transport.heartbeat_count >= self.heartbeat_count:
+                transport.heartbeat_timer = None
                 transport.close(MonitorError.HeartbeatTimeout())
             else:
-                transport.heartbeat_timer = loop.call_later(
+                transport.heartbeat_timer = wheel.call_later(
                     self.heartbeat_interval, heartbeat_timeout,
                 )
 
         transport.heartbeat_count = 0
-        transport.heartbeat_timer = loop.call_later(
+        transport.heartbeat_timer = wheel.call_later(
             self.heartbeat_interval, heartbeat_timeout,
         )
         transport.clear_heartbeat_counter = clear_heartbeat_counter
 
     def on_connection_lost(self, channel, transport):
-        transport.heartbeat_timer.cancel()
+        if transport.heartbeat_timer is not None:
+            transport.heartbeat_timer.cancel()
         del transport.heartbeat_timer
         del transport.clear_heartbeat_counter
         del transport.heartbeat_count
@@ -1,182 +1,206 @@
-import os
-import sys
-import threading
-from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set
 
-from pymaid import LifoQueue, PriorityQueue, QueueFull, QueueEmpty
-from pymaid.net import dial_stream
+from pymaid.core import create_task, get_running_loop, shield
+from pymaid.rpc.connection import Connection
+from pymaid.rpc.pb import dial_stream
+from pymaid.utils.logger import logger_wrapper
 
 
-class ConnectionPool(object):
-    '''Inspired by redis.ConnectionPool'''
+@logger_wrapper(name='pymaid.ConnectionPool')
+class ConnectionPool:
+    '''Pool of multiplexed rpc connections dialed to one address.
 
-    queue_class = LifoQueue
-    empty_item = None
+    Connections are shared instead of checked out, as every connection
+    multiplexes many contexts. :meth:`get` returns the healthy connection
+    with the fewest in-flight contexts, another connection is dialed only
+    when all of them have `max_inflight` or more contexts in flight, up to
+    `size` connections.
+
+    Connections are evicted once closed, or once peer has shut its write
+    side down, e.g. a draining or overloaded server. Evicted connections
+    with contexts in flight are retired, i.e. closed once they are idle.
+
+    :param address: address dialed by `dial`
+    :param size: max number of connections
+    :param prewarm: number of connections dialed by :meth:`start`
+    :param max_inflight: in-flight contexts per connection before dialing
+        another one
+    :param dial: coroutine function dialing a connection, default to
+        :func:`pymaid.rpc.pb.dial_stream`, `dial_kwargs` are passed to it
+    '''
+
+    # seconds to wait before dialing again after a failed dial
+    DIAL_RETRY_DELAY = 1.0
 
     def __init__(
         self,
-        name,
-        address=None,
+        address: str,
         *,
-        size=50,
-        init_count=0,
-        **connection_kwargs,
+        size: int = 8,
+        prewarm: int = 1,
+        max_inflight: int = 128,
+        dial: Callable = dial_stream,
+        **dial_kwargs,
     ):
-        '''Create a blocking connection pool.
-
-        Use ``size`` to increase / decrease the pool size::
-
-        By default, connections will be created by dial_stream.
-
-        Any additional keyword arguments are passed to the dial_stream.
-        '''
-        if not isinstance(size, int) or size < 0 or size > 100:
-            raise ValueError('size must be 0 < size <= 100')
-
-        self.name = name
+        if size <= 0:
+            raise ValueError(f'size must be positive: {size}')
+        if not 0 <= prewarm <= size:
+            raise ValueError(f'prewarm must be in [0, {size}]: {prewarm}')
+        if max_inflight <= 0:
+            raise ValueError(f'max_inflight must be positive: {max_inflight}')
         self.address = address
         self.size = size
-        self.init_count = init_count
-        self.connection_kwargs = connection_kwargs
-        self.reset()
-
-    def _checkpid(self):
-        if self.pid != os.getpid():
-            with self._check_lock:
-                if self.pid == os.getpid():
-                    # another thread already did the work while we waited
-                    # on the lock.
-                    return
-                self.disconnect()
-                self.reset()
-
-    def reset(self):
-        self.pid = os.getpid()
-        self._check_lock = threading.Lock()
-
-        # Create and fill up a thread safe queue with ``empty_item`` values.
-        self.pool = self.queue_class(self.size)
-        while 1:
-            try:
-                self.pool.put_nowait(self.empty_item)
-            except QueueFull:
-                break
-
-        # Keep a list of actual connection instances so that we can
-        # disconnect them later.
-        self._connections = []
-        if self.init_count:
-            self.initpool(self.init_count)
-
-    def item_getter(self, item):
-        return item
-
-    def item_putter(self, conn):
-        return conn
-
-    def initpool(self, init_count):
-        if self._connections:
-            # do not init pool if there are connections
-            return
-        if init_count > self.size:
-            raise ValueError('init_count should not greater than pool size')
-        if not self.address:
-            raise ValueError('calling initpool with address is None')
-        self.init_count = init_count
-        try:
-            for _ in range(init_count):
-                self.pool.get_nowait()
-        except QueueEmpty:
-            pass
-        try:
-            for _ in range(init_count):
-                self.pool.put_nowait(self.item_putter(self.make_connection()))
-        except QueueFull:
-            pass
-
-    def get_connection(self, timeout=None):
-        '''
-        Get a connection from the pool, blocking for ``timeout`` util
-        a connection is available from the pool.
+        self.prewarm = prewarm
+        self.max_inflight = max_inflight
+        self.dial = dial
+        self.dial_kwargs = dial_kwargs
+
+        self.connections: List[Connection] = []
+        # evicted, closed once the contexts in flight are done
+        self.retiring: Set[Connection] = set()
+        self.is_closed = False
+        self.dialed = 0
+        self.evicted = 0
+        self.dial_errors = 0
+        self._dialing = None
+        self._dial_failed_at = None
+        self._loop = get_running_loop()
+
+    async def start(self):
+        '''Dial `prewarm` connections.'''
+        while len(self.connections) < self.prewarm:
+            await self._dial()
+
+    async def get(self) -> Connection:
+        '''Return the least loaded connection, dial one if needed.
+
+        :raises: errors of `dial` if there is no healthy connection.
         '''
-        self._checkpid()
-        # will raise QueueEmpty if timeout is not None
-        item = self.pool.get(block=True, timeout=timeout)
-        if item is self.empty_item:
-            return self.make_connection()
-        else:
-            return self.item_getter(item)
-
-    @contextmanager
-    def get_autorelease_connection(self, timeout=None):
-        conn = self.get_connection(timeout)
+        if self.is_closed:
+            raise RuntimeError(f'{self!r} is closed')
+        conn, inflight = self._least_loaded()
+        if (conn is not None
+                and (inflight < self.max_inflight
+                     or len(self.connections) >= self.size)):
+            return conn
+        if conn is not None and self._dial_failed_at is not None:
+            if (self._loop.time() - self._dial_failed_at
+                    < self.DIAL_RETRY_DELAY):
+                return conn
         try:
-            yield conn
-        finally:
-            self.release(conn)
-
-    def make_connection(self):
-        '''Create a new connection'''
-        connection = dial_stream(self.address, **self.connection_kwargs)
-        connection.pid = os.getpid()
-
-        def close(conn, reason=None, reset=None):
-            self._connections.remove(conn)
-            item = self.item_putter(conn)
-            if item in self.pool.queue:
-                self.pool.queue.remove(item)
-            del connection.pid
-            try:
-                self.pool.put_nowait(self.empty_item)
-            except QueueFull:
-                pass
-
-        connection.add_close_cb(close)
-        self._connections.append(connection)
-        return connection
-
-    def release(self, connection):
-        '''Releases the connection back to the pool'''
-        self._checkpid()
-        if connection.pid != self.pid:
-            return
-
-        if connection.is_closed:
-            if connection in self._connections:
-                self._connections.remove(connection)
-            connection = None
-            item = self.empty_item
-        else:
-            item = self.item_putter(connection)
-        try:
-            self.pool.put_nowait(item)
-        except QueueFull:
-            # perhaps the pool has been reset() after a fork? regardless,
-            # we don't want this connection
-            # should we close this conn?
-            if connection:
-                connection.close('useless')
-
-    def disconnect(self, reason=None):
-        '''Disconnects all connections in the pool'''
-        for connection in self._connections[:]:
-            connection.close(reason)
-
-    def __repr__(self):
-        return '[ConnectionPool|%s][connect_kwargs|%s][max|%d][created|%d]' % (
-            self.name, self.connection_kwargs, self.size,
-            len(self._connections)
+            return await self._dial()
+        except OSError:
+            if conn is None:
+                raise
+            # busy but healthy
+            return conn
+
+    def _least_loaded(self):
+        best = None
+        best_inflight = 0
+        for conn in self.connections[:]:
+            if not self.is_healthy(conn):
+                self._evict(conn)
+                continue
+            inflight = len(conn.context_manager.contexts)
+            if best is None or inflight < best_inflight:
+                best = conn
+                best_inflight = inflight
+                if not inflight:
+                    break
+        return best, best_inflight
+
+    def is_healthy(self, conn: Connection) -> bool:
+        return (
+            conn.state < conn.STATE.CLOSING
+            and not conn.handler.is_closing
         )
-    __str__ = __repr__
 
+    async def _dial(self) -> Connection:
+        # concurrent callers share one dial
+        if self._dialing is None:
+            self._dialing = create_task(self._do_dial())
+            self._dialing.add_done_callback(self._dial_done)
+        return await shield(self._dialing)
+
+    def _dial_done(self, task):
+        self._dialing = None
+        if not task.cancelled() and task.exception() is not None:
+            self.dial_errors += 1
+            self._dial_failed_at = self._loop.time()
+
+    async def _do_dial(self) -> Connection:
+        conn = await self.dial(
+            self.address,
+            on_close=[self._connection_lost],
+            **self.dial_kwargs,
+        )
+        self._dial_failed_at = None
+        if self.is_closed:
+            conn.close('pool closed')
+            raise RuntimeError(f'{self!r} is closed')
+        self.dialed += 1
+        self.connections.append(conn)
+        self.logger.debug(f'{self!r} dialed {conn!r}')
+        return conn
 
-class PriorityConnectionPool(ConnectionPool):
+    def _connection_lost(self, conn: Connection, exc=None):
+        self.retiring.discard(conn)
+        if conn in self.connections:
+            self.connections.remove(conn)
+            self.evicted += 1
+            self.logger.debug(f'{self!r} lost {conn!r} exc={exc!r}')
+
+    def _evict(self, conn: Connection):
+        self.connections.remove(conn)
+        self.evicted += 1
+        self.logger.debug(f'{self!r} evicted {conn!r}')
+        if not conn.context_manager.contexts:
+            conn.close('evicted')
+            return
+        # contexts in flight keep going until they are done
+        self.retiring.add(conn)
+        conn.context_manager.on_idle.append(partial(self._retired, conn))
+
+    def _retired(self, conn: Connection, context_manager):
+        if conn in self.retiring:
+            self.retiring.discard(conn)
+            conn.close('evicted')
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'connections': len(self.connections),
+            'inflight': sum(
+                len(conn.context_manager.contexts)
+                for conn in self.connections
+            ),
+            'dialed': self.dialed,
+            'evicted': self.evicted,
+            'retiring': len(self.retiring),
+            'dial_errors': self.dial_errors,
+        }
+
+    def close(self, reason: Optional[str] = 'pool closed'):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        if self._dialing is not None:
+            self._dialing.cancel()
+        for conn in self.connections + list(self.retiring):
+            conn.close(reason)
+        self.connections.clear()
+        self.retiring.clear()
 
-    queue_class = PriorityQueue
-    empty_item = (sys.maxsize, None)
+    async def __aenter__(self):
+        await self.start()
+        return self
 
-    def item_getter(self, item):
-        return item[1] if item else item
+    async def __aexit__(self, exc_type, exc_value, exc_tb):
+        self.close()
 
-    def item_putter(self, conn):
-        return (conn.transmission_id, conn) if conn else conn
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} address={self.address} '
+            f'connections={len(self.connections)}/{self.size}>'
+        )
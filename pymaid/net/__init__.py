@@ -22,11 +22,12 @@ __all__ = ['Protocol', 'Transport', 'Stream', 'Datagram']
 import socket
 import ssl
 
-from typing import Callable, List, Optional, Union
+from typing import Callable, List, Optional, Sequence, Union
 
 
 from .channel import ChannelType, StreamChannel
-from .raw import sock_connect
+from .datagram import Datagram, DatagramChannel
+from .raw import sock_connect, DATAGRAM_OPTS
 from .stream import Stream
 from .utils.uri import parse_uri
 
@@ -102,6 +103,8 @@ async def serve_stream(
     backlog: int = 4096,
     reuse_address: bool = True,
     reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
     ssl_context: Union[None, 'ssl.SSLContext'] = None,
     ssl_handshake_timeout: Optional[float] = None,
     start_serving: bool = True,
@@ -119,6 +122,12 @@ async def serve_stream(
     e.g. when hostnames resolve to the same IP address),
     the Channel is only bound once to that address.
 
+    With `reuse_port`, connections can be steered to the worker whose cpu
+    handles them, e.g. the cpu of the nic queue, by `incoming_cpu` of the
+    worker and `reuseport_cpus` of the reuse port group,
+    see :func:`pymaid.net.raw.steer_by_cpu`.
+    :class:`pymaid.utils.prefork.Supervisor` does it with `steer_by_cpu`.
+
     This method is a coroutine.
     '''
     channel = create_channel(
@@ -134,6 +143,74 @@ async def serve_stream(
         backlog=backlog,
         reuse_address=reuse_address,
         reuse_port=reuse_port,
+        incoming_cpu=incoming_cpu,
+        reuseport_cpus=reuseport_cpus,
+    )
+    if start_serving:
+        channel.start()
+    return channel
+
+
+async def dial_datagram(
+    address: str,
+    *,
+    transport_class: Datagram = Datagram,
+    on_open: Optional[List[Callable]] = None,
+    on_close: Optional[List[Callable]] = None,
+    **kwargs,
+):
+    '''Create a `Datagram` instance connected to `address`.
+
+    The socket is connected, so `sendto` without address sends to `address`
+    and only datagrams from `address` are received.
+
+    This method is a coroutine.
+
+    :returns: a `Datagram` object.
+    '''
+    uri = parse_uri(address)
+    sock = await sock_connect(uri.scheme, uri.address, net_opts=DATAGRAM_OPTS)
+    return transport_class(
+        sock,
+        initiative=True,
+        on_open=on_open,
+        on_close=on_close,
+        uri=uri,
+        **kwargs,
+    )
+
+
+async def serve_datagram(
+    address: str,
+    *,
+    name: str = 'DatagramChannel',
+    channel_class: ChannelType = DatagramChannel,
+    transport_class: Datagram = Datagram,
+    flags: socket.AddressInfo = socket.AI_PASSIVE,
+    reuse_address: bool = True,
+    reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
+    start_serving: bool = True,
+    **kwargs,
+):
+    '''Create a datagram channel bound on `address` and serve forever.
+
+    Every bound socket is served by one `transport_class` instance, see
+    :class:`pymaid.net.datagram.DatagramChannel`.
+
+    This method is a coroutine.
+    '''
+    channel = channel_class(
+        name=name, transport_class=transport_class, **kwargs,
+    )
+    await channel.listen(
+        address,
+        flags=flags,
+        reuse_address=reuse_address,
+        reuse_port=reuse_port,
+        incoming_cpu=incoming_cpu,
+        reuseport_cpus=reuseport_cpus,
     )
     if start_serving:
         channel.start()
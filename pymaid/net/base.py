@@ -19,6 +19,7 @@ class ChannelState(enum.IntEnum):
     CREATED = 0
     STARTED = 10
     PAUSED = 20
+    DRAINING = 30
     SHUTTING_DOWN = 50
     CLOSING = 90
     CLOSED = 100
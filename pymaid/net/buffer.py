@@ -0,0 +1,153 @@
+'''Buffers used by socket transports.
+
+Transports hold their outgoing data in `write_buffer`, which is created by
+`SocketTransport.BUFFER_FACTORY`. Both buffers here expose the same small api:
+`extend`, `clear`, `send(sock)` and `len()` in bytes.
+
+:class:`RecvSizer` decides how many bytes a stream asks for per recv.
+'''
+
+import os
+import socket
+
+from collections import deque
+from itertools import islice
+
+from pymaid.types import DataType
+
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = -1
+if IOV_MAX <= 0:
+    # POSIX guarantees at least 16
+    IOV_MAX = 16
+
+
+class WriteBuffer(bytearray):
+    '''Contiguous write buffer, data is copied in when enqueued.
+
+    Cheap for small writes, but sent data is deleted from the front,
+    which costs a memmove of the remaining bytes for every partial send.
+    '''
+
+    __slots__ = ()
+
+    def send(self, sock: socket.socket) -> int:
+        n = sock.send(self)
+        if n:
+            del self[:n]
+        return n
+
+
+class WriteQueue:
+    '''Queue of immutable buffers flushed by vectored `sock.sendmsg`.
+
+    Immutable data (`bytes`, readonly `memoryview`) is queued without copying,
+    mutable data is copied once since caller may reuse it.
+    Partial sends are tracked by slicing the head buffer, no memmove needed.
+    '''
+
+    __slots__ = ('buffers', 'size')
+
+    def __init__(self):
+        self.buffers = deque()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def extend(self, data: DataType):
+        view = memoryview(data)
+        if not view.readonly:
+            view = memoryview(bytes(view))
+        elif view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        size = view.nbytes
+        if size:
+            self.buffers.append(view)
+            self.size += size
+
+    def clear(self):
+        self.buffers.clear()
+        self.size = 0
+
+    def send(self, sock: socket.socket) -> int:
+        buffers = self.buffers
+        if len(buffers) == 1 or not HAS_SENDMSG:
+            n = sock.send(buffers[0])
+        else:
+            n = sock.sendmsg(islice(buffers, IOV_MAX))
+        if n:
+            self.consume(n)
+        return n
+
+    def consume(self, n: int):
+        '''Drop `n` bytes from the front of the queue.'''
+        buffers = self.buffers
+        self.size -= n
+        while n:
+            head = buffers[0]
+            size = head.nbytes
+            if n < size:
+                buffers[0] = head[n:]
+                break
+            buffers.popleft()
+            n -= size
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'buffers={len(self.buffers)} size={self.size}>'
+        )
+
+
+class RecvSizer:
+    '''Adapt recv size to the observed read sizes of one connection.
+
+    Keeps an exponentially weighted moving average of read sizes, the size is
+    doubled when a read fills it up, and halved when the average drops below
+    a quarter of it, always within [`minimum`, `maximum`].
+    '''
+
+    __slots__ = (
+        'size', 'minimum', 'maximum', 'alpha', 'average', 'grows', 'shrinks',
+    )
+
+    def __init__(
+        self, initial: int, minimum: int, maximum: int, alpha: float,
+    ):
+        if not 0 < minimum <= initial <= maximum:
+            raise ValueError(
+                f'requires 0 < minimum ({minimum!r}) <= initial ({initial!r})'
+                f' <= maximum ({maximum!r})'
+            )
+        if not 0 < alpha <= 1:
+            raise ValueError(f'alpha ({alpha!r}) must be in (0, 1]')
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alpha = alpha
+        self.average = float(initial)
+        self.grows = 0
+        self.shrinks = 0
+
+    def update(self, n: int):
+        '''Record a read of `n` bytes, adjust `size` for the next one.'''
+        self.average += self.alpha * (n - self.average)
+        size = self.size
+        if n >= size:
+            if size < self.maximum:
+                self.size = min(size * 2, self.maximum)
+                self.grows += 1
+        elif self.average < size / 4 and size > self.minimum:
+            self.size = max(size // 2, self.minimum)
+            self.shrinks += 1
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'size={self.size} average={self.average:.0f}>'
+        )
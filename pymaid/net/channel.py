@@ -4,18 +4,30 @@ import socket
 import ssl as _ssl
 import sys
 
-from typing import Optional, TypeVar, Union
+from typing import List, Optional, Sequence, TypeVar, Union
+from weakref import WeakSet
 
 from pymaid.conf import settings
-from pymaid.core import get_running_loop, Event, CancelledError
+from pymaid.core import get_running_loop, wait_for, Event, CancelledError
+from pymaid.core import TimeoutError
 from pymaid.ext.middleware import MiddlewareManager
+from pymaid.utils.timer import get_timer_wheel
 
 from .base import logger, ChannelState
-from .raw import sock_listen
+from .raw import (
+    ACCEPT_RETRY_DELAY, ACCEPT_RETRY_ERRNOS, sock_accept, sock_listen,
+)
 from .stream import Stream, StreamType
 from .transport import Transport, TransportType
 from .utils.uri import parse_uri
 
+_listening_channels = WeakSet()
+
+
+def get_listening_channels() -> List['Channel']:
+    '''Return channels of this process with listeners not closed.'''
+    return [ch for ch in _listening_channels if ch.listeners]
+
 
 class Channel(abc.ABC):
 
@@ -49,6 +61,13 @@ class Channel(abc.ABC):
         self.closed_event = Event()
         self._loop = get_running_loop()
         self._serving_forever_fut = None
+        self._drained_fut = None
+
+        # drain metrics, see get_drain_stats
+        self.drain_started_at = None
+        self.drain_deadline = None
+        self.drain_connections = 0
+        self.drain_forced = 0
 
     @property
     def is_full(self):
@@ -63,7 +82,15 @@ class Channel(abc.ABC):
         backlog: int = 4096,
         reuse_address: bool = os.name == 'posix' and sys.platform != 'cygwin',
         reuse_port: bool = False,
+        incoming_cpu: Optional[int] = None,
+        reuseport_cpus: Optional[Sequence[int]] = None,
     ):
+        '''Listen on `address`.
+
+        `incoming_cpu` and `reuseport_cpus` steer connections to the
+        listeners of the reuse port group by cpu handling them,
+        see :func:`pymaid.net.raw.steer_by_cpu`.
+        '''
         uri = self.uri = parse_uri(address)
         listeners = await sock_listen(
             uri.scheme,
@@ -72,9 +99,12 @@ class Channel(abc.ABC):
             backlog=backlog,
             reuse_address=reuse_address,
             reuse_port=reuse_port,
+            incoming_cpu=incoming_cpu,
+            reuseport_cpus=reuseport_cpus,
         )
         for sock in listeners:
             self.listeners.append(sock)
+        _listening_channels.add(self)
 
     def read_from_listener(self, sock: socket.socket):
         raise NotImplementedError
@@ -124,6 +154,78 @@ class Channel(abc.ABC):
         for sock in self.listeners:
             loop.remove_reader(sock.fileno())
 
+    async def drain(
+        self, timeout: Optional[float] = None, reason: str = 'drain',
+    ):
+        '''Stop accepting, let the connections finish, then close.
+
+        Connections are shut down by :meth:`shutdown_connections`, e.g. rpc
+        connections finish the contexts in flight before shutting down,
+        the ones still open after `timeout` seconds are closed, default to
+        `settings.pymaid.GRACEFUL_TIMEOUT`.
+        Progress is reported by :meth:`get_drain_stats`.
+        '''
+        if self.state >= self.STATE.DRAINING:
+            await self.wait_closed()
+            return
+        if timeout is None:
+            timeout = settings.pymaid.GRACEFUL_TIMEOUT
+        if self.state == self.STATE.STARTED:
+            self.pause(reason)
+        self.logger.info(
+            f'{self!r} drain in {timeout} seconds with reason: {reason!r}'
+        )
+        self.state = self.STATE.DRAINING
+        self.drain_started_at = self._loop.time()
+        self.drain_deadline = self.drain_started_at + timeout
+        self.drain_connections = len(self.transports)
+        self.shutdown_connections(reason)
+        if self.transports:
+            fut = self._drained_fut = self._loop.create_future()
+            try:
+                await wait_for(fut, timeout)
+            except TimeoutError:
+                self.logger.warning(
+                    f'{self!r} not drained in {timeout} seconds, '
+                    f'close the rest connections, {self.get_drain_stats()}'
+                )
+                self.drain_forced = len(self.transports)
+                exc = TimeoutError(f'not drained in {timeout} seconds')
+                for conn in list(self.transports.values()):
+                    # drop the buffered data, peer may not be reading
+                    conn._force_close(exc)
+            finally:
+                self._drained_fut = None
+        self.logger.info(f'{self!r} drained, {self.get_drain_stats()}')
+        self.close(reason)
+        await self.wait_closed()
+
+    def shutdown_connections(self, reason: str = 'shutdown'):
+        '''Shut the connections down, called by :meth:`drain`.'''
+
+    def get_drain_stats(self) -> dict:
+        '''Return progress of :meth:`drain`.
+
+        `connections` and `inflight` are the ones left, `drained` is the
+        number of connections closed since drain started, `forced` is the
+        number of them closed by deadline.
+        '''
+        if self.drain_started_at is None:
+            return {'draining': False}
+        now = self._loop.time()
+        return {
+            'draining': self.state == self.STATE.DRAINING,
+            'elapsed': now - self.drain_started_at,
+            'remaining': max(self.drain_deadline - now, 0),
+            'connections': len(self.transports),
+            'inflight': sum(
+                getattr(conn, 'inflight', 0)
+                for conn in self.transports.values()
+            ),
+            'drained': self.drain_connections - len(self.transports),
+            'forced': self.drain_forced,
+        }
+
     def shutdown(self, reason: str = 'shutdown'):
         if self.state >= self.STATE.SHUTTING_DOWN:
             return
@@ -139,7 +241,7 @@ class Channel(abc.ABC):
             return
         if self.state == self.STATE.STARTED:
             self.pause(reason)
-        if self.state == self.STATE.PAUSED:
+        if self.state in {self.STATE.PAUSED, self.STATE.DRAINING}:
             self.shutdown(reason)
         self.logger.info(f'{self!r} close with reason: {reason!r}')
         self.state = self.STATE.CLOSING
@@ -179,6 +281,11 @@ class Channel(abc.ABC):
 
 class StreamChannel(Channel):
 
+    # seconds over which `accept_rate` and `shed_rate` are measured
+    ACCEPT_RATE_WINDOW = 1.0
+    # max seconds a shed connection is kept waiting for peer to close
+    SHED_TIMEOUT = 1.0
+
     def __init__(
         self,
         *,
@@ -197,25 +304,188 @@ class StreamChannel(Channel):
             middleware_manager=middleware_manager,
             **kwargs,
         )
+        self.max_accept = settings.pymaid.MAX_ACCEPT
+
+        # accept metrics, see get_accept_stats
+        self.accepted = 0
+        self.accept_batches = 0
+        self.accept_limited = 0
+        self.accept_errors = 0
+        self.accept_rate = 0.0
+        self.shed = 0
+        self.shed_rate = 0.0
+        self._rate_start = self._loop.time()
+        self._rate_accepted = 0
+        self._rate_shed = 0
+
+        # fd -> (sock, timeout handle), of sockets being shed
+        self.shedding = {}
+
+        # idle reaper, see IDLE_TIMEOUT setting
+        self.idle_timeout = settings.pymaid.IDLE_TIMEOUT
+        self.reaped = 0
+        # conn.id -> (reads, timer handle), of connections watched
+        self._idle_timers = {}
+
+    @property
+    def hard_limit(self) -> int:
+        '''Limit of connections plus the ones being shed.
+
+        Connections beyond `MAX_CONNECTIONS` are shed only if
+        `HARD_MAX_CONNECTIONS` is greater than it.
+        '''
+        return max(
+            settings.pymaid.HARD_MAX_CONNECTIONS,
+            settings.pymaid.MAX_CONNECTIONS,
+        )
+
+    @property
+    def is_full(self):
+        return len(self.transports) + len(self.shedding) >= self.hard_limit
 
     def read_from_listener(self, sock: socket.socket):
-        connection_made = self.connection_made
-        while 1:
-            if self.is_full:
-                self.pause('stop accept since is full')
-                break
-            try:
-                conn, addr = sock.accept()
-            except (BlockingIOError, InterruptedError, ConnectionAbortedError):
-                return
-            conn.setblocking(False)
-            connection_made(conn)
+        # accept at most `max_accept` connections per wakeup, the rest are
+        # left in backlog for next loop iteration, so that a connection storm
+        # does not starve the established connections
+        room = self.hard_limit - len(self.transports) - len(self.shedding)
+        if room <= 0:
+            self.pause('stop accept since is full')
+            return
+        max_accept = self.max_accept
+        batch = min(max_accept, room)
+        accept_connection = self.accept_connection
+        accepted = 0
+        try:
+            while accepted < batch:
+                conn = sock_accept(sock)
+                accepted += 1
+                accept_connection(conn)
+        except (BlockingIOError, InterruptedError, ConnectionAbortedError):
+            pass
+        except OSError as exc:
+            if exc.errno not in ACCEPT_RETRY_ERRNOS:
+                raise
+            self.accept_errors += 1
+            self.logger.error(
+                f'{self!r} accept failed: {exc.strerror}, '
+                f'retry in {ACCEPT_RETRY_DELAY} seconds'
+            )
+            self._loop.remove_reader(sock.fileno())
+            self._loop.call_later(
+                ACCEPT_RETRY_DELAY, self._retry_accept, sock
+            )
+        self._record_accepts(accepted, accepted == max_accept)
+        if accepted == room:
+            self.pause('stop accept since is full')
+
+    def _retry_accept(self, sock: socket.socket):
+        if self.state == self.STATE.STARTED and sock.fileno() != -1:
+            self._loop.add_reader(sock.fileno(), self.read_from_listener, sock)
+
+    def accept_connection(self, sock: socket.socket):
+        '''Serve accepted `sock`, or shed it beyond `MAX_CONNECTIONS`.'''
+        if len(self.transports) < settings.pymaid.MAX_CONNECTIONS:
+            self.connection_made(sock)
+        else:
+            self.shed_connection(sock)
+
+    def shed_connection(self, sock: socket.socket):
+        '''Reject `sock` right away, so that the peer fails fast.
+
+        Data of :meth:`shed_message` is sent, then write side is shut down,
+        the socket is kept reading until closed by peer, so that the message
+        is not discarded by a reset, for at most `SHED_TIMEOUT` seconds.
+        '''
+        self.shed += 1
+        self._rate_shed += 1
+        try:
+            data = self.shed_message()
+            if data:
+                sock.send(data)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            sock.close()
+            return
+        fd = sock.fileno()
+        loop = self._loop
+        self.shedding[fd] = (
+            sock, loop.call_later(self.SHED_TIMEOUT, self._shed_done, sock),
+        )
+        loop.add_reader(fd, self._read_shed, sock)
+        self.logger.debug(f'{self!r} shed connection fd={fd}')
+
+    def shed_message(self) -> Optional[bytes]:
+        '''Return the protocol level "server busy" message for shedding.'''
+        return None
+
+    def _read_shed(self, sock: socket.socket):
+        try:
+            data = sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._shed_done(sock)
+
+    def _shed_done(self, sock: socket.socket):
+        shedding = self.shedding.pop(sock.fileno(), None)
+        if shedding is None:
+            return
+        shedding[1].cancel()
+        self._loop.remove_reader(sock.fileno())
+        sock.close()
+        if self.state == self.STATE.PAUSED and not self.is_full:
+            self.start()
+
+    def _record_accepts(self, accepted: int, limited: bool = False):
+        self.accepted += accepted
+        self.accept_batches += 1
+        if limited:
+            self.accept_limited += 1
+        self._rate_accepted += accepted
+        self._update_accept_rate()
+
+    def _update_accept_rate(self):
+        now = self._loop.time()
+        elapsed = now - self._rate_start
+        if elapsed >= self.ACCEPT_RATE_WINDOW:
+            self.accept_rate = self._rate_accepted / elapsed
+            self.shed_rate = self._rate_shed / elapsed
+            self._rate_start = now
+            self._rate_accepted = 0
+            self._rate_shed = 0
+
+    def get_accept_stats(self) -> dict:
+        '''Return accept statistics of this channel.
+
+        `batches` counts the wakeups of listeners, `limited` counts the ones
+        stopped by `max_accept` with connections left in backlog, a growing
+        `limited` means accepting is falling behind, e.g. connection storm.
+        `rate` is connections accepted per second over the last window.
+        `shed` counts the accepted connections rejected by load shedding,
+        `shedding` is the number of them not closed yet, and `shed_rate` is
+        the rejected per second over the last window.
+        '''
+        self._update_accept_rate()
+        return {
+            'accepted': self.accepted,
+            'batches': self.accept_batches,
+            'limited': self.accept_limited,
+            'errors': self.accept_errors,
+            'rate': self.accept_rate,
+            'shed': self.shed,
+            'shedding': len(self.shedding),
+            'shed_rate': self.shed_rate,
+        }
 
     def connection_made(self, sock: socket.socket) -> Stream:
         conn = self._make_connection(
             sock, False, on_close=[self.connection_lost],
         )
         self.transports[conn.id] = conn
+        if self.idle_timeout > 0:
+            self._watch_idle(conn)
         self.logger.info(
             f'{self!r} connection_made: '
             f'<{self.transport_class.__name__} {conn.id}>'
@@ -225,8 +495,14 @@ class StreamChannel(Channel):
     def connection_lost(self, conn: Stream, exc=None):
         assert conn.id in self.transports, conn.id
         del self.transports[conn.id]
+        idle_timer = self._idle_timers.pop(conn.id, None)
+        if idle_timer is not None:
+            idle_timer[1].cancel()
         if self.state == self.STATE.PAUSED and not self.is_full:
             self.start()
+        if not self.transports and self._drained_fut is not None:
+            if not self._drained_fut.done():
+                self._drained_fut.set_result(None)
         self.logger.info(
             f'{self!r} connection_lost: '
             f'<{self.transport_class.__name__} {conn.id}> exc={exc}'
@@ -234,11 +510,36 @@ class StreamChannel(Channel):
         if not self.transports and self.state >= self.STATE.CLOSING:
             self._finnal_close(exc)
 
+    def _watch_idle(self, conn: Stream):
+        self._idle_timers[conn.id] = (
+            conn.reads,
+            get_timer_wheel().call_later(
+                self.idle_timeout, self._check_idle, conn,
+            ),
+        )
+
+    def _check_idle(self, conn: Stream):
+        reads, _ = self._idle_timers.pop(conn.id)
+        if conn.reads != reads or getattr(conn, 'inflight', 0):
+            self._watch_idle(conn)
+            return
+        self.reaped += 1
+        self.logger.info(
+            f'{self!r} close idle connection: '
+            f'<{self.transport_class.__name__} {conn.id}>'
+        )
+        conn.close(TimeoutError(f'idle for {self.idle_timeout} seconds'))
+
     def shutdown(self, reason: str = 'shutdown'):
         super().shutdown(reason)
-        for conn in self.transports.values():
-            # conn.shutdown is not coroutine
-            conn.shutdown(reason)
+        self.shutdown_connections(reason)
+
+    def shutdown_connections(self, reason: str = 'shutdown'):
+        '''Shut connections down once their buffered data is sent.'''
+        for sock, _ in list(self.shedding.values()):
+            self._shed_done(sock)
+        for conn in list(self.transports.values()):
+            conn.graceful_shutdown(reason)
 
     def _make_connection(self, sock, initiative, on_open=None, on_close=None):
         return self.transport_class(
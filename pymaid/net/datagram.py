@@ -0,0 +1,439 @@
+import errno
+import socket
+import struct
+import sys
+
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, TypeVar
+
+from pymaid.ext.middleware import MiddlewareManager
+from pymaid.types import DataType
+
+from .channel import Channel, _listening_channels
+from .raw import sock_bind
+from .transport import SocketTransport
+from .utils.uri import URI, parse_uri
+
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+# from linux/udp.h, python does not export it
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+HAS_UDP_GSO = sys.platform.startswith('linux')
+# kernel limits of one UDP_SEGMENT send
+UDP_MAX_SEGMENTS = 64
+UDP_MAX_GSO_BYTES = 65507
+# errors meaning GSO does not work for this socket or device
+GSO_UNSUPPORTED_ERRNOS = frozenset((errno.EIO, errno.ENOPROTOOPT))
+
+
+def split_gso_batches(datagrams: Sequence[DataType]) -> List[List[DataType]]:
+    '''Split `datagrams` into batches sendable by one UDP_SEGMENT send.
+
+    Datagrams of a batch are of the same size, except that the last one can
+    be shorter, as the kernel cuts the payload into `gso_size` segments.
+    '''
+    batches = []
+    batch = None
+    gso_size = total = 0
+    for data in datagrams:
+        size = len(data)
+        if (batch is None
+                or size > gso_size
+                or len(batch) >= UDP_MAX_SEGMENTS
+                or total + size > UDP_MAX_GSO_BYTES):
+            batch = [data]
+            batches.append(batch)
+            gso_size = size
+            total = size
+        else:
+            batch.append(data)
+            total += size
+        if size < gso_size:
+            # only the last segment can be shorter
+            batch = None
+    return batches
+
+
+class Datagram(SocketTransport):
+    '''Datagram transport, e.g. udp.
+
+    Served by :class:`DatagramChannel` with one instance per bound socket
+    receiving datagrams of all peers, or created by
+    :func:`pymaid.net.dial_datagram` with a connected socket.
+
+    Datagrams are received by up to `RECV_BATCH` `recvmsg` calls per
+    wakeup, sent right away and queued only when the socket buffer is full.
+    :meth:`sendto_many` sends datagrams of the same size by one syscall with
+    UDP generic segmentation offload (GSO) when kernel supports it.
+    '''
+
+    __slots__ = (
+        'initiative', 'uri', 'gso', 'datagrams_received', 'bytes_read',
+        'datagrams_sent', 'gso_sends', 'errors', '_buffer_size',
+    )
+
+    # max size of one datagram, the rest is truncated and reported as error
+    MAX_SIZE = 64 * 1024
+    # max recvmsg calls per wakeup, like recvmmsg(2) but in a loop
+    RECV_BATCH = 32
+    # datagrams queued until the socket is writable again
+    BUFFER_FACTORY = deque
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        *,
+        on_open: Optional[List[Callable]] = None,
+        on_close: Optional[List[Callable]] = None,
+        initiative: bool = False,
+        uri: Optional[URI] = None,
+    ):
+        self._buffer_size = 0
+        super().__init__(sock, on_open=on_open, on_close=on_close)
+        self.initiative = initiative
+        self.uri = uri
+        self.gso = HAS_UDP_GSO and self._probe_gso()
+        self.datagrams_received = 0
+        self.bytes_read = 0
+        self.datagrams_sent = 0
+        self.gso_sends = 0
+        self.errors = 0
+        self.state = self.STATE.CONNECTED
+
+        for cb in self.on_open:
+            cb(self)
+
+    def wrap_sock(self, sock: socket.socket):
+        self._sock = sock
+        self._sock_fd = sock.fileno()
+        try:
+            self.peername = sock.getpeername()
+        except OSError:
+            # not connected, e.g. served by channel
+            self.peername = None
+        self.sockname = sock.getsockname()
+        self._loop.add_reader(self._sock_fd, self._reader)
+
+    def _probe_gso(self) -> bool:
+        if self.family not in {socket.AF_INET, socket.AF_INET6}:
+            return False
+        try:
+            self._sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+        except OSError:
+            return False
+        return True
+
+    def get_write_buffer_size(self) -> int:
+        return self._buffer_size
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'received': self.datagrams_received,
+            'bytes_read': self.bytes_read,
+            'sent': self.datagrams_sent,
+            'gso_sends': self.gso_sends,
+            'errors': self.errors,
+            'queued': len(self.write_buffer),
+        }
+
+    def shutdown(self, reason=None):
+        # datagram has no half close, close after queued datagrams are sent
+        self.close()
+
+    # Public api for upper usage.
+    def datagram_received(self, data: bytes, addr: Any):
+        '''Callback when a datagram received from `addr`.
+
+        Should be overrided.
+        '''
+        self.logger.debug(
+            f'{self!r} datagram_received, size={len(data)} addr={addr}, '
+            'ignored!'
+        )
+
+    def error_received(self, exc: OSError):
+        '''Callback when a send or receive operation raises an OSError.
+
+        E.g. ConnectionRefusedError reported by ICMP for connected sockets,
+        the transport is kept open.
+        '''
+        self.logger.debug(f'{self!r} error_received exc={exc!r}')
+
+    def sendto(self, data: DataType, addr: Any = None):
+        '''Send `data` to `addr`, or to peer of connected socket if None.
+
+        Never blocks, datagram is queued if the socket buffer is full.
+        '''
+        if self.state >= self.STATE.CLOSING:
+            raise ConnectionResetError('transport is closing')
+        if not data:
+            return
+        if not self.write_buffer:
+            try:
+                self._send(data, addr)
+            except (BlockingIOError, InterruptedError):
+                self._loop.add_writer(self._sock_fd, self._writer)
+            except OSError as exc:
+                self._error_received(exc)
+                return
+            else:
+                self.datagrams_sent += 1
+                return
+        self._queue(data, addr)
+
+    def sendto_many(self, datagrams: Sequence[DataType], addr: Any = None):
+        '''Send `datagrams` to `addr` in order, as if :meth:`sendto` each.
+
+        Datagrams of the same size are coalesced into one syscall by GSO,
+        only the last one of such a run can be shorter, so send datagrams
+        of a fixed size (e.g. state updates of mtu size) to benefit from it.
+        '''
+        if self.state >= self.STATE.CLOSING:
+            raise ConnectionResetError('transport is closing')
+        datagrams = [data for data in datagrams if data]
+        if not datagrams:
+            return
+        if not self.gso or len(datagrams) == 1 or self.write_buffer:
+            for data in datagrams:
+                self.sendto(data, addr)
+            return
+        batches = split_gso_batches(datagrams)
+        for index, batch in enumerate(batches):
+            try:
+                if len(batch) == 1:
+                    self._send(batch[0], addr)
+                else:
+                    self._send_gso(batch, addr)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as exc:
+                if len(batch) > 1 and exc.errno in GSO_UNSUPPORTED_ERRNOS:
+                    # e.g. device without checksum offload, never try again
+                    self.logger.debug(f'{self!r} disable gso, exc={exc!r}')
+                    self.gso = False
+                if len(batch) > 1 and (
+                        not self.gso or exc.errno == errno.EINVAL):
+                    # EINVAL if segments are larger than mtu
+                    for data in (d for b in batches[index:] for d in b):
+                        self.sendto(data, addr)
+                    return
+                self._error_received(exc)
+                continue
+            self.datagrams_sent += len(batch)
+        else:
+            return
+        self._loop.add_writer(self._sock_fd, self._writer)
+        for data in (d for b in batches[index:] for d in b):
+            self._queue(data, addr)
+
+    # for internal
+    def _send(self, data: DataType, addr: Any):
+        if addr is None:
+            self._sock.send(data)
+        else:
+            self._sock.sendto(data, addr)
+
+    def _send_gso(self, batch: List[DataType], addr: Any):
+        ancdata = [(SOL_UDP, UDP_SEGMENT, struct.pack('=H', len(batch[0])))]
+        if addr is None:
+            self._sock.sendmsg(batch, ancdata)
+        else:
+            self._sock.sendmsg(batch, ancdata, 0, addr)
+        self.gso_sends += 1
+
+    def _queue(self, data: DataType, addr: Any):
+        # copy, caller may reuse the buffer
+        self.write_buffer.append((bytes(data), addr))
+        self._buffer_size += len(data)
+        self._maybe_pause_writing()
+
+    def _error_received(self, exc: OSError):
+        self.errors += 1
+        try:
+            self.error_received(exc)
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            self._fatal_error(exc, 'Fatal error: error_received() failed.')
+
+    def _reader(self):
+        sock = self._sock
+        max_size = self.MAX_SIZE
+        for _ in range(self.RECV_BATCH):
+            try:
+                data, _, flags, addr = sock.recvmsg(max_size)
+            except (BlockingIOError, InterruptedError):
+                return
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except OSError as exc:
+                self._error_received(exc)
+                return
+            except BaseException as exc:
+                self._fatal_error(exc, 'Fatal read error on socket transport')
+                return
+            if flags & socket.MSG_TRUNC:
+                self._error_received(OSError(
+                    errno.EMSGSIZE,
+                    f'datagram from {addr} truncated to {max_size} bytes',
+                ))
+                continue
+            self.datagrams_received += 1
+            self.bytes_read += len(data)
+            try:
+                self.datagram_received(data, addr)
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except BaseException as exc:
+                self._fatal_error(
+                    exc, 'Fatal error: datagram_received() call failed.'
+                )
+                return
+            if self._sock is None or self.reading_paused:
+                return
+
+    def _writer(self):
+        buffer = self.write_buffer
+        while buffer:
+            data, addr = buffer[0]
+            try:
+                self._send(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except OSError as exc:
+                self._error_received(exc)
+                if self._sock is None:
+                    return
+            except BaseException as exc:
+                self._fatal_error(exc, 'Fatal write error on socket transport')
+                return
+            else:
+                self.datagrams_sent += 1
+            buffer.popleft()
+            self._buffer_size -= len(data)
+        self._buffer_size = 0
+        self._maybe_resume_writing()
+        self._loop.remove_writer(self._sock_fd)
+        if self.state == self.STATE.CLOSING:
+            self._finnal_close(None)
+
+    def _force_close(self, exc):
+        self._buffer_size = 0
+        super()._force_close(exc)
+
+
+Datagram.wrap_sock_attributes()
+
+DatagramType = TypeVar('DatagramType', bound=Datagram)
+
+
+class DatagramChannel(Channel):
+    '''Channel serving datagram sockets bound by :meth:`listen`.
+
+    There is no connection for datagram, every bound socket is served by
+    one `transport_class` instance created by :meth:`start`, which receives
+    datagrams of all peers.
+    '''
+
+    def __init__(
+        self,
+        *,
+        name: str = 'DatagramChannel',
+        transport_class: DatagramType = Datagram,
+        middleware_manager: Optional[MiddlewareManager] = None,
+        **kwargs,
+    ):
+        super().__init__(
+            name=name,
+            transport_class=transport_class,
+            ssl_context=None,
+            middleware_manager=middleware_manager,
+            **kwargs,
+        )
+
+    @property
+    def is_full(self):
+        return False
+
+    async def listen(
+        self,
+        address: str,
+        *,
+        flags: socket.AddressInfo = socket.AI_PASSIVE,
+        reuse_address: bool = True,
+        reuse_port: bool = False,
+        incoming_cpu: Optional[int] = None,
+        reuseport_cpus: Optional[Sequence[int]] = None,
+    ):
+        uri = self.uri = parse_uri(address)
+        listeners = await sock_bind(
+            uri.scheme,
+            uri.address,
+            flags=flags,
+            reuse_address=reuse_address,
+            reuse_port=reuse_port,
+            incoming_cpu=incoming_cpu,
+            reuseport_cpus=reuseport_cpus,
+        )
+        self.listeners.extend(listeners)
+        _listening_channels.add(self)
+
+    def start(self):
+        if self.state >= self.STATE.CLOSING:
+            raise RuntimeError(f'{self!r} is closing, cannot start again')
+        self.logger.info(f'{self!r} start')
+        self.state = self.STATE.STARTED
+        if self.transports:
+            for conn in self.transports.values():
+                conn.resume_reading()
+            return
+        for sock in self.listeners:
+            conn = self.transport_class(
+                sock,
+                on_close=[self.connection_lost],
+                uri=self.uri,
+                **self.extra_transport_kwargs,
+            )
+            self.transports[conn.id] = conn
+
+    def pause(self, reason: str = ''):
+        self.logger.info(f'{self!r} pause with reason: {reason!r}')
+        self.state = self.STATE.PAUSED
+        for conn in self.transports.values():
+            conn.pause_reading()
+
+    async def drain(
+        self, timeout: Optional[float] = None, reason: str = 'drain',
+    ):
+        '''Stop receiving, close after queued datagrams are sent.
+
+        There is no connection to wait for, `timeout` is ignored.
+        '''
+        self.close(reason)
+        await self.wait_closed()
+
+    def close(self, reason=None):
+        if self.state >= self.STATE.CLOSING:
+            return
+        self.logger.info(f'{self!r} close with reason: {reason!r}')
+        self.state = self.STATE.CLOSING
+        if not self.transports:
+            # never started, sockets are not owned by transports
+            for sock in self.listeners:
+                sock.close()
+        del self.listeners[:]
+        if not self.transports:
+            self._finnal_close(reason)
+            return
+        for conn in list(self.transports.values()):
+            conn.close()
+
+    def connection_lost(self, conn: Datagram, exc=None):
+        del self.transports[conn.id]
+        self.logger.info(
+            f'{self!r} connection_lost: '
+            f'<{self.transport_class.__name__} {conn.id}> exc={exc}'
+        )
+        if not self.transports and self.state >= self.STATE.CLOSING:
+            self._finnal_close(exc)
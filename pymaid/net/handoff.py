@@ -0,0 +1,239 @@
+'''Hot restart, hand listening sockets over to a new process.
+
+The running process serves a unix control socket by :class:`HandoffServer`,
+a new process started with the same control path calls :func:`take_over`
+before creating its channels:
+
+1. new process connects, old process sends its listeners by SCM_RIGHTS
+2. new process registers them by :func:`pymaid.net.raw.inherit_listeners`
+   and acks, its channels listen on the inherited sockets then, sharing the
+   same accept queue, so no connection is refused meanwhile
+3. old process drains its channels and exits as on SIGTERM, new process
+   serves the control socket for the next generation
+
+Old process keeps serving if anything fails before the ack.
+'''
+
+import array
+import json
+import os
+import signal
+import socket
+import struct
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymaid.conf import settings
+from pymaid.core import create_task, gather, get_running_loop, wait_for
+from pymaid.core import TimeoutError
+
+from .base import logger
+from .channel import get_listening_channels
+from .raw import inherit_listeners, sock_accept
+
+HEADER = struct.Struct('!I')
+ACK = b'ok'
+# SCM_MAX_FD of linux
+MAX_FDS = 253
+HANDOFF_TIMEOUT = 5.0
+
+
+def send_fds(sock: socket.socket, data: bytes, fds: List[int]) -> int:
+    return sock.sendmsg(
+        [data],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))],
+    )
+
+
+def recv_fds(
+    sock: socket.socket, bufsize: int, maxfds: int,
+) -> Tuple[bytes, List[int]]:
+    fds = array.array('i')
+    data, ancdata, flags, _ = sock.recvmsg(
+        bufsize, socket.CMSG_SPACE(maxfds * fds.itemsize),
+    )
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+    if flags & socket.MSG_CTRUNC:
+        for fd in fds:
+            os.close(fd)
+        raise OSError('ancillary data truncated, too many fds')
+    return data, list(fds)
+
+
+def pack_listeners(
+    listeners: Dict[Tuple[str, str], List[socket.socket]],
+) -> Tuple[bytes, List[int]]:
+    infos = []
+    fds = []
+    for (net, address), sockets in listeners.items():
+        for sock in sockets:
+            infos.append([net, address, sock.family, sock.type, sock.proto])
+            fds.append(sock.fileno())
+    if len(fds) > MAX_FDS:
+        raise ValueError(f'too many listeners to hand over: {len(fds)}')
+    payload = json.dumps({'pid': os.getpid(), 'listeners': infos}).encode()
+    return HEADER.pack(len(payload)) + payload, fds
+
+
+def take_over(path: str, timeout: float = HANDOFF_TIMEOUT) -> bool:
+    '''Take listeners over from the process serving control socket `path`.
+
+    Blocks, call it before the channels listen.
+
+    :returns: bool, False if no process is serving `path`.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    with sock:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+        data, fds = recv_fds(sock, 65536, MAX_FDS)
+        try:
+            if len(data) < HEADER.size:
+                raise ConnectionError('handoff closed by peer')
+            size, = HEADER.unpack_from(data)
+            data = data[HEADER.size:]
+            while len(data) < size:
+                chunk = sock.recv(size - len(data))
+                if not chunk:
+                    raise ConnectionError('handoff closed by peer')
+                data += chunk
+            message = json.loads(data)
+            infos = message['listeners']
+            if len(infos) != len(fds):
+                raise ValueError(
+                    f'got {len(fds)} fds for {len(infos)} listeners'
+                )
+        except BaseException:
+            for fd in fds:
+                os.close(fd)
+            raise
+
+        listeners = {}
+        for (net, address, family, kind, proto), fd in zip(infos, fds):
+            sock_ = socket.socket(family, kind, proto, fd)
+            sock_.setblocking(False)
+            listeners.setdefault((net, address), []).append(sock_)
+        for (net, address), sockets in listeners.items():
+            inherit_listeners(net, address, sockets)
+        sock.sendall(ACK)
+    logger.info(
+        f'[handoff] took {len(fds)} listeners over from pid {message["pid"]}'
+    )
+    return True
+
+
+class HandoffServer:
+    '''Serve control socket `path`, hand listeners over to a new process.
+
+    :param on_drained: called after channels drained,
+        default to terminate this process as on SIGTERM
+    :param graceful_timeout: seconds given to drain the channels,
+        default to `settings.pymaid.GRACEFUL_TIMEOUT`
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        on_drained: Optional[Callable] = None,
+        graceful_timeout: Optional[float] = None,
+    ):
+        self.path = path
+        self.on_drained = on_drained or self._terminate
+        self.graceful_timeout = (
+            graceful_timeout if graceful_timeout is not None
+            else settings.pymaid.GRACEFUL_TIMEOUT
+        )
+        self.sock = None
+        self.handing_off = False
+        self._loop = get_running_loop()
+
+    def start(self):
+        if os.path.exists(self.path):
+            # left by the old generation, which has handed off already
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.bind(self.path)
+        sock.listen()
+        self.sock = sock
+        self._loop.add_reader(sock.fileno(), self._accept)
+        logger.info(f'{self!r} start')
+
+    def close(self):
+        sock = self.sock
+        if sock is None:
+            return
+        self.sock = None
+        self._loop.remove_reader(sock.fileno())
+        # path is not unlinked, it may be bound by the new process already
+        sock.close()
+
+    def _accept(self):
+        try:
+            conn = sock_accept(self.sock)
+        except (BlockingIOError, InterruptedError, ConnectionAbortedError):
+            return
+        if self.handing_off:
+            conn.close()
+            return
+        self.handing_off = True
+        create_task(self.handoff(conn))
+
+    async def handoff(self, conn: socket.socket):
+        channels = get_listening_channels()
+        listeners = {}
+        for ch in channels:
+            key = (ch.uri.scheme, ch.uri.address)
+            listeners.setdefault(key, []).extend(ch.listeners)
+        try:
+            with conn:
+                data, fds = pack_listeners(listeners)
+                n = send_fds(conn, data, fds)
+                if n < len(data):
+                    await self._loop.sock_sendall(conn, data[n:])
+                ack = await wait_for(
+                    self._loop.sock_recv(conn, len(ACK)), HANDOFF_TIMEOUT,
+                )
+        except (OSError, ValueError, TimeoutError) as exc:
+            logger.error(f'{self!r} handoff failed: {exc!r}')
+            self.handing_off = False
+            return
+        if ack != ACK:
+            logger.error(f'{self!r} handoff not acked: {ack!r}')
+            self.handing_off = False
+            return
+
+        logger.info(
+            f'{self!r} handed {len(fds)} listeners over, '
+            f'draining {len(channels)} channels'
+        )
+        self.close()
+        await gather(*(
+            ch.drain(self.graceful_timeout, 'hot restart') for ch in channels
+        ))
+        self.on_drained()
+
+    def _terminate(self):
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} path={self.path} '
+            f'handing_off={self.handing_off}>'
+        )
+
+
+async def serve_handoff(path: str, main):
+    '''Run coroutine `main` with a :class:`HandoffServer` on `path`.'''
+    server = HandoffServer(path)
+    server.start()
+    try:
+        await main
+    finally:
+        server.close()
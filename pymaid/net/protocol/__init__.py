@@ -1,6 +1,6 @@
 import abc
 
-from typing import Any, TypeVar
+from typing import Any, Iterator, Sequence, TypeVar
 
 from pymaid.types import DataType
 
@@ -32,6 +32,65 @@ class Protocol(abc.ABC):
     def encode(cls, obj: Any) -> DataType:
         raise NotImplementedError
 
+    @classmethod
+    def for_connection(cls):
+        '''Return the protocol used by one connection.
+
+        Stateful protocols return a per connection object with the same
+        api, default to the protocol itself.
+        '''
+        return cls
+
+    @classmethod
+    def encode_hello(cls) -> DataType:
+        '''Return data sent by accepted connections once they are made.
+
+        Stateful protocols may advertise their features to peer by it,
+        default to nothing.
+        '''
+        return b''
+
+    @classmethod
+    def encode_segments(cls, *args, **kwargs) -> Sequence[DataType]:
+        '''Encode as segments for vectored writes, default to `encode`.'''
+        return (cls.encode(*args, **kwargs),)
+
+    @classmethod
+    def encode_frames(cls, *args, **kwargs) -> Iterator[Sequence[DataType]]:
+        '''Encode as segments of each frame, default to one frame.
+
+        Protocols splitting large messages yield one frame at a time, so
+        that frames of other messages can be sent between them.
+        '''
+        yield cls.encode_segments(*args, **kwargs)
+
+    @classmethod
+    async def encode_frames_async(
+        cls, *args, **kwargs,
+    ) -> Iterator[Sequence[DataType]]:
+        '''Asynchronized version of `encode_frames`, default to it.
+
+        Protocols doing heavy work to encode, e.g. compression, may offload
+        it to threads here.
+        '''
+        return cls.encode_frames(*args, **kwargs)
+
+    @classmethod
+    def discard_pending(cls, key: Any):
+        '''Drop the partial message of `key`, e.g. fragments received so far
+        of a released rpc context, default to nothing.
+        '''
+
+    @classmethod
+    def frame_size(cls, data: DataType) -> int:
+        '''Return bytes needed to decode the first frame of `data`.
+
+        It is the whole size of the frame once its header is complete,
+        transports skip decoding until that much data is received.
+        Default to 0, i.e. unknown.
+        '''
+        return 0
+
     @abc.abstractclassmethod
     def decode(cls, data: DataType) -> Any:
         raise NotImplementedError
@@ -3,15 +3,25 @@
 Mostly inspired from standard lib `asyncio`.
 '''
 
+import ctypes
+import errno
 import os
 import re
 import socket
+import struct
+import sys
 
+from asyncio import FIRST_COMPLETED
 from errno import ENOTCONN, ECONNABORTED
-from typing import List
+from functools import partial
+from itertools import chain, zip_longest
+from typing import Dict, List, Optional, Sequence
 
 from pymaid.conf import settings
 from pymaid.core import get_running_loop, run_in_threadpool, sleep
+from pymaid.core import create_task, ensure_future, shield, wait
+
+from .utils.dns import DNSCache
 
 HAS_IPv6_FAMILY = hasattr(socket, 'AF_INET6')
 HAS_IPv6_PROTOCOL = hasattr(socket, 'IPPROTO_IPV6')
@@ -41,13 +51,62 @@ NET_OPTS = {
 
 ADDRESS_REGEX = re.compile(r'([\w\.]+):?(\w*)|\[([\w:]+)\]:?(\w*)')
 
+ACCEPT_FLAGS = (
+    getattr(socket, 'SOCK_NONBLOCK', 0) | getattr(socket, 'SOCK_CLOEXEC', 0)
+)
+# errors of accept meaning that we are short of resources
+ACCEPT_RETRY_ERRNOS = frozenset(
+    (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+)
+ACCEPT_RETRY_DELAY = 1
 
-async def getaddrinfo(
+# linux only, missing in socket module of old pythons
+SO_INCOMING_CPU = getattr(socket, 'SO_INCOMING_CPU', 49)
+SO_ATTACH_REUSEPORT_CBPF = 51
+# classic bpf, see linux/filter.h
+BPF_INSN = struct.Struct('HBBI')
+BPF_MAXINSNS = 4096
+BPF_LD_W_ABS = 0x20
+BPF_JMP_JEQ_K = 0x15
+BPF_ALU_MOD_K = 0x94
+BPF_RET_K = 0x06
+BPF_RET_A = 0x16
+# SKF_AD_OFF + SKF_AD_CPU, loads the cpu handling the packet
+SKF_AD_CPU = (-0x1000 + 36) & 0xffffffff
+
+
+def _load_accept4():
+    if not sys.platform.startswith('linux') or not ACCEPT_FLAGS:
+        return None
+    try:
+        accept4 = ctypes.CDLL(None, use_errno=True).accept4
+    except (OSError, AttributeError):
+        return None
+    accept4.argtypes = (
+        ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int,
+    )
+    accept4.restype = ctypes.c_int
+    return accept4
+
+
+_accept4 = _load_accept4()
+HAS_ACCEPT4 = _accept4 is not None
+
+_dns_cache = None
+# (address, family, socket_kind, flags) -> future, of lookups in progress
+_resolving = {}
+
+# listening sockets bound before, keyed by (net, address)
+_inherited_listeners = {}
+
+
+def resolve_address(
     address: str,
     family: socket.AddressFamily,
     socket_kind: socket.SocketKind,
     flags: int = 0,
 ):
+    '''Blocking version of :func:`getaddrinfo`.'''
     if address.startswith('/'):
         if family not in {socket.AF_UNIX, socket.AF_UNSPEC}:
             raise ValueError(
@@ -66,15 +125,78 @@ async def getaddrinfo(
         if not match:
             raise ValueError(f'invalid address: {address}')
         host, port = (g for g in match.groups() if g)
-        infos = await run_in_threadpool(
-            socket.getaddrinfo,
-            args=(host, port, family, socket_kind),
-            kwargs={'flags': flags},
+        infos = socket.getaddrinfo(
+            host, port, family, socket_kind, flags=flags,
         )
         infos = list(set(infos))
     return infos
 
 
+def is_ip_literal(host: str) -> bool:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+        except (OSError, ValueError):
+            continue
+        return True
+    return False
+
+
+def get_dns_cache() -> DNSCache:
+    global _dns_cache
+    if _dns_cache is None:
+        _dns_cache = DNSCache(
+            settings.pymaid.DNS_CACHE_SIZE,
+            settings.pymaid.DNS_CACHE_TTL,
+            settings.pymaid.DNS_CACHE_NEGATIVE_TTL,
+        )
+    return _dns_cache
+
+
+async def getaddrinfo(
+    address: str,
+    family: socket.AddressFamily,
+    socket_kind: socket.SocketKind,
+    flags: int = 0,
+):
+    '''Resolve `address`, results are cached by :func:`get_dns_cache`.
+
+    Unix paths and ip literals are resolved without the threadpool,
+    concurrent lookups of the same address share one resolving.
+    '''
+    if address.startswith('/'):
+        return resolve_address(address, family, socket_kind, flags)
+    match = ADDRESS_REGEX.match(address)
+    if match and is_ip_literal(match.group(1) or match.group(3)):
+        # no dns query, cheap enough to do it in loop
+        return resolve_address(
+            address, family, socket_kind, flags | socket.AI_NUMERICHOST
+        )
+
+    key = (address, family, socket_kind, flags)
+    infos = get_dns_cache().get(key)
+    if infos is not None:
+        return list(infos)
+    fut = _resolving.get(key)
+    if fut is None:
+        fut = _resolving[key] = ensure_future(run_in_threadpool(
+            resolve_address, args=(address, family, socket_kind, flags),
+        ))
+        fut.add_done_callback(partial(_resolved, key))
+    return list(await shield(fut))
+
+
+def _resolved(key, fut):
+    del _resolving[key]
+    if fut.cancelled():
+        return
+    exc = fut.exception()
+    if exc is None:
+        get_dns_cache().set(key, fut.result())
+    elif isinstance(exc, socket.gaierror):
+        get_dns_cache().set_error(key, exc)
+
+
 def set_sock_options(sock: socket.socket):
     # stream opts
     if sock.type == socket.SOCK_STREAM and sock.family != socket.AF_UNIX:
@@ -84,56 +206,218 @@ def set_sock_options(sock: socket.socket):
         setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 
+def reuseport_cpu_cbpf(cpus: Sequence[int]) -> bytes:
+    '''Classic bpf program selecting reuse port socket by cpu.
+
+    Packets handled by `cpus[i]` go to the `i`-th socket of the reuse port
+    group, the ones handled by other cpus to the `cpu % len(cpus)`-th.
+    '''
+    if not cpus or len(cpus) * 2 + 3 > BPF_MAXINSNS:
+        raise ValueError(f'invalid number of cpus: {len(cpus)}')
+    insns = [BPF_INSN.pack(BPF_LD_W_ABS, 0, 0, SKF_AD_CPU)]
+    for index, cpu in enumerate(cpus):
+        # return index if A == cpu else skip the return
+        insns.append(BPF_INSN.pack(BPF_JMP_JEQ_K, 0, 1, cpu))
+        insns.append(BPF_INSN.pack(BPF_RET_K, 0, 0, index))
+    insns.append(BPF_INSN.pack(BPF_ALU_MOD_K, 0, 0, len(cpus)))
+    insns.append(BPF_INSN.pack(BPF_RET_A, 0, 0, 0))
+    return b''.join(insns)
+
+
+def attach_reuseport_cbpf(sock: socket.socket, program: bytes):
+    '''Attach classic bpf `program` to the reuse port group of `sock`.
+
+    The program is shared by the group, attaching to any socket of it
+    replaces the program of all of them.
+    '''
+    buf = ctypes.create_string_buffer(program, len(program))
+    # struct sock_fprog, kernel copies the filter during setsockopt
+    fprog = struct.pack(
+        'HP', len(program) // BPF_INSN.size, ctypes.addressof(buf)
+    )
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+
+
+def steer_by_cpu(
+    sock: socket.socket,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
+):
+    '''Steer connections of `sock` by the cpu handling them, linux only.
+
+    :param incoming_cpu: set `SO_INCOMING_CPU`, since linux 6.2 sockets of
+        the reuse port group with incoming cpu matching the cpu handling the
+        connection are preferred
+    :param reuseport_cpus: attach :func:`reuseport_cpu_cbpf` of the cpus,
+        `reuseport_cpus[i]` is served by the `i`-th socket bound in the
+        group, it works for older kernels as well
+    '''
+    if sock.family == socket.AF_UNIX:
+        return
+    if incoming_cpu is not None:
+        sock.setsockopt(socket.SOL_SOCKET, SO_INCOMING_CPU, incoming_cpu)
+    if reuseport_cpus:
+        attach_reuseport_cbpf(sock, reuseport_cpu_cbpf(reuseport_cpus))
+
+
+def sock_accept(sock: socket.socket) -> socket.socket:
+    '''Accept a connection from listening `sock` as a non-blocking socket.
+
+    `accept4` with SOCK_NONBLOCK is used when available, which saves the
+    syscall of `setblocking` per accepted connection.
+    Peer address is not returned, use `getpeername` when needed.
+
+    :raises: the same errors as `sock.accept`, e.g. `BlockingIOError`.
+    '''
+    if _accept4 is None:
+        conn, _ = sock.accept()
+        conn.setblocking(False)
+        return conn
+    fd = _accept4(sock.fileno(), None, None, ACCEPT_FLAGS)
+    if fd < 0:
+        err = ctypes.get_errno()
+        # OSError picks the subclass by errno, e.g. BlockingIOError
+        raise OSError(err, os.strerror(err))
+    # SOCK_NONBLOCK in type makes the socket object non-blocking as well,
+    # without touching the fd again
+    return socket.socket(
+        sock.family, sock.type | socket.SOCK_NONBLOCK, sock.proto, fd
+    )
+
+
+def interleave_addr_infos(addr_infos: List) -> List:
+    '''Interleave `addr_infos` by family, first family first (RFC 8305).'''
+    families = {}
+    for addr_info in addr_infos:
+        families.setdefault(addr_info[0], []).append(addr_info)
+    return [
+        addr_info
+        for addr_info in chain.from_iterable(zip_longest(*families.values()))
+        if addr_info is not None
+    ]
+
+
+async def _connect_addr(loop, addr_info) -> socket.socket:
+    retry = 3
+    af, kind, proto, canonname, sa = addr_info
+    while 1:
+        sock = socket.socket(af, kind, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, sa)
+            set_sock_options(sock)
+            # NOTE:
+            # When doing a lots connect to remote side under heavy pressure
+            # it would sometimes getting ENOTCONN when call getpeername.
+            # Check it here, if occured, raise it to retry.
+            # *WHY* sock_connect above does not handle this case?
+            # NOTE 2:
+            # This case appears to inconsistently occur with
+            # bound to a unix domain socket.
+            sock.getpeername()
+            return sock
+        except socket.error as exc:
+            sock.close()
+            if exc.errno == 107:
+                # OSError: [Errno 107] Transport endpoint is not connected
+                # special case when dealing with 107, it seems retry later
+                # is ok.
+                await sleep(0.001)
+                continue
+            if exc.errno in {ECONNABORTED, ENOTCONN} and retry:
+                retry -= 1
+                continue
+            raise
+        except BaseException:
+            sock.close()
+            raise
+
+
 async def sock_connect(
     net: str,
     address: str,
     flags: int = 0,
+    *,
+    happy_eyeballs_delay: Optional[float] = None,
+    net_opts: Dict = STREAM_OPTS,
 ) -> socket.socket:
+    '''Connect to `address` over `net`, return the connected socket.
+
+    `net_opts` is :data:`DATAGRAM_OPTS` for connected datagram sockets.
+
+    Resolved addresses are tried by happy eyeballs (RFC 8305): attempts are
+    started one by one every `happy_eyeballs_delay` seconds, or as soon as
+    the previous one fails, the first connected wins, others are cancelled.
+    `happy_eyeballs_delay` defaults to `settings.pymaid.HAPPY_EYEBALLS_DELAY`,
+    addresses are tried one after another when it is 0.
+    '''
     loop = get_running_loop()
-    err = None
-    if net not in STREAM_OPTS:
-        raise ValueError(f'only support {STREAM_OPTS.keys()} now, got {net}')
-    family, socket_kind = STREAM_OPTS[net]
+    if net not in net_opts:
+        raise ValueError(f'only support {net_opts.keys()} now, got {net}')
+    family, socket_kind = net_opts[net]
     addr_infos = await getaddrinfo(address, family, socket_kind, flags)
+    if not addr_infos:
+        raise socket.error('getaddrinfo returns an empty list')
+    if happy_eyeballs_delay is None:
+        happy_eyeballs_delay = settings.pymaid.HAPPY_EYEBALLS_DELAY
+    if len(addr_infos) == 1 or happy_eyeballs_delay <= 0:
+        return await _connect_serially(loop, addr_infos)
+    return await _connect_staggered(
+        loop, interleave_addr_infos(addr_infos), happy_eyeballs_delay
+    )
+
+
+async def _connect_serially(loop, addr_infos) -> socket.socket:
+    err = None
     for addr_info in addr_infos:
-        retry = 3
-        af, kind, proto, canonname, sa = addr_info
-        sock = None
+        try:
+            return await _connect_addr(loop, addr_info)
+        except socket.error as exc:
+            err = exc
+    try:
+        raise err
+    finally:
+        # Break explicitly a reference cycle
+        err = None
+
+
+async def _connect_staggered(loop, addr_infos, delay) -> socket.socket:
+    pending = set()
+    remaining = iter(addr_infos)
+    err = None
+    sock = None
+    try:
         while 1:
-            try:
-                sock = socket.socket(af, kind, proto)
-                sock.setblocking(False)
-                await loop.sock_connect(sock, sa)
-                set_sock_options(sock)
-                # NOTE:
-                # When doing a lots connect to remote side under heavy pressure
-                # it would sometimes getting ENOTCONN when call getpeername.
-                # Check it here, if occured, raise it to retry.
-                # *WHY* sock_connect above does not handle this case?
-                # NOTE 2:
-                # This case appears to inconsistently occur with
-                # bound to a unix domain socket.
-                sock.getpeername()
-                # Break explicitly a reference cycle
-                err = None
-                return sock
-            except socket.error as _:
-                if _.errno == 107:
-                    # OSError: [Errno 107] Transport endpoint is not connected
-                    # special case when dealing with 107, it seems retry later
-                    # is ok.
-                    await sleep(0.001)
-                    continue
-                if _.errno in {ECONNABORTED, ENOTCONN} and retry:
-                    retry -= 1
-                    continue
-                err = _
-                if sock is not None:
-                    sock.close()
+            addr_info = next(remaining, None)
+            if addr_info is not None:
+                pending.add(create_task(_connect_addr(loop, addr_info)))
+            if not pending:
                 break
-
-    if err is None:
-        raise socket.error('getaddrinfo returns an empty list')
+            done, pending = await wait(
+                pending, timeout=delay, return_when=FIRST_COMPLETED,
+            )
+            for task in done:
+                exc = task.exception()
+                if exc is None:
+                    if sock is None:
+                        sock = task.result()
+                    else:
+                        # connected at the same time, keep the first one
+                        task.result().close()
+                elif isinstance(exc, socket.error):
+                    err = exc
+                else:
+                    raise exc
+            if sock is not None:
+                return sock
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await wait(pending)
+            for task in pending:
+                if not task.cancelled() and task.exception() is None:
+                    task.result().close()
     try:
         raise err
     finally:
@@ -141,6 +425,22 @@ async def sock_connect(
         err = None
 
 
+def inherit_listeners(net: str, address: str, sockets: List[socket.socket]):
+    '''Register listening `sockets` bound before for `net` and `address`.
+
+    Processes forked after that, e.g. workers of
+    :class:`pymaid.utils.prefork.Supervisor`, get duplicates of them from
+    :func:`sock_listen` instead of binding their own ones.
+    '''
+    _inherited_listeners[(net, address)] = list(sockets)
+
+
+def get_inherited_listeners(
+    net: str, address: str,
+) -> Optional[List[socket.socket]]:
+    return _inherited_listeners.get((net, address))
+
+
 async def sock_listen(
     net: str,
     address: str,
@@ -148,6 +448,8 @@ async def sock_listen(
     backlog: int = 4096,
     reuse_address: bool = True,
     reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
 ) -> List[socket.socket]:
     '''Create sockets listening on `address`.
 
@@ -160,16 +462,101 @@ async def sock_listen(
     resolve to the same IP address), the sock is only bound once to that
     host.
 
+    Sockets registered by :func:`inherit_listeners` for the same `net` and
+    `address` are duplicated instead of binding new ones.
+
     This is a coroutine.
 
     :returns: `socket.socket` objects that listening on `address`.
     '''
     if net not in STREAM_OPTS:
         raise ValueError(f'only support {STREAM_OPTS.keys()} now, got {net}')
+    inherited = _inherited_listeners.get((net, address))
+    if inherited:
+        return [sock.dup() for sock in inherited]
 
-    sockets = []
     family, socket_kind = STREAM_OPTS[net]
     addr_infos = await getaddrinfo(address, family, socket_kind, flags)
+    return bind_listeners(
+        addr_infos, backlog, reuse_address, reuse_port,
+        incoming_cpu, reuseport_cpus,
+    )
+
+
+def sock_listen_sync(
+    net: str,
+    address: str,
+    flags: socket.AddressInfo = socket.AI_PASSIVE,
+    backlog: int = 4096,
+    reuse_address: bool = True,
+    reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
+) -> List[socket.socket]:
+    '''Blocking version of :func:`sock_listen`, for use without event loop.
+
+    It never touches the threadpool, so it is safe to fork afterwards.
+    '''
+    if net not in STREAM_OPTS:
+        raise ValueError(f'only support {STREAM_OPTS.keys()} now, got {net}')
+    family, socket_kind = STREAM_OPTS[net]
+    addr_infos = resolve_address(address, family, socket_kind, flags)
+    return bind_listeners(
+        addr_infos, backlog, reuse_address, reuse_port,
+        incoming_cpu, reuseport_cpus,
+    )
+
+
+async def sock_bind(
+    net: str,
+    address: str,
+    flags: socket.AddressInfo = socket.AI_PASSIVE,
+    reuse_address: bool = True,
+    reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
+) -> List[socket.socket]:
+    '''Create datagram sockets bound on `address`.
+
+    Datagram version of :func:`sock_listen`, sockets registered by
+    :func:`inherit_listeners` are duplicated as well.
+
+    This is a coroutine.
+    '''
+    if net not in DATAGRAM_OPTS:
+        raise ValueError(
+            f'only support {DATAGRAM_OPTS.keys()} now, got {net}'
+        )
+    inherited = _inherited_listeners.get((net, address))
+    if inherited:
+        return [sock.dup() for sock in inherited]
+
+    family, socket_kind = DATAGRAM_OPTS[net]
+    addr_infos = await getaddrinfo(address, family, socket_kind, flags)
+    return bind_listeners(
+        addr_infos, None, reuse_address, reuse_port,
+        incoming_cpu, reuseport_cpus,
+    )
+
+
+def bind_listeners(
+    addr_infos: List,
+    backlog: Optional[int] = 4096,
+    reuse_address: bool = True,
+    reuse_port: bool = False,
+    incoming_cpu: Optional[int] = None,
+    reuseport_cpus: Optional[Sequence[int]] = None,
+) -> List[socket.socket]:
+    '''Create sockets bound and listening on each of `addr_infos`.
+
+    Sockets are only bound if `backlog` is None, e.g. datagram sockets.
+    Connections are steered by `incoming_cpu` and `reuseport_cpus`,
+    see :func:`steer_by_cpu`.
+    '''
+    reuse_port = settings.get('REUSE_PORT', ns='pymaid') or reuse_port
+    if reuseport_cpus and not reuse_port:
+        raise ValueError('reuseport_cpus requires reuse_port')
+    sockets = []
     try:
         for addr_info in addr_infos:
             af, kind, proto, canonname, sa = addr_info
@@ -182,7 +569,7 @@ async def sock_listen(
             set_sock_options(sock)
             if reuse_address:
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
-            if settings.get('REUSE_PORT', ns='pymaid') or reuse_port:
+            if reuse_port:
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             # Disable IPv4/IPv6 dual stack support (enabled by
             # default on Linux) which makes a single socket
@@ -209,9 +596,11 @@ async def sock_listen(
                     f'error occured while binding on address {addr_info}: '
                     f'{err.strerror}, addr_infos={addr_infos}'
                 ) from None
-            # see https://github.com/golang/go/issues/5030
-            sock.listen(min(backlog, 65535))
+            if backlog is not None:
+                # see https://github.com/golang/go/issues/5030
+                sock.listen(min(backlog, 65535))
             sockets.append(sock)
+            steer_by_cpu(sock, incoming_cpu, reuseport_cpus)
     except Exception:
         for sock in sockets:
             sock.close()
@@ -1,25 +1,81 @@
 import abc
+import errno
+import io
+import mmap
+import os
 import socket
 import ssl as _ssl
 
-from typing import Callable, List, Optional, TypeVar
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, TypeVar
 
+from pymaid.conf import settings
 from pymaid.types import DataType
 
+from .buffer import HAS_SENDMSG, IOV_MAX, RecvSizer
+
+from .tls import get_session, set_session, TLSLayer, SSL_HANDSHAKE_TIMEOUT
 from .transport import SocketTransport
 from .utils.uri import URI
 
+HAS_SENDFILE = hasattr(os, 'sendfile')
+# errors meaning os.sendfile does not work on this kind of fd pair
+SENDFILE_UNSUPPORTED_ERRNOS = frozenset(
+    getattr(errno, name) for name in
+    ('EINVAL', 'ENOSYS', 'ENOTSOCK', 'EOPNOTSUPP', 'ENODEV', 'ESPIPE')
+    if hasattr(errno, name)
+)
+
+
+def get_recv_arena(size: int) -> memoryview:
+    '''Return the shared receive arena with at least `size` bytes.
+
+    IO callbacks run one by one in the event loop, so a single preallocated
+    buffer can serve all transports using :attr:`Stream.RECV_INTO`.
+    '''
+    global _recv_arena
+    if _recv_arena is None or _recv_arena.nbytes < size:
+        # never resize in place, views handed out before are still valid
+        _recv_arena = memoryview(bytearray(size))
+    return _recv_arena
+
+
+_recv_arena = None
+
 
 class Stream(SocketTransport):
 
+    __slots__ = (
+        'initiative', 'ssl_context', 'ssl_handshake_timeout', 'uri', 'corked',
+        'reads', 'bytes_read', '_recv_sizer', '_write_empty_waiter',
+        '_flush_handle', '_tls', '_tls_timer', '_sending_file',
+        '_sendfile_waiter', '_sendfile_deferred', 'write_shutdown',
+    )
+
     MAX_SIZE = 256 * 1024  # recv size passed to sock.recv
+    # Adapt recv size per connection instead of always using MAX_SIZE,
+    # bounds are `RECV_SIZE_*` settings, see :class:`.buffer.RecvSizer`
+    ADAPTIVE_RECV = False
     KEEP_OPEN_ON_EOF = False
-
+    # Use sock.recv_into the shared arena instead of allocating bytes per read,
+    # data_received will get a memoryview which is *only valid* until it
+    # returns, copy it if need to keep the data.
+    RECV_INTO = False
+    # Defer writes and flush them once at the end of current loop iteration,
+    # or as soon as CORK_THRESHOLD bytes buffered. See :meth:`cork`.
+    CORK = False
+    CORK_THRESHOLD = 64 * 1024
+    # max bytes per os.sendfile call, or per read when falling back
+    SENDFILE_CHUNK_SIZE = 256 * 1024
+
+    # target is aliased to source at class creation, unless defined
     WRAP_METHODS = {
         '_data_received': 'data_received',
 
         'write': '_write',
         'write_sync': '_write_sync',
+        'writelines': '_writelines',
+        'writelines_sync': '_writelines_sync',
     }
 
     def __init__(
@@ -40,23 +96,176 @@ class Stream(SocketTransport):
         self.uri = uri
 
         self._write_empty_waiter = None
+        self._flush_handle = None
+        self.corked = self.CORK
+        self._tls = None
+        self._tls_timer = None
+        self._sending_file = False
+        self._sendfile_waiter = None
+        self._sendfile_deferred = None
+        self.write_shutdown = False
+        self.reads = 0
+        self.bytes_read = 0
+        if self.ADAPTIVE_RECV:
+            conf = settings.pymaid
+            self._recv_sizer = RecvSizer(
+                conf.RECV_SIZE_INITIAL,
+                conf.RECV_SIZE_MIN,
+                conf.RECV_SIZE_MAX,
+                conf.RECV_SIZE_ALPHA,
+            )
+        else:
+            self._recv_sizer = None
 
-        self.wrap_methods()
+        if ssl_context:
+            self._start_tls()
 
         for cb in self.on_open:
             cb(self)
 
-    def wrap_methods(self):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.wrap_methods()
+
+    @classmethod
+    def wrap_methods(cls):
         # for internal usage, can be overrided if needed
-        for target, source in self.WRAP_METHODS.items():
-            if not hasattr(self, target):
-                setattr(self, target, getattr(self, source))
+        for target, source in cls.WRAP_METHODS.items():
+            owner = next((k for k in cls.__mro__ if target in vars(k)), None)
+            # re-alias if target is an alias installed for a base class
+            if (owner is None
+                    or vars(owner)[target] is getattr(owner, source, None)):
+                setattr(cls, target, getattr(cls, source))
 
     async def wait_ready(self):
-        '''Wait for connection made event if needed.'''
+        '''Wait for tls handshake and connection made event if needed.'''
+        if self._tls is not None:
+            await self._tls.wait_handshake()
         if hasattr(self, 'conn_made_event'):
             await self.conn_made_event.wait()
 
+    @property
+    def recv_size(self) -> int:
+        '''Size passed to the next recv call.'''
+        sizer = self._recv_sizer
+        return self.MAX_SIZE if sizer is None else sizer.size
+
+    def get_recv_stats(self) -> Dict[str, float]:
+        '''Read statistics, useful to tune memory usage vs syscall count.'''
+        stats = {
+            'recv_size': self.recv_size,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+        }
+        sizer = self._recv_sizer
+        if sizer is not None:
+            stats['average'] = sizer.average
+            stats['grows'] = sizer.grows
+            stats['shrinks'] = sizer.shrinks
+        return stats
+
+    @property
+    def ssl_object(self) -> Optional[_ssl.SSLObject]:
+        return self._tls.sslobj if self._tls is not None else None
+
+    def get_write_buffer_size(self) -> int:
+        size = len(self.write_buffer)
+        if self._tls is not None:
+            size += self._tls.pending_size
+        if self._sendfile_deferred is not None:
+            size += len(self._sendfile_deferred)
+        return size
+
+    def close(self, exc=None):
+        tls = self._tls
+        if (tls is not None and tls.handshake_done
+                and self.state < self.STATE.CLOSING):
+            # best effort to send close_notify
+            if tls.pending:
+                self.flush()
+            if self.state < self.STATE.CLOSING:
+                self._sock_write(tls.unwrap())
+        super().close(exc)
+
+    def graceful_shutdown(self, reason=None):
+        '''Shut the write side down once buffered data is sent.
+
+        Unlike :meth:`shutdown`, which drops the data still buffered.
+        '''
+        if self.write_shutdown or self.state >= self.STATE.CLOSING:
+            return
+        self.write_shutdown = True
+        self.logger.debug(f'{self!r} graceful shutdown reason={reason!r}')
+        self.flush()
+        if not self.get_write_buffer_size() and not self._sending_file:
+            self._shutdown_write()
+
+    def _shutdown_write(self):
+        try:
+            self.shutdown()
+        except OSError as exc:
+            # e.g. reset by peer meanwhile
+            self._force_close(exc)
+
+    def cork(self):
+        '''Buffer all following writes until :meth:`uncork` is called.
+
+        While corked, writes are coalesced and flushed by one send syscall at
+        the end of current loop iteration, or as soon as `CORK_THRESHOLD`
+        bytes are buffered.
+        '''
+        self.corked = True
+
+    def uncork(self):
+        '''Stop corking and flush buffered data right now.'''
+        self.corked = False
+        self.flush()
+
+    @contextmanager
+    def corked_writes(self):
+        '''Context manager version of :meth:`cork`/:meth:`uncork`.
+
+        .. code-block:: python
+
+            with stream.corked_writes():
+                for message in messages:
+                    stream.write_sync(message)
+        '''
+        corked = self.corked
+        self.corked = True
+        try:
+            yield self
+        finally:
+            self.corked = corked
+            if not corked:
+                self.flush()
+
+    def flush(self):
+        '''Try to send out buffered data right now.
+
+        Data not sent will be handled by write io Callable.
+        '''
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._sock is None:
+            return
+        tls = self._tls
+        if tls is not None:
+            # batch the encryption of all corked data
+            if tls.pending and tls.handshake_done:
+                self._sock_write(tls.encrypt_pending())
+            return
+        if self.write_buffer:
+            self._start_writing()
+
+    def _start_writing(self):
+        '''Send buffered data now, register write io Callable if not all sent.
+        '''
+        self._writer()
+        if self.write_buffer:
+            self._loop.add_writer(self._sock_fd, self._writer)
+
     def _write_sync(self, data: DataType) -> bool:
         '''Write data to low level socket, in a synchronized way.
 
@@ -67,6 +276,56 @@ class Stream(SocketTransport):
 
         :returns: bool, indicate whether sent out all data this time or not.
         '''
+        if self._sending_file:
+            # keep order, will be written after the file
+            self._sendfile_deferred.extend(data)
+            self._maybe_pause_writing()
+            return False
+        tls = self._tls
+        if tls is not None:
+            if self.corked or not tls.handshake_done:
+                # plaintext, will be encrypted all together by flush
+                tls.add_pending(data)
+                if tls.handshake_done:
+                    self._cork_written()
+                else:
+                    self._maybe_pause_writing()
+                return False
+            data = tls.encrypt(data)
+        elif self.corked:
+            self.write_buffer.extend(data)
+            self._cork_written()
+            return False
+        return self._sock_write(data)
+
+    def _writelines_sync(self, segments: Sequence[DataType]) -> bool:
+        '''Write `segments` in order, same as `write_sync` of their join.
+
+        Segments are not concatenated, they are sent by one vectored send
+        if possible, otherwise copied into write_buffer one by one.
+
+        :returns: bool, indicate whether sent out all data this time or not.
+        '''
+        if self._sending_file or self._tls is not None:
+            # deferred data is kept in order, tls encrypts one record
+            return self._write_sync(b''.join(segments))
+        if self.corked:
+            write_buffer = self.write_buffer
+            for data in segments:
+                write_buffer.extend(data)
+            self._cork_written()
+            return False
+        return self._sock_writelines(segments)
+
+    def _cork_written(self):
+        self._maybe_pause_writing()
+        if self.get_write_buffer_size() >= self.CORK_THRESHOLD:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self.flush)
+
+    def _sock_write(self, data: DataType) -> bool:
+        '''Write raw data to socket, data is already encrypted if needed.'''
         if not self.write_buffer:
             # Optimization: try to send now.
             try:
@@ -79,16 +338,54 @@ class Stream(SocketTransport):
                 self._fatal_error(exc, 'Fatal write error on socket transport')
                 return
             else:
-                data = data[n:]
-                if not data:
+                if n == len(data):
                     if self.state == self.STATE.CLOSING:
                         self._loop.call_soon(self._finnal_close, None)
                     return True
+                # slice by memoryview, let write_buffer decide to copy or not
+                data = memoryview(data)[n:]
             # Not all was written; register write handler.
             self._loop.add_writer(self._sock_fd, self._writer)
 
         # Add it to the buffer.
         self.write_buffer.extend(data)
+        self._maybe_pause_writing()
+        return False
+
+    def _sock_writelines(self, segments: Sequence[DataType]) -> bool:
+        '''Write raw segments to socket by `sock.sendmsg`.'''
+        sent = 0
+        if (not self.write_buffer and HAS_SENDMSG
+                and len(segments) <= IOV_MAX):
+            try:
+                sent = self._sock.sendmsg(segments)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except BaseException as exc:
+                self._fatal_error(exc, 'Fatal write error on socket transport')
+                return
+            if sent == sum(map(len, segments)):
+                if self.state == self.STATE.CLOSING:
+                    self._loop.call_soon(self._finnal_close, None)
+                return True
+            # Not all was written; register write handler.
+            self._loop.add_writer(self._sock_fd, self._writer)
+        elif not self.write_buffer:
+            return self._sock_write(b''.join(segments))
+
+        write_buffer = self.write_buffer
+        for data in segments:
+            if sent:
+                size = len(data)
+                if sent >= size:
+                    sent -= size
+                    continue
+                data = memoryview(data)[sent:]
+                sent = 0
+            write_buffer.extend(data)
+        self._maybe_pause_writing()
         return False
 
     async def _write(self, data: DataType):
@@ -101,10 +398,29 @@ class Stream(SocketTransport):
         Will try to call await on the :meth:`wait_write_all` to wait for all
         buffered data to send.
 
+        When corked, only wait if buffered data reached `CORK_THRESHOLD`.
+
         .. _handle backpressure correctly: https://vorpus.org/blog/some-thoughts-on-asynchronous-api-design-in-a-post-asyncawait-world/#bug-1-backpressure  # noqa
         '''
         if not self._write_sync(data):
-            await self.wait_write_all()
+            await self._wait_written()
+
+    async def _writelines(self, segments: Sequence[DataType]):
+        '''Asynchronized version of :meth:`_writelines_sync`.
+
+        Backpressure is handled the same as :meth:`_write`.
+        '''
+        if not self._writelines_sync(segments):
+            await self._wait_written()
+
+    async def _wait_written(self):
+        if self._sending_file:
+            # deferred data is sent after the file
+            await self.drain()
+            return
+        if self.corked and self.get_write_buffer_size() < self.CORK_THRESHOLD:
+            return
+        await self.wait_write_all()
 
     async def wait_write_all(self, timeout=None):
         '''Wait for all buffered data to send.
@@ -115,6 +431,9 @@ class Stream(SocketTransport):
             cancel this method if sending not finished after that time. It is
             always relative to the current time.
         '''
+        tls = self._tls
+        if tls is not None and not tls.handshake_done:
+            await tls.wait_handshake()
         if not self.write_buffer:
             return
         if self._write_empty_waiter is not None:
@@ -133,6 +452,55 @@ class Stream(SocketTransport):
                 timer.cancel()
             self._write_empty_waiter = None
 
+    async def sendfile(
+        self,
+        file: io.IOBase,
+        offset: int = 0,
+        count: Optional[int] = None,
+    ) -> int:
+        '''Send `count` bytes of `file` starting from `offset`.
+
+        Uses zero-copy `os.sendfile` when possible, otherwise falls back to
+        chunked reads through a read-only mmap of the file (or plain reads if
+        file can not be mapped). TLS streams always use the fallback.
+
+        Data written before is sent first, data written during sending is
+        deferred and written right after the file. Like :meth:`wait_write_all`,
+        this returns only when the whole file has been handed to the kernel.
+
+        :params count: number of bytes to send, default to the end of file.
+        :returns: int, number of bytes sent, file position is updated too.
+        '''
+        if count is not None and count <= 0:
+            return 0
+        if self._sending_file:
+            raise RuntimeError('cannot call sendfile multiple times at once')
+        # keep data written before in order
+        self.flush()
+        await self.wait_write_all()
+
+        sent = None
+        self._sending_file = True
+        self._sendfile_deferred = bytearray()
+        try:
+            if self._tls is None and HAS_SENDFILE:
+                sent = await self._sendfile_native(file, offset, count)
+            if sent is None:
+                sent = 0
+                sent = await self._sendfile_fallback(file, offset, count)
+            return sent
+        finally:
+            self._sending_file = False
+            deferred, self._sendfile_deferred = self._sendfile_deferred, None
+            if self._sock is not None:
+                if deferred:
+                    self._write_sync(deferred)
+                self._maybe_resume_writing()
+                if self.write_shutdown and not self.write_buffer:
+                    self._shutdown_write()
+            if sent and hasattr(file, 'seek'):
+                file.seek(offset + sent)
+
     # Public api for upper usage.
     @abc.abstractmethod
     def data_received(self, data: DataType):
@@ -165,8 +533,14 @@ class Stream(SocketTransport):
         self.logger.debug(f'{self!r} now ready to work')
 
     def _reader(self):
+        sizer = self._recv_sizer
+        size = self.MAX_SIZE if sizer is None else sizer.size
         try:
-            data = self._sock.recv(self.MAX_SIZE)
+            if self.RECV_INTO:
+                arena = get_recv_arena(size)
+                data = arena[:self._sock.recv_into(arena, size)]
+            else:
+                data = self._sock.recv(size)
         except (BlockingIOError, InterruptedError):
             return
         except (SystemExit, KeyboardInterrupt):
@@ -175,32 +549,48 @@ class Stream(SocketTransport):
             self._fatal_error(exc, 'Fatal read error on socket transport')
             return
 
+        self._process_read(data)
+
+    def _process_read(self, data: DataType):
         if not data:
-            try:
-                if self.eof_received() and not self.state < self.STATE.CLOSING:
-                    # We're keeping the connection open so can write more,
-                    # but we still can't receive more, so remove the reader.
-                    self._loop.remove_reader(self._sock_fd)
-                else:
-                    self.close()
-            except (SystemExit, KeyboardInterrupt):
-                raise
-            except BaseException as exc:
-                self._fatal_error(exc, 'Fatal error: eof_received() failed.')
+            self._eof_received()
             return
 
+        sizer = self._recv_sizer
+        n = len(data)
+        self.reads += 1
+        self.bytes_read += n
+        if sizer is not None:
+            sizer.update(n)
+
         try:
-            self._data_received(data)
+            if self._tls is None:
+                self._data_received(data)
+            else:
+                self._tls_data_received(data)
         except (SystemExit, KeyboardInterrupt):
             raise
         except BaseException as exc:
             self._fatal_error(exc, 'Fatal error: data_received() call failed.')
 
+    def _eof_received(self):
+        try:
+            if self.eof_received() and not self.state < self.STATE.CLOSING:
+                # We're keeping the connection open so can write more,
+                # but we still can't receive more, so remove the reader.
+                self._loop.remove_reader(self._sock_fd)
+            else:
+                self.close()
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            self._fatal_error(exc, 'Fatal error: eof_received() failed.')
+
     def _writer(self):
         assert self.write_buffer, 'data should not be empty'
 
         try:
-            n = self._sock.send(self.write_buffer)
+            self.write_buffer.send(self._sock)
         except (BlockingIOError, InterruptedError):
             pass
         except (SystemExit, KeyboardInterrupt):
@@ -208,15 +598,232 @@ class Stream(SocketTransport):
         except BaseException as exc:
             self._fatal_error(exc, 'Fatal write error on socket transport')
         else:
-            if n:
-                del self.write_buffer[:n]
+            self._maybe_resume_writing()
             if not self.write_buffer:
                 self._loop.remove_writer(self._sock_fd)
-                if self._write_empty_waiter:
-                    self._write_empty_waiter.set_result(None)
-                    self._write_empty_waiter = None
-                if self.state == self.STATE.CLOSING:
-                    self._finnal_close(None)
+                self._write_flushed()
+
+    def _write_flushed(self):
+        '''Called once all buffered data is sent.'''
+        if self._write_empty_waiter:
+            self._write_empty_waiter.set_result(None)
+            self._write_empty_waiter = None
+        if self.state == self.STATE.CLOSING:
+            self._finnal_close(None)
+        elif self.write_shutdown and not self._sending_file:
+            self._shutdown_write()
+
+    # sendfile
+    async def _sendfile_native(
+        self, file: io.IOBase, offset: int, count: Optional[int],
+    ) -> Optional[int]:
+        '''Send file by os.sendfile, returns None if it is not supported.'''
+        try:
+            fileno = file.fileno()
+            size = os.fstat(fileno).st_size
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            return None
+        if count is None:
+            count = size - offset
+        count = min(count, size - offset)
+        chunk_size = self.SENDFILE_CHUNK_SIZE
+        sent = 0
+        while sent < count:
+            try:
+                n = os.sendfile(
+                    self._sock_fd,
+                    fileno,
+                    offset + sent,
+                    min(count - sent, chunk_size),
+                )
+            except (BlockingIOError, InterruptedError):
+                await self._wait_writable()
+                continue
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except OSError as exc:
+                if not sent and exc.errno in SENDFILE_UNSUPPORTED_ERRNOS:
+                    return None
+                self._fatal_error(exc, 'Fatal sendfile error on socket')
+                raise
+            if not n:
+                # file was truncated
+                break
+            sent += n
+        return sent
+
+    async def _sendfile_fallback(
+        self, file: io.IOBase, offset: int, count: Optional[int],
+    ) -> int:
+        chunk_size = self.SENDFILE_CHUNK_SIZE
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, io.UnsupportedOperation, ValueError, OSError):
+            # e.g. pipes, empty files or in memory files
+            mapped = None
+
+        if mapped is not None:
+            with mapped:
+                end = len(mapped)
+                if count is not None:
+                    end = min(end, offset + count)
+                pos = offset
+                while pos < end:
+                    # slicing mmap copies, so there is no exported buffer
+                    # left when closing it
+                    chunk = mapped[pos:min(pos + chunk_size, end)]
+                    await self._sendfile_write(chunk)
+                    pos += len(chunk)
+                return max(end - offset, 0)
+
+        file.seek(offset)
+        sent = 0
+        while count is None or sent < count:
+            size = chunk_size if count is None else min(
+                chunk_size, count - sent
+            )
+            chunk = file.read(size)
+            if not chunk:
+                break
+            await self._sendfile_write(chunk)
+            sent += len(chunk)
+        return sent
+
+    async def _sendfile_write(self, data: DataType):
+        if self._sock is None:
+            raise ConnectionResetError('Connection lost')
+        # we are the one allowed to write now
+        self._sending_file = False
+        try:
+            done = self._write_sync(data)
+        finally:
+            self._sending_file = True
+        if not done:
+            self.flush()
+            await self.wait_write_all()
+
+    async def _wait_writable(self):
+        self._sendfile_waiter = waiter = self._loop.create_future()
+        self._loop.add_writer(self._sock_fd, self._sendfile_writable)
+        try:
+            await waiter
+        finally:
+            self._sendfile_waiter = None
+            if self._sock is not None:
+                self._loop.remove_writer(self._sock_fd)
+
+    def _sendfile_writable(self):
+        waiter = self._sendfile_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    # tls
+    def _start_tls(self):
+        ssl_context = self.ssl_context
+        session = server_hostname = None
+        if self.initiative:
+            if ssl_context is True:
+                ssl_context = self.ssl_context = _ssl.create_default_context()
+            if self.uri is not None and self.uri.host:
+                server_hostname = self.uri.host
+            session = get_session(ssl_context, self._tls_session_key)
+        elif ssl_context is True:
+            raise ValueError('server side requires a ssl.SSLContext')
+        self._tls = TLSLayer(
+            ssl_context,
+            server_side=not self.initiative,
+            server_hostname=server_hostname,
+            session=session,
+        )
+        self._tls_timer = self._loop.call_later(
+            self.ssl_handshake_timeout or SSL_HANDSHAKE_TIMEOUT,
+            self._tls_handshake_timeout,
+        )
+        if self.initiative:
+            self._tls_handshake()
+
+    @property
+    def _tls_session_key(self):
+        return (self.uri and self.uri.host, self.peername)
+
+    def _tls_handshake(self):
+        tls = self._tls
+        try:
+            done = tls.do_handshake()
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            tls.set_exception(exc)
+            self._fatal_error(exc, 'TLS handshake failed')
+            return
+        outgoing = tls.read_outgoing()
+        if outgoing:
+            self._sock_write(outgoing)
+        if not done:
+            return
+        self._tls_timer.cancel()
+        self._tls_timer = None
+        self.logger.debug(
+            f'{self!r} tls handshake done, version={tls.sslobj.version()} '
+            f'session_reused={tls.sslobj.session_reused}'
+        )
+        self._save_tls_session()
+        if tls.pending and not self.corked:
+            self.flush()
+
+    def _tls_handshake_timeout(self):
+        self._tls_timer = None
+        exc = ConnectionAbortedError(
+            f'SSL handshake is taking longer than '
+            f'{self.ssl_handshake_timeout or SSL_HANDSHAKE_TIMEOUT} seconds'
+        )
+        self._tls.set_exception(exc)
+        self._force_close(exc)
+
+    def _tls_data_received(self, data: DataType):
+        tls = self._tls
+        if not tls.handshake_done:
+            tls.incoming.write(data)
+            self._tls_handshake()
+            if not tls.handshake_done or self.state >= self.STATE.CLOSED:
+                return
+            data = b''
+        data, eof = tls.feed_data(data, self.MAX_SIZE)
+        # e.g. key update or session tickets
+        outgoing = tls.read_outgoing()
+        if outgoing:
+            self._sock_write(outgoing)
+        if data:
+            self._data_received(data)
+        if eof and self.state < self.STATE.CLOSING:
+            self._eof_received()
+
+    def _save_tls_session(self):
+        session = self._tls.sslobj.session
+        if self.initiative and session is not None:
+            set_session(self.ssl_context, self._tls_session_key, session)
+
+    def _finnal_close(self, exc=None):
+        waiter = self._sendfile_waiter
+        if waiter is not None:
+            self._loop.remove_writer(self._sock_fd)
+            if not waiter.done():
+                waiter.set_exception(
+                    exc or ConnectionResetError('Connection lost')
+                )
+        tls = self._tls
+        if tls is not None:
+            if self._tls_timer is not None:
+                self._tls_timer.cancel()
+                self._tls_timer = None
+            if tls.handshake_done:
+                # tls 1.3 session tickets arrive after handshake
+                self._save_tls_session()
+            else:
+                tls.set_exception(exc or ConnectionResetError('closed'))
+        super()._finnal_close(exc)
+
 
+Stream.wrap_methods()
 
 StreamType = TypeVar('StreamType', bound=Stream)
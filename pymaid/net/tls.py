@@ -0,0 +1,168 @@
+'''TLS support for transports, built on `ssl.MemoryBIO`.
+
+The socket is never wrapped, transports feed raw data into :class:`TLSLayer`
+and send out whatever it produced, so TLS works with any readiness based
+transport, and encryption can be batched.
+'''
+
+import ssl as _ssl
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from pymaid.core import Event
+from pymaid.types import DataType
+
+# same as asyncio
+SSL_HANDSHAKE_TIMEOUT = 60.0
+# max number of resumable sessions kept per ssl context
+MAX_SESSIONS = 1024
+
+_sessions = WeakKeyDictionary()
+
+
+def get_session(
+    context: _ssl.SSLContext, key: Tuple,
+) -> Optional[_ssl.SSLSession]:
+    '''Return the cached client session of `key` for resumption.'''
+    sessions = _sessions.get(context)
+    if sessions is None:
+        return None
+    return sessions.get(key)
+
+
+def set_session(
+    context: _ssl.SSLContext, key: Tuple, session: _ssl.SSLSession,
+):
+    sessions = _sessions.get(context)
+    if sessions is None:
+        sessions = _sessions[context] = OrderedDict()
+    sessions[key] = session
+    sessions.move_to_end(key)
+    while len(sessions) > MAX_SESSIONS:
+        sessions.popitem(last=False)
+
+
+class TLSLayer:
+    '''TLS state machine of one connection.
+
+    Incoming ciphertext is fed by :meth:`feed_data`, outgoing ciphertext is
+    collected by :meth:`encrypt` and :meth:`read_outgoing`.
+    Plaintext written before handshake finished, or written while corked,
+    is kept in `pending` and encrypted as a whole by :meth:`encrypt_pending`.
+    '''
+
+    def __init__(
+        self,
+        context: _ssl.SSLContext,
+        *,
+        server_side: bool,
+        server_hostname: Optional[str] = None,
+        session: Optional[_ssl.SSLSession] = None,
+    ):
+        self.incoming = _ssl.MemoryBIO()
+        self.outgoing = _ssl.MemoryBIO()
+        self.sslobj = context.wrap_bio(
+            self.incoming,
+            self.outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+        self.handshake_done = False
+        self.handshake_event = Event()
+        self.exc = None
+
+        self.pending = []
+        self.pending_size = 0
+
+    def do_handshake(self) -> bool:
+        '''Step the handshake.
+
+        :returns: bool, whether handshake has finished.
+        '''
+        try:
+            self.sslobj.do_handshake()
+        except _ssl.SSLWantReadError:
+            return False
+        self.handshake_done = True
+        self.handshake_event.set()
+        return True
+
+    def set_exception(self, exc: Exception):
+        if self.handshake_event.is_set():
+            return
+        self.exc = exc
+        self.handshake_event.set()
+
+    async def wait_handshake(self):
+        await self.handshake_event.wait()
+        if self.exc is not None:
+            raise self.exc
+
+    def feed_data(self, data: DataType, size: int) -> Tuple[bytes, bool]:
+        '''Decrypt incoming data.
+
+        :returns: tuple of plaintext and whether peer sent close_notify.
+        '''
+        self.incoming.write(data)
+        read = self.sslobj.read
+        chunks = []
+        eof = False
+        while 1:
+            try:
+                chunk = read(size)
+            except _ssl.SSLWantReadError:
+                break
+            except _ssl.SSLZeroReturnError:
+                eof = True
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+        if len(chunks) == 1:
+            return chunks[0], eof
+        return b''.join(chunks), eof
+
+    def encrypt(self, data: DataType) -> bytes:
+        view = memoryview(data)
+        write = self.sslobj.write
+        # memory bio never blocks, but write is limited by record size
+        while view:
+            view = view[write(view):]
+        return self.outgoing.read()
+
+    def add_pending(self, data: DataType):
+        # copy, caller may reuse the buffer
+        data = bytes(data)
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+    def encrypt_pending(self) -> bytes:
+        pending = self.pending
+        if len(pending) == 1:
+            data = pending[0]
+        else:
+            data = b''.join(pending)
+        pending.clear()
+        self.pending_size = 0
+        return self.encrypt(data)
+
+    def read_outgoing(self) -> bytes:
+        return self.outgoing.read()
+
+    def unwrap(self) -> bytes:
+        '''Start TLS shutdown, returns the close_notify alert to be sent.'''
+        try:
+            self.sslobj.unwrap()
+        except (_ssl.SSLWantReadError, _ssl.SSLError):
+            pass
+        return self.outgoing.read()
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'handshake_done={self.handshake_done} '
+            f'pending={self.pending_size}>'
+        )
@@ -2,11 +2,13 @@ import abc
 import socket
 import warnings
 
-from typing import Callable, List, Optional, TypeVar
+from collections import deque
+from typing import Callable, List, Optional, Tuple, TypeVar
 
 from pymaid.core import get_running_loop, Event
 
 from .base import logger, TransportState
+from .buffer import WriteBuffer
 
 
 class PipeTransport(abc.ABCMeta):
@@ -30,8 +32,31 @@ class PipeTransport(abc.ABCMeta):
         )
 
 
+class SocketAttribute:
+    '''Resolve an attribute of the wrapped socket on access.
+
+    Used instead of copying socket attributes onto every transport instance.
+    '''
+
+    __slots__ = ('name',)
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+
+    def __set_name__(self, owner, name: str):
+        if self.name is None:
+            self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance._sock, self.name)
+
+
 class Transport(metaclass=PipeTransport):
 
+    __slots__ = ()
+
     logger = logger
     ID = 0
 
@@ -53,13 +78,28 @@ class SocketTransport(Transport):
 
     Wraps low level socket.
     Wrapped some attrs and methods, added some apis like `asyncio` `protocols`.
+
+    Instances are slotted, subclasses can declare `__slots__` as well to avoid
+    the per instance `__dict__` when holding lots of connections.
     '''
 
+    __slots__ = (
+        '_loop', '_sock', '_sock_fd', 'id', 'peername', 'sockname',
+        'on_open', 'on_close', 'state', 'write_buffer', 'writing_paused',
+        'reading_paused', '_high_water', '_low_water', '_drain_waiters',
+        '_closed_event', '__weakref__',
+    )
+
+    # resolved from the socket by :class:`SocketAttribute` on access
     WRAPPED_ATTRS = ('family', 'proto', 'timeout', 'type')
     WRAPPED_METHODS = ('getsockopt', 'setsockopt')
     STATE = TransportState
 
-    BUFFER_FACTORY = bytearray
+    # `WriteBuffer` or `WriteQueue`, see :mod:`pymaid.net.buffer`
+    BUFFER_FACTORY = WriteBuffer
+    # default write buffer limits, see :meth:`set_write_buffer_limits`
+    WRITE_HIGH_WATER = 64 * 1024
+    WRITE_LOW_WATER = 16 * 1024
 
     def __init__(
         self,
@@ -75,20 +115,34 @@ class SocketTransport(Transport):
 
         self.on_open = on_open or []
         self.on_close = on_close or []
-        self.closed_event = Event()
+        # created on demand, most connections never wait for them
+        self._closed_event = None
+        self._drain_waiters = None
         self.state = self.STATE.OPENED
         self.write_buffer = self.BUFFER_FACTORY()
+        self.writing_paused = False
+        self.reading_paused = False
+        self._high_water = self.WRITE_HIGH_WATER
+        self._low_water = self.WRITE_LOW_WATER
         self.init()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.wrap_sock_attributes()
+
+    @classmethod
+    def wrap_sock_attributes(cls):
+        '''Install :class:`SocketAttribute` for `WRAPPED_*` names.'''
+        for name in (*cls.WRAPPED_ATTRS, *cls.WRAPPED_METHODS):
+            if not hasattr(cls, name):
+                setattr(cls, name, SocketAttribute(name))
+
     def init(self):
         pass
 
     def wrap_sock(self, sock: socket.socket):
         self._sock = sock
         self._sock_fd = sock.fileno()
-        self._wrap_sock(self.WRAPPED_ATTRS)
-        self._wrap_sock(self.WRAPPED_METHODS)
-
         self.peername = sock.getpeername()
         self.sockname = sock.getsockname()
         self._loop.add_reader(self._sock_fd, self._reader)
@@ -98,7 +152,7 @@ class SocketTransport(Transport):
         self._sock.shutdown(socket.SHUT_WR)
 
     def close(self, exc=None):
-        if self.state == self.STATE.CLOSING:
+        if self.state >= self.STATE.CLOSING:
             return
         self.logger.debug(f'{self!r} close exc={exc}')
         self.state = self.STATE.CLOSING
@@ -110,12 +164,139 @@ class SocketTransport(Transport):
             # loop.call_soon(self._finnal_close, None)
             self._finnal_close(exc)
 
+    @property
+    def closed_event(self) -> Event:
+        event = self._closed_event
+        if event is None:
+            event = self._closed_event = Event()
+            if self.state == self.STATE.CLOSED:
+                event.set()
+        return event
+
     async def wait_closed(self):
         await self.closed_event.wait()
 
-    def _wrap_sock(self, keys: List[str]):
-        for key in keys:
-            setattr(self, key, getattr(self._sock, key))
+    # flow control, mostly the same as `asyncio` transports
+    def set_write_buffer_limits(
+        self, high: Optional[int] = None, low: Optional[int] = None,
+    ):
+        '''Set the high- and low-water limits for write flow control.
+
+        :meth:`pause_writing` is called once the write buffer grows above
+        `high`, :meth:`resume_writing` is called once it drains to `low`.
+        If only `high` is given, `low` defaults to a quarter of it.
+        '''
+        if high is None:
+            high = self.WRITE_HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError(
+                f'high ({high!r}) must be >= low ({low!r}) must be >= 0'
+            )
+        self._high_water = high
+        self._low_water = low
+        self._maybe_pause_writing()
+        self._maybe_resume_writing()
+
+    def get_write_buffer_limits(self) -> Tuple[int, int]:
+        return self._low_water, self._high_water
+
+    def get_write_buffer_size(self) -> int:
+        return len(self.write_buffer)
+
+    def pause_writing(self):
+        '''Called when the write buffer goes over the high-water mark.
+
+        Override it to stop producing data, e.g. stop calling `write_sync`.
+        '''
+
+    def resume_writing(self):
+        '''Called when the write buffer drains below the low-water mark.'''
+
+    async def drain(self):
+        '''Wait until the write buffer drains below the low-water mark.
+
+        Returns immediately if writing is not paused.
+        '''
+        if self.state >= self.STATE.CLOSED:
+            raise ConnectionResetError('Connection lost')
+        if not self.writing_paused:
+            return
+        waiters = self._drain_waiters
+        if waiters is None:
+            waiters = self._drain_waiters = deque()
+        waiter = self._loop.create_future()
+        waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in waiters:
+                waiters.remove(waiter)
+
+    def pause_reading(self):
+        '''Stop reading from the socket until :meth:`resume_reading`.
+
+        Peer will be throttled by tcp flow control once kernel buffer is full.
+        '''
+        if self.reading_paused or self.state >= self.STATE.CLOSING:
+            return
+        self.reading_paused = True
+        self._loop.remove_reader(self._sock_fd)
+        self.logger.debug(f'{self!r} pause reading')
+
+    def resume_reading(self):
+        if not self.reading_paused or self.state >= self.STATE.CLOSING:
+            return
+        self.reading_paused = False
+        self._loop.add_reader(self._sock_fd, self._reader)
+        self.logger.debug(f'{self!r} resume reading')
+
+    def _maybe_pause_writing(self):
+        if (self.writing_paused
+                or self.get_write_buffer_size() <= self._high_water):
+            return
+        self.writing_paused = True
+        try:
+            self.pause_writing()
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            self._loop.call_exception_handler({
+                'message': 'transport pause_writing() failed',
+                'exception': exc,
+                'transport': self,
+            })
+
+    def _maybe_resume_writing(self):
+        if (not self.writing_paused
+                or self.get_write_buffer_size() > self._low_water):
+            return
+        self.writing_paused = False
+        try:
+            self.resume_writing()
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            self._loop.call_exception_handler({
+                'message': 'transport resume_writing() failed',
+                'exception': exc,
+                'transport': self,
+            })
+        self._wakeup_drain_waiters()
+
+    def _wakeup_drain_waiters(self, exc: Optional[Exception] = None):
+        waiters = self._drain_waiters
+        if waiters is None:
+            return
+        while waiters:
+            waiter = waiters.popleft()
+            if waiter.done():
+                continue
+            if exc is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exc)
 
     def _reader(self):
         raise NotImplementedError('_reader')
@@ -134,6 +315,8 @@ class SocketTransport(Transport):
     def _finnal_close(self, exc=None):
         self.logger.info(f'{self!r} final close exc={exc}')
         self.state = self.STATE.CLOSED
+        if self._drain_waiters:
+            self._wakeup_drain_waiters(ConnectionResetError('Connection lost'))
         for cb in self.on_close:
             cb(self, exc)
         self._sock.close()
@@ -141,7 +324,8 @@ class SocketTransport(Transport):
         self._loop = None
         del self.on_open
         del self.on_close
-        self.closed_event.set()
+        if self._closed_event is not None:
+            self._closed_event.set()
 
     def __del__(self, _warn=warnings.warn):
         if getattr(self, '_sock', None):
@@ -162,4 +346,6 @@ class SocketTransport(Transport):
         )
 
 
+SocketTransport.wrap_sock_attributes()
+
 TransportType = TypeVar('TransportType', bound=Transport)
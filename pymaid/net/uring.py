@@ -0,0 +1,721 @@
+'''Completion based io by linux `io_uring`, through raw syscalls by `ctypes`.
+
+:class:`UringStream` and :class:`UringStreamChannel` are drop-in replacements
+of :class:`~pymaid.net.stream.Stream` and
+:class:`~pymaid.net.channel.StreamChannel`, e.g.:
+
+.. code-block:: python
+
+    await pymaid.net.serve_stream(
+        address,
+        channel_class=UringStreamChannel,
+        transport_class=UringStream,
+    )
+
+Instead of readiness callbacks plus one `recv`/`send`/`accept` syscall per
+operation, operations are queued in the submission ring of the running loop,
+all of them queued in one loop iteration are submitted by a single
+`io_uring_enter`, and completions are reaped when the ring's eventfd becomes
+readable.
+
+When `io_uring` is not available (not linux, kernel older than 5.6, or
+disabled by seccomp/sysctl), both classes fall back to the readiness based
+implementation of their base classes.
+'''
+
+import ctypes
+import errno
+import mmap
+import os
+import socket
+import struct
+import sys
+
+from typing import Callable, Dict, Optional, Tuple
+
+from pymaid.core import get_running_loop
+
+from .base import logger
+from .channel import StreamChannel
+from .raw import ACCEPT_FLAGS, ACCEPT_RETRY_DELAY, ACCEPT_RETRY_ERRNOS
+from .stream import Stream
+
+__all__ = ('UringStream', 'UringStreamChannel', 'get_ring')
+
+# syscall numbers are shared by all architectures
+NR_IO_URING_SETUP = 425
+NR_IO_URING_ENTER = 426
+NR_IO_URING_REGISTER = 427
+
+IORING_SETUP_CQSIZE = 1 << 3
+IORING_FEAT_SINGLE_MMAP = 1 << 0
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_SQ_CQ_OVERFLOW = 1 << 1
+
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+
+IORING_REGISTER_EVENTFD = 4
+IORING_REGISTER_PROBE = 8
+IO_URING_OP_SUPPORTED = 1 << 0
+
+IORING_OP_ACCEPT = 13
+IORING_OP_ASYNC_CANCEL = 14
+IORING_OP_SEND = 26
+IORING_OP_RECV = 27
+REQUIRED_OPS = (
+    IORING_OP_ACCEPT, IORING_OP_ASYNC_CANCEL, IORING_OP_SEND, IORING_OP_RECV,
+)
+
+MSG_NOSIGNAL = getattr(socket, 'MSG_NOSIGNAL', 0)
+
+
+class _SQRingOffsets(ctypes.Structure):
+    _fields_ = [
+        ('head', ctypes.c_uint32),
+        ('tail', ctypes.c_uint32),
+        ('ring_mask', ctypes.c_uint32),
+        ('ring_entries', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('dropped', ctypes.c_uint32),
+        ('array', ctypes.c_uint32),
+        ('resv1', ctypes.c_uint32),
+        ('user_addr', ctypes.c_uint64),
+    ]
+
+
+class _CQRingOffsets(ctypes.Structure):
+    _fields_ = [
+        ('head', ctypes.c_uint32),
+        ('tail', ctypes.c_uint32),
+        ('ring_mask', ctypes.c_uint32),
+        ('ring_entries', ctypes.c_uint32),
+        ('overflow', ctypes.c_uint32),
+        ('cqes', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('resv1', ctypes.c_uint32),
+        ('user_addr', ctypes.c_uint64),
+    ]
+
+
+class _Params(ctypes.Structure):
+    _fields_ = [
+        ('sq_entries', ctypes.c_uint32),
+        ('cq_entries', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('sq_thread_cpu', ctypes.c_uint32),
+        ('sq_thread_idle', ctypes.c_uint32),
+        ('features', ctypes.c_uint32),
+        ('wq_fd', ctypes.c_uint32),
+        ('resv', ctypes.c_uint32 * 3),
+        ('sq_off', _SQRingOffsets),
+        ('cq_off', _CQRingOffsets),
+    ]
+
+
+# struct io_uring_sqe, fields: opcode, flags, ioprio, fd, off, addr, len,
+# op_flags, user_data, buf_index, personality, splice_fd_in, addr3, pad
+SQE = struct.Struct('=BBHiQQIIQHHiQQ')
+# struct io_uring_cqe, fields: user_data, res, flags
+CQE = struct.Struct('=QiI')
+
+
+class _ProbeOp(ctypes.Structure):
+    _fields_ = [
+        ('op', ctypes.c_uint8),
+        ('resv', ctypes.c_uint8),
+        ('flags', ctypes.c_uint16),
+        ('resv2', ctypes.c_uint32),
+    ]
+
+
+class _Probe(ctypes.Structure):
+    _fields_ = [
+        ('last_op', ctypes.c_uint8),
+        ('ops_len', ctypes.c_uint8),
+        ('resv', ctypes.c_uint16),
+        ('resv2', ctypes.c_uint32 * 3),
+        ('ops', _ProbeOp * 256),
+    ]
+
+
+_libc_syscall = None
+
+
+def _syscall(*args) -> int:
+    global _libc_syscall
+    if _libc_syscall is None:
+        # syscall(2) is variadic, but passing 7 longs is fine for the abi
+        _libc_syscall = ctypes.CDLL(None, use_errno=True).syscall
+        _libc_syscall.restype = ctypes.c_long
+        _libc_syscall.argtypes = [ctypes.c_long] * 7
+    ret = _libc_syscall(*args, *(0,) * (7 - len(args)))
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+def _address(data: bytes) -> int:
+    # pointer to the internal buffer of bytes, no copy
+    return ctypes.cast(data, ctypes.c_void_p).value
+
+
+class IoUring:
+    '''A minimal io_uring instance bound to an event loop.
+
+    Operations are submitted in batch at the end of current loop iteration,
+    completions are dispatched to the callbacks passed in when preparing.
+    '''
+
+    SQ_ENTRIES = 256
+    # every stream keeps a recv in flight, give completions enough room
+    CQ_ENTRIES = 8192
+
+    def __init__(self, loop):
+        if not hasattr(os, 'eventfd'):
+            raise OSError(errno.ENOSYS, 'io_uring requires python 3.10+')
+        self._loop = loop
+        params = _Params()
+        params.flags = IORING_SETUP_CQSIZE
+        params.cq_entries = self.CQ_ENTRIES
+        fd = self.fd = _syscall(
+            NR_IO_URING_SETUP, self.SQ_ENTRIES, ctypes.addressof(params)
+        )
+        self._efd = None
+        self._mmaps = []
+        try:
+            self._check_ops()
+            self._map_rings(params)
+            self._efd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            efd = ctypes.c_int32(self._efd)
+            _syscall(
+                NR_IO_URING_REGISTER, fd, IORING_REGISTER_EVENTFD,
+                ctypes.addressof(efd), 1,
+            )
+        except BaseException:
+            self.close()
+            raise
+
+        self._inflight: Dict[int, Tuple[Optional[Callable], object]] = {}
+        self._next_user_data = 1
+        self._submit_handle = None
+        loop.add_reader(self._efd, self._reap)
+
+    def _check_ops(self):
+        probe = _Probe()
+        _syscall(
+            NR_IO_URING_REGISTER, self.fd, IORING_REGISTER_PROBE,
+            ctypes.addressof(probe), 256,
+        )
+        for op in REQUIRED_OPS:
+            if (op > probe.last_op
+                    or not probe.ops[op].flags & IO_URING_OP_SUPPORTED):
+                raise OSError(errno.ENOSYS, f'io_uring op {op} not supported')
+
+    def _map_rings(self, params: _Params):
+        fd = self.fd
+        sq_off, cq_off = params.sq_off, params.cq_off
+        sq_size = sq_off.array + params.sq_entries * 4
+        cq_size = cq_off.cqes + params.cq_entries * CQE.size
+        if params.features & IORING_FEAT_SINGLE_MMAP:
+            sq_size = cq_size = max(sq_size, cq_size)
+        sq_ring = mmap.mmap(fd, sq_size, offset=IORING_OFF_SQ_RING)
+        self._mmaps.append(sq_ring)
+        if params.features & IORING_FEAT_SINGLE_MMAP:
+            cq_ring = sq_ring
+        else:
+            cq_ring = mmap.mmap(fd, cq_size, offset=IORING_OFF_CQ_RING)
+            self._mmaps.append(cq_ring)
+        sqes = mmap.mmap(
+            fd,
+            params.sq_entries * SQE.size,
+            offset=IORING_OFF_SQES,
+        )
+        self._mmaps.append(sqes)
+
+        self.sq_entries = params.sq_entries
+        self._sqes_map = sqes
+        self._cq_map = cq_ring
+        self._cqes_off = cq_off.cqes
+        sq_view = memoryview(sq_ring)
+        cq_view = memoryview(cq_ring)
+        self._views = views = [sq_view, cq_view]
+
+        def u32(view, offset, count=1):
+            field = view[offset:offset + 4 * count].cast('I')
+            views.append(field)
+            return field
+
+        self._sq_head = u32(sq_view, sq_off.head)
+        self._sq_tail = u32(sq_view, sq_off.tail)
+        self._sq_flags = u32(sq_view, sq_off.flags)
+        self._sq_mask = u32(sq_view, sq_off.ring_mask)[0]
+        self._sq_array = u32(sq_view, sq_off.array, params.sq_entries)
+        self._local_tail = self._sq_tail[0]
+
+        self._cq_head = u32(cq_view, cq_off.head)
+        self._cq_tail = u32(cq_view, cq_off.tail)
+        self._cq_mask = u32(cq_view, cq_off.ring_mask)[0]
+
+    def close(self):
+        if self.fd is None:
+            return
+        if self._efd is not None:
+            if not self._loop.is_closed():
+                self._loop.remove_reader(self._efd)
+            os.close(self._efd)
+            self._efd = None
+        # release the exported buffers before closing the mmaps
+        for view in reversed(getattr(self, '_views', ())):
+            view.release()
+        for mapped in self._mmaps:
+            mapped.close()
+        self._mmaps.clear()
+        os.close(self.fd)
+        self.fd = None
+
+    def prepare(
+        self,
+        opcode: int,
+        fd: int,
+        *,
+        addr: int = 0,
+        length: int = 0,
+        off: int = 0,
+        op_flags: int = 0,
+        callback: Optional[Callable[[int], None]] = None,
+        keep: object = None,
+    ) -> int:
+        '''Queue an operation, it will be submitted in batch.
+
+        :params callback: called with the result of the operation, negative
+            errno if failed.
+        :params keep: object referenced until operation completed, e.g.
+            the buffer used by kernel.
+        :returns: int, the user_data used to identify the operation.
+        '''
+        tail = self._local_tail
+        if (tail - self._sq_head[0]) & 0xffffffff >= self.sq_entries:
+            # submission ring is full
+            self.submit()
+        index = tail & self._sq_mask
+        user_data = self._next_user_data
+        self._next_user_data += 1
+        SQE.pack_into(
+            self._sqes_map, index * SQE.size,
+            opcode, 0, 0, fd, off, addr, length, op_flags, user_data,
+            0, 0, 0, 0, 0,
+        )
+        self._sq_array[index] = index
+        self._local_tail = (tail + 1) & 0xffffffff
+        if callback is not None:
+            self._inflight[user_data] = (callback, keep)
+        if self._submit_handle is None:
+            self._submit_handle = self._loop.call_soon(self.submit)
+        return user_data
+
+    def submit(self):
+        '''Submit all queued operations by one syscall.'''
+        if self._submit_handle is not None:
+            self._submit_handle.cancel()
+            self._submit_handle = None
+        if self.fd is None:
+            return
+        self._sq_tail[0] = self._local_tail
+        to_submit = (self._local_tail - self._sq_head[0]) & 0xffffffff
+        while to_submit:
+            try:
+                submitted = _syscall(
+                    NR_IO_URING_ENTER, self.fd, to_submit, 0, 0, 0, 0
+                )
+            except InterruptedError:
+                continue
+            except (BlockingIOError, OSError) as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EBUSY):
+                    raise
+                # completion queue is under pressure, reap and retry later
+                self._reap_completions()
+                self._submit_handle = self._loop.call_soon(self.submit)
+                return
+            to_submit -= submitted
+
+    def cancel(self, user_data: int, discard: bool = True):
+        '''Cancel an operation.
+
+        :params discard: if True, callback will not be called any more,
+            otherwise it is called with the result, e.g. `-ECANCELED`.
+        '''
+        entry = self._inflight.get(user_data)
+        if entry is None or entry[0] is None:
+            return
+        if discard:
+            # keep the buffer until kernel completes the operation
+            self._inflight[user_data] = (None, entry[1])
+        self.prepare(IORING_OP_ASYNC_CANCEL, -1, addr=user_data)
+
+    def recv(self, fd: int, buf: ctypes.Array, callback: Callable) -> int:
+        return self.prepare(
+            IORING_OP_RECV, fd, addr=ctypes.addressof(buf),
+            length=len(buf), callback=callback, keep=buf,
+        )
+
+    def send(self, fd: int, data: bytes, callback: Callable) -> int:
+        return self.prepare(
+            IORING_OP_SEND, fd, addr=_address(data), length=len(data),
+            op_flags=MSG_NOSIGNAL, callback=callback, keep=data,
+        )
+
+    def accept(self, fd: int, callback: Callable) -> int:
+        return self.prepare(
+            IORING_OP_ACCEPT, fd, op_flags=ACCEPT_FLAGS, callback=callback,
+        )
+
+    def _reap(self):
+        try:
+            os.eventfd_read(self._efd)
+        except BlockingIOError:
+            pass
+        self._reap_completions()
+
+    def _reap_completions(self):
+        cq_head, cq_tail = self._cq_head, self._cq_tail
+        mask, inflight = self._cq_mask, self._inflight
+        unpack_from, cq_map = CQE.unpack_from, self._cq_map
+        cqes_off = self._cqes_off
+        while 1:
+            head, tail = cq_head[0], cq_tail[0]
+            if head == tail:
+                if not self._sq_flags[0] & IORING_SQ_CQ_OVERFLOW:
+                    break
+                # flush completions kept by kernel due to overflow
+                _syscall(
+                    NR_IO_URING_ENTER, self.fd, 0, 0,
+                    IORING_ENTER_GETEVENTS, 0, 0,
+                )
+                if cq_head[0] == cq_tail[0]:
+                    break
+                continue
+            completed = []
+            while head != tail:
+                user_data, res, _ = unpack_from(
+                    cq_map, cqes_off + (head & mask) * CQE.size
+                )
+                callback, _ = inflight.pop(user_data, (None, None))
+                if callback is not None:
+                    completed.append((callback, res))
+                head = (head + 1) & 0xffffffff
+            cq_head[0] = head
+            for callback, res in completed:
+                try:
+                    callback(res)
+                except (SystemExit, KeyboardInterrupt):
+                    raise
+                except BaseException as exc:
+                    self._loop.call_exception_handler({
+                        'message': 'io_uring completion callback failed',
+                        'exception': exc,
+                    })
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} fd={self.fd} '
+            f'inflight={len(self._inflight)}>'
+        )
+
+
+_rings = {}
+_unavailable = None if sys.platform.startswith('linux') else OSError(
+    errno.ENOSYS, 'io_uring requires linux'
+)
+
+
+def get_ring(loop=None) -> Optional[IoUring]:
+    '''Return the ring of `loop`, or None if io_uring is not available.'''
+    global _unavailable
+    if _unavailable is not None:
+        return None
+    loop = loop or get_running_loop()
+    ring = _rings.get(loop)
+    if ring is None:
+        for stale in [lp for lp in _rings if lp.is_closed()]:
+            _rings.pop(stale).close()
+        try:
+            ring = _rings[loop] = IoUring(loop)
+        except OSError as exc:
+            logger.warning(f'io_uring is not available, fall back: {exc!r}')
+            _unavailable = exc
+            return None
+    return ring
+
+
+class UringStream(Stream):
+    '''Stream doing recv/send by io_uring, see :mod:`pymaid.net.uring`.
+
+    Every stream keeps one recv in flight into its own receive buffer, so
+    memory used by the buffers is `recv_size` per connection, consider
+    `ADAPTIVE_RECV`.
+    '''
+
+    __slots__ = ('_ring', '_recv_op', '_recv_buf', '_send_op', '_paused_data')
+
+    MAX_SIZE = 64 * 1024
+    # max bytes copied for one send, see :meth:`_send_chunk`
+    SEND_SIZE = 64 * 1024
+
+    def __init__(self, sock: socket.socket, **kwargs):
+        self._recv_op = self._send_op = None
+        self._recv_buf = self._paused_data = None
+        super().__init__(sock, **kwargs)
+        if self._ring is not None and self.state < self.STATE.CLOSING:
+            self._start_reading()
+
+    def wrap_sock(self, sock: socket.socket):
+        ring = self._ring = get_ring(self._loop)
+        if ring is None:
+            super().wrap_sock(sock)
+            return
+        self._sock = sock
+        self._sock_fd = sock.fileno()
+        self.peername = sock.getpeername()
+        self.sockname = sock.getsockname()
+
+    def pause_reading(self):
+        if self._ring is None:
+            super().pause_reading()
+            return
+        if self.reading_paused or self.state >= self.STATE.CLOSING:
+            return
+        # recv in flight is kept, data is held until resumed
+        self.reading_paused = True
+        self.logger.debug(f'{self!r} pause reading')
+
+    def resume_reading(self):
+        if self._ring is None:
+            super().resume_reading()
+            return
+        if not self.reading_paused or self.state >= self.STATE.CLOSING:
+            return
+        self.reading_paused = False
+        self.logger.debug(f'{self!r} resume reading')
+        data, self._paused_data = self._paused_data, None
+        if data is not None:
+            self._loop.call_soon(self._recv_done_data, data)
+        elif self._recv_op is None:
+            self._start_reading()
+
+    def _start_reading(self):
+        buf = self._recv_buf
+        size = self.recv_size
+        if buf is None or len(buf) != size:
+            buf = self._recv_buf = ctypes.create_string_buffer(size)
+        self._recv_op = self._ring.recv(self._sock_fd, buf, self._recv_done)
+
+    def _recv_done(self, res: int):
+        self._recv_op = None
+        if self._sock is None:
+            return
+        if res < 0:
+            if res == -errno.EINTR or res == -errno.EAGAIN:
+                self._start_reading()
+                return
+            exc = OSError(-res, os.strerror(-res))
+            self._fatal_error(exc, 'Fatal read error on socket transport')
+            return
+        data = ctypes.string_at(self._recv_buf, res)
+        if self.reading_paused:
+            self._paused_data = data
+            return
+        self._recv_done_data(data)
+
+    def _recv_done_data(self, data: bytes):
+        if self.state >= self.STATE.CLOSING and data:
+            return
+        self._process_read(data)
+        if (data and self._sock is not None and not self.reading_paused
+                and self.state < self.STATE.CLOSING
+                and self._recv_op is None):
+            self._start_reading()
+
+    def _sock_write(self, data) -> bool:
+        if self._ring is None:
+            return super()._sock_write(data)
+        self.write_buffer.extend(data)
+        self._maybe_pause_writing()
+        if self._send_op is None and self.write_buffer:
+            self._start_send()
+        return False
+
+    def _sock_writelines(self, segments) -> bool:
+        if self._ring is None:
+            return super()._sock_writelines(segments)
+        write_buffer = self.write_buffer
+        for data in segments:
+            write_buffer.extend(data)
+        self._maybe_pause_writing()
+        if self._send_op is None and self.write_buffer:
+            self._start_send()
+        return False
+
+    def _start_writing(self):
+        if self._ring is None:
+            super()._start_writing()
+        elif self._send_op is None:
+            self._start_send()
+
+    def _start_send(self):
+        self._send_op = self._ring.send(
+            self._sock_fd, self._send_chunk(), self._send_done
+        )
+
+    def _send_chunk(self) -> bytes:
+        '''Return the head of write_buffer to send.
+
+        Kernel reads it until the send completes, while write_buffer may
+        change meanwhile, so it is a snapshot kept by the ring. A whole
+        `bytes` buffer queued by `WriteQueue` is sent as it is, otherwise
+        no more than `SEND_SIZE` bytes are copied.
+        '''
+        write_buffer = self.write_buffer
+        size = self.SEND_SIZE
+        if isinstance(write_buffer, bytearray):
+            with memoryview(write_buffer) as view:
+                return bytes(view[:size])
+
+        buffers = write_buffer.buffers
+        head = buffers[0]
+        if len(buffers) == 1 or head.nbytes >= size:
+            obj = head.obj
+            if type(obj) is bytes and head.nbytes == len(obj):
+                return obj
+            return bytes(head[:size])
+        chunks = []
+        for data in buffers:
+            if data.nbytes >= size:
+                chunks.append(data[:size])
+                break
+            chunks.append(data)
+            size -= data.nbytes
+            if not size:
+                break
+        return b''.join(chunks)
+
+    def _send_done(self, res: int):
+        self._send_op = None
+        if self._sock is None:
+            return
+        if res < 0:
+            if res == -errno.EINTR or res == -errno.EAGAIN:
+                self._start_send()
+                return
+            exc = OSError(-res, os.strerror(-res))
+            self._fatal_error(exc, 'Fatal write error on socket transport')
+            return
+        write_buffer = self.write_buffer
+        if isinstance(write_buffer, bytearray):
+            del write_buffer[:res]
+        else:
+            write_buffer.consume(res)
+        self._maybe_resume_writing()
+        if write_buffer:
+            self._start_send()
+            return
+        self._write_flushed()
+
+    def _finnal_close(self, exc=None):
+        ring = self._ring
+        if ring is not None:
+            if self._recv_op is not None:
+                ring.cancel(self._recv_op)
+                self._recv_op = None
+            if self._send_op is not None:
+                ring.cancel(self._send_op)
+                self._send_op = None
+            # fd must not be closed with operations queued but not submitted
+            ring.submit()
+        super()._finnal_close(exc)
+
+
+class UringStreamChannel(StreamChannel):
+    '''StreamChannel accepting by io_uring, see :mod:`pymaid.net.uring`.'''
+
+    # accept operations kept in flight per listener
+    ACCEPT_BACKLOG = 16
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._ring = None
+        self._accepts = {}
+
+    def start(self):
+        ring = self._ring = get_ring(self._loop)
+        if ring is None:
+            super().start()
+            return
+        if self.state >= self.STATE.CLOSING:
+            raise RuntimeError(f'{self!r} is closing, cannot start again')
+        self.logger.info(f'{self!r} start')
+        self.state = self.STATE.STARTED
+        accepts = self._accepts = {}
+        for sock in self.listeners:
+            ops = accepts[sock.fileno()] = set()
+            for _ in range(min(self.ACCEPT_BACKLOG, self.max_accept)):
+                self._start_accept(sock, ops)
+
+    def pause(self, reason: str = ''):
+        ring = self._ring
+        if ring is None:
+            super().pause(reason)
+            return
+        self.logger.info(f'{self!r} pause with reason: {reason!r}')
+        self.state = self.STATE.PAUSED
+        for ops in self._accepts.values():
+            for user_data in ops:
+                # accepted sockets are closed by callback
+                ring.cancel(user_data, discard=False)
+            ops.clear()
+        # listeners may be closed right after pause
+        ring.submit()
+
+    def _start_accept(self, sock: socket.socket, ops: set):
+        def accepted(res: int):
+            ops.discard(user_data)
+            self._accept_done(sock, ops, res)
+        user_data = self._ring.accept(sock.fileno(), accepted)
+        ops.add(user_data)
+
+    def _accept_done(self, sock: socket.socket, ops: set, res: int):
+        if res >= 0:
+            # accepted with SOCK_NONBLOCK, see IoUring.accept
+            conn = socket.socket(
+                sock.family, sock.type | socket.SOCK_NONBLOCK, sock.proto, res
+            )
+            self._record_accepts(1)
+            if self.state >= self.STATE.SHUTTING_DOWN:
+                conn.close()
+                return
+            # already accepted, even if paused meanwhile
+            self.accept_connection(conn)
+        elif res == -errno.ECANCELED:
+            return
+        elif -res in ACCEPT_RETRY_ERRNOS:
+            self.accept_errors += 1
+            self.logger.error(
+                f'{self!r} accept failed: {os.strerror(-res)}, '
+                f'retry in {ACCEPT_RETRY_DELAY} seconds'
+            )
+            self._loop.call_later(
+                ACCEPT_RETRY_DELAY, self._retry_accept, sock, ops
+            )
+            return
+        if self.state != self.STATE.STARTED:
+            return
+        if self.is_full:
+            self.pause('stop accept since is full')
+            return
+        self._start_accept(sock, ops)
+
+    def _retry_accept(self, sock: socket.socket, ops: set):
+        if self.state == self.STATE.STARTED and sock.fileno() != -1:
+            self._start_accept(sock, ops)
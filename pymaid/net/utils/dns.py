@@ -0,0 +1,73 @@
+'''Cache of resolved addresses, used by :func:`pymaid.net.raw.getaddrinfo`.
+
+`getaddrinfo` does not tell the ttl of records, entries are kept for a
+fixed `ttl`, failures for `negative_ttl`, the least recently used entries
+are dropped beyond `size`.
+'''
+
+import copy
+import time
+
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+
+
+class DNSCache:
+
+    def __init__(self, size: int, ttl: float, negative_ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (expire_at, addr_infos or exception)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[List]:
+        '''Return cached addr_infos of `key`, None if missed.
+
+        :raises: the cached error if `key` failed to resolve lately.
+        '''
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expire_at, value = entry
+        if expire_at <= time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        if isinstance(value, Exception):
+            # a copy, tracebacks would pile up on the cached one otherwise
+            raise copy.copy(value)
+        return value
+
+    def set(self, key: Hashable, addr_infos: List):
+        self._set(key, addr_infos, self.ttl)
+
+    def set_error(self, key: Hashable, exc: Exception):
+        self._set(key, exc, self.negative_ttl)
+
+    def _set(self, key, value, ttl):
+        if ttl <= 0 or self.size <= 0:
+            return
+        entries = self.entries
+        entries[key] = (time.monotonic() + ttl, value)
+        entries.move_to_end(key)
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'entries={len(self.entries)}/{self.size} '
+            f'hits={self.hits} misses={self.misses}>'
+        )
@@ -1,6 +1,7 @@
 from base64 import b64encode
 from io import BytesIO
 from os import urandom
+from typing import Sequence
 
 from pymaid.core import Event
 from pymaid.net.http.h11 import RequestParser, ResponseParser
@@ -83,6 +84,13 @@ class WebSocket(Stream):
             )
         )
 
+    async def writelines(self, segments: Sequence[DataType]):
+        '''Send segments joined as one frame.'''
+        await self.write(b''.join(segments))
+
+    def writelines_sync(self, segments: Sequence[DataType]):
+        self.write_sync(b''.join(segments))
+
     def mark_ready(self):
         # we are finished upgrade handshake
         self.state = self.STATE.CONNECTED
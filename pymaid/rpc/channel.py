@@ -2,6 +2,7 @@ import ssl as _ssl
 
 from typing import Optional, Tuple, Type, TypeVar, Union
 
+from pymaid.conf import settings
 from pymaid.ext.middleware import MiddlewareManager
 from pymaid.net.channel import StreamChannel as NetStreamChannel
 from pymaid.ext.handler import SerialHandler
@@ -11,6 +12,7 @@ from pymaid.utils.logger import get_logger
 
 from .connection import Connection, ConnectionType
 from .context import ContextManager
+from .error import RPCError
 from .router import Router
 
 __all__ = ('Channel',)
@@ -74,8 +76,17 @@ class Channel(NetStreamChannel):
             context_manager=self.context_manager_class(initiative=False),
         )
 
+    def shed_message(self) -> Optional[bytes]:
+        return self.router.encode_connection_error(
+            self.protocol_class,
+            RPCError.ConnectionLimit(
+                data={'max_connections': settings.pymaid.MAX_CONNECTIONS}
+            ),
+        )
+
     def connection_made(self, sock) -> ConnectionType:
         conn = super().connection_made(sock)
+        conn.send_hello()
         self.middleware_manager.dispatch('on_connection_made', self, conn)
         return conn
 
@@ -1,6 +1,9 @@
-from typing import TypeVar
+from itertools import chain
+from typing import Iterator, Sequence, TypeVar
 
+from pymaid.core import shield, sleep
 from pymaid.net.transport import Transport
+from pymaid.types import DataType
 
 
 class Connection:
@@ -31,28 +34,140 @@ class Connection:
         **kwargs
     ):
         super().__init__(sock, **kwargs)
-        self.protocol = protocol
+        # seconds given to inbound contexts, shadows timeout of the socket
+        self.timeout = timeout
+        self.protocol = protocol.for_connection()
         self.handler = handler
         self.router = router
         self.context_manager = context_manager
+        self.is_draining = False
+        context_manager.on_idle.append(self.contexts_idle)
+        context_manager.on_released.append(self.context_released)
         self.__read_buffer = bytearray()
+        # bytes of read buffer decoded already
+        self.__read_offset = 0
+        # bytes needed to decode the pending frame, see Protocol.frame_size
+        self.__frame_size = 0
+        # read side backpressure, stop reading while handler is saturated
+        handler.on_saturated.append(self.handler_saturated)
+        handler.on_drained.append(self.handler_drained)
 
-    def data_received(self, data: bytes):
-        '''Received data from low level transport'''
-        self.__read_buffer.extend(data)
-        used_size, messages = self.protocol.feed_data(self.__read_buffer)
-        if used_size:
-            self.__read_buffer = self.__read_buffer[used_size:]
+    def send_hello(self):
+        '''Send hello of protocol, if any, called once accepted.'''
+        hello = self.protocol.encode_hello()
+        if hello:
+            self.write_sync(hello)
+
+    def data_received(self, data: DataType):
+        '''Received data from low level transport
+
+        When there is no pending partial frame, frames are parsed in place
+        from `data`, only the trailing incomplete frame is copied.
+
+        Otherwise `data` is appended to the pending bytes, which are parsed
+        only once the pending frame is complete. Parsed bytes are skipped by
+        offset and dropped once they are the most of the buffer, so the cost
+        of each read is in proportion to its size.
+        '''
+        protocol = self.protocol
+        read_buffer = self.__read_buffer
+        if not read_buffer:
+            used_size, messages = protocol.feed_data(data)
+            if used_size < len(data):
+                # data may be a reused buffer, e.g. Stream.RECV_INTO
+                read_buffer.extend(data[used_size:])
+                self.__frame_size = protocol.frame_size(read_buffer)
+        else:
+            offset = self.__read_offset
+            try:
+                read_buffer.extend(data)
+            except BufferError:
+                # payloads parsed from it are still referred
+                read_buffer = self.__read_buffer = read_buffer[offset:] + data
+                offset = 0
+            if len(read_buffer) - offset < self.__frame_size:
+                self.__read_offset = offset
+                return
+            with memoryview(read_buffer) as view:
+                used_size, messages = protocol.feed_data(view[offset:])
+            offset += used_size
+            if offset == len(read_buffer):
+                self.__read_buffer = bytearray()
+                self.__read_offset = self.__frame_size = 0
+            else:
+                if offset > len(read_buffer) >> 1:
+                    read_buffer = self.__read_buffer = read_buffer[offset:]
+                    offset = 0
+                self.__read_offset = offset
+                with memoryview(read_buffer) as view:
+                    self.__frame_size = protocol.frame_size(view[offset:])
+        if messages:
             for task in self.router.feed_messages(self, messages):
                 self.handler.submit(task)
 
+    def handler_saturated(self, handler):
+        self.pause_reading()
+
+    def handler_drained(self, handler):
+        self.resume_reading()
+
     def eof_received(self):
         self.handler.shutdown('eof_received')
         return super().eof_received()
 
+    @property
+    def inflight(self) -> int:
+        '''Number of contexts in flight.'''
+        return len(self.context_manager.contexts)
+
+    def graceful_shutdown(self, reason=None):
+        '''Finish the contexts in flight, then shut the write side down.
+
+        New requests received meanwhile are rejected by router with
+        `RPCError.RPCShutdown`, so peer can retry them somewhere else.
+        '''
+        if self.is_draining or self.state >= self.STATE.CLOSING:
+            return
+        self.is_draining = True
+        self.logger.debug(
+            f'{self!r} draining {self.inflight} contexts, reason={reason!r}'
+        )
+        if not self.context_manager.contexts:
+            super().graceful_shutdown(reason)
+
+    def contexts_idle(self, context_manager):
+        if self.is_draining and self.state < self.STATE.CLOSING:
+            super().graceful_shutdown('contexts drained')
+
+    def context_released(self, context_manager, transmission_id: int):
+        # fragments of a message never completed
+        self.protocol.discard_pending(transmission_id)
+
     async def send_message(self, *args, **kwargs):
-        '''Helper to send protocol message'''
-        await self.write(self.protocol.encode(*args, **kwargs))
+        '''Helper to send protocol message, encoded as segments.
+
+        Messages encoded as several frames, i.e. fragments of large messages,
+        are sent by a shielded task, which yields between frames to let other
+        contexts send theirs, peer would wait for the rest of fragments
+        forever if cancelled halfway.
+
+        The first frame is written right away, it defines the method ids
+        interned while encoding, which other contexts may use before the
+        task runs.
+        '''
+        frames = await self.protocol.encode_frames_async(*args, **kwargs)
+        segments = next(frames)
+        following = next(frames, None)
+        if following is None:
+            await self.writelines(segments)
+        else:
+            self.writelines_sync(segments)
+            await shield(self._send_frames(chain((following,), frames)))
+
+    async def _send_frames(self, frames: Iterator[Sequence[DataType]]):
+        for segments in frames:
+            await sleep(0)
+            await self.writelines(segments)
 
     def close(self, exc=None):
         if self.state == self.STATE.CLOSED:
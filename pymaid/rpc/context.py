@@ -1,11 +1,11 @@
 from collections import deque
-from functools import partial
 from typing import Optional, TypeVar, Union
 
-from pymaid.core import get_running_loop
+from pymaid.core import create_task
 from pymaid.core import Future, TimeoutError
 from pymaid.error import BaseEx
 from pymaid.utils.logger import logger_wrapper
+from pymaid.utils.timer import get_timer_wheel
 
 from .error import RPCError
 from .method import Method, MethodStub
@@ -86,12 +86,15 @@ class Context:
         if self.is_closed:
             raise RuntimeError('cannot reuse closed context')
         if self.timeout_interval is not None:
-            self.timer = get_running_loop().call_later(
-                self.timeout_interval,
-                partial(self.cancel, TimeoutError('context action timeout')),
+            self.timer = get_timer_wheel().call_later(
+                self.timeout_interval, self._timeout,
             )
         return self
 
+    def _timeout(self):
+        self.timer = None
+        create_task(self.cancel(TimeoutError('context action timeout')))
+
     async def __aexit__(self, exc_type, exc_value, exc_tb):
         await self.close(exc_value)
 
@@ -216,6 +219,10 @@ class ContextManager:
         self.initiative = initiative
         self.outbound_transmission_id = 1 if initiative else 2
         self.contexts = {}
+        # called with this manager once the last context released
+        self.on_idle = []
+        # called with this manager and transmission id of each one released
+        self.on_released = []
 
     def next_transmission_id(self) -> int:
         '''Return the next available transmission id for the context created
@@ -305,6 +312,11 @@ class ContextManager:
             return
         context = self.contexts.pop(transmission_id)
         del context._manager
+        for cb in self.on_released:
+            cb(self, transmission_id)
+        if not self.contexts:
+            for cb in self.on_idle:
+                cb(self)
 
 
 C = TypeVar('Context', bound=Context)
@@ -37,6 +37,8 @@ async def dial_stream(
         transport_class=transport_class,
         ssl_context=ssl_context,
         ssl_handshake_timeout=ssl_handshake_timeout,
+        on_open=on_open,
+        on_close=on_close,
         protocol=protocol_class(),
         handler=handler_class(),
         router=router_class(),
@@ -0,0 +1,159 @@
+'''Payload compression of rpc messages, see :class:`.protocol.Codec`.
+
+zlib is always available, zstd and lz4 are available once `zstandard` and
+`lz4` are installed, e.g. by `pip install pymaid[compression]`.
+
+Compressions are thread safe, payloads may be compressed and decompressed in
+threads.
+'''
+
+import threading
+import zlib
+
+from functools import lru_cache
+from typing import Dict, Optional
+
+from pymaid.types import DataType
+
+from .error import PBError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.block
+except ImportError:
+    lz4 = None
+
+
+class Compression:
+    '''Compression of `id`, sent in packet_flags of compact meta.'''
+
+    name = ''
+    id = 0
+    # ratio to estimate decompressed size of formats not storing it
+    RATIO = 4
+
+    def compress(self, data: DataType) -> bytes:
+        raise NotImplementedError
+
+    def content_size(self, data: DataType) -> int:
+        '''Return size of `data` once decompressed, estimated if unknown.'''
+        return len(data) * self.RATIO
+
+    def decompress(self, data: DataType, max_size: int) -> bytes:
+        '''Decompress `data` to no more than `max_size` bytes.
+
+        :raises: PBError.PacketTooLarge if decompressed data is larger,
+            PBError.InvalidPayload if `data` is corrupted.
+        '''
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} id={self.id}>'
+
+
+class Zlib(Compression):
+
+    name = 'zlib'
+    id = 1
+    LEVEL = zlib.Z_DEFAULT_COMPRESSION
+
+    def compress(self, data: DataType) -> bytes:
+        return zlib.compress(data, self.LEVEL)
+
+    def decompress(self, data: DataType, max_size: int) -> bytes:
+        decompressor = zlib.decompressobj()
+        try:
+            decompressed = decompressor.decompress(data, max_size)
+        except zlib.error as ex:
+            raise PBError.InvalidPayload(data={'error': str(ex)})
+        if decompressor.unconsumed_tail:
+            raise PBError.PacketTooLarge(data={'max': max_size})
+        if not decompressor.eof:
+            raise PBError.InvalidPayload(data={'error': 'truncated'})
+        return decompressed
+
+
+class Zstd(Compression):
+    '''zstd with an optional dictionary, which peer must use as well.'''
+
+    name = 'zstd'
+    id = 2
+    LEVEL = 3
+
+    def __init__(self, dictionary: Optional[bytes] = None):
+        self.dictionary = (
+            zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        )
+        # contexts of zstd are not thread safe
+        self.local = threading.local()
+
+    def compress(self, data: DataType) -> bytes:
+        compressor = getattr(self.local, 'compressor', None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(
+                level=self.LEVEL, dict_data=self.dictionary
+            )
+        return compressor.compress(data)
+
+    def content_size(self, data: DataType) -> int:
+        try:
+            size = zstandard.frame_content_size(data)
+        except zstandard.ZstdError:
+            # rejected by decompress
+            size = -1
+        return size if size >= 0 else super().content_size(data)
+
+    def decompress(self, data: DataType, max_size: int) -> bytes:
+        decompressor = getattr(self.local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self.local.decompressor = \
+                zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        try:
+            # max_output_size is ignored once size is known from the frame
+            size = zstandard.frame_content_size(data)
+            if size > max_size:
+                raise PBError.PacketTooLarge(
+                    data={'max': max_size, 'size': size}
+                )
+            return decompressor.decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError as ex:
+            raise PBError.InvalidPayload(data={'error': str(ex)})
+
+
+class LZ4(Compression):
+
+    name = 'lz4'
+    id = 3
+
+    def compress(self, data: DataType) -> bytes:
+        return lz4.block.compress(data)
+
+    def content_size(self, data: DataType) -> int:
+        # little endian size is stored ahead of the block
+        return int.from_bytes(data[:4], 'little')
+
+    def decompress(self, data: DataType, max_size: int) -> bytes:
+        size = self.content_size(data)
+        if size > max_size:
+            raise PBError.PacketTooLarge(data={'max': max_size, 'size': size})
+        try:
+            return lz4.block.decompress(data)
+        except lz4.block.LZ4BlockError as ex:
+            raise PBError.InvalidPayload(data={'error': str(ex)})
+
+
+@lru_cache()
+def get_compressions(
+    zstd_dictionary: Optional[bytes] = None,
+) -> Dict[int, Compression]:
+    '''Return available compressions by id.'''
+    compressions = [Zlib()]
+    if zstandard is not None:
+        compressions.append(Zstd(zstd_dictionary))
+    if lz4 is not None:
+        compressions.append(LZ4())
+    return {compression.id: compression for compression in compressions}
@@ -1,13 +1,36 @@
-from orjson import loads, dumps
+from orjson import dumps
+from pymaid.conf import settings
 from pymaid.error import ErrorManager
 from pymaid.rpc.error import RPCError
 from pymaid.rpc.context import InboundContext, OutboundContext, ContextManager
 
+from .error import PBError
+from .protocol import HELLO_TRANSMISSION_ID, Compressed
 from .pymaid_pb2 import Context as Meta, ErrorMessage, Void
 
 
 class PBContext:
 
+    @property
+    def max_message_size(self) -> int:
+        return (
+            self.method.options.get('max_message_size')
+            or settings.pymaid.MAX_MESSAGE_SIZE
+        )
+
+    def check_message_size(self, payload):
+        '''Limit payload by `MAX_MESSAGE_SIZE` of service or stub.'''
+        max_size = self.method.options.get('max_message_size')
+        if max_size and len(payload) > max_size:
+            raise PBError.PacketTooLarge(
+                data={
+                    'service_method': self.method.full_name,
+                    'transmission_id': self.transmission_id,
+                    'max': max_size,
+                    'size': len(payload),
+                }
+            )
+
     async def handle_error(self, error: Exception):
         await self.conn.send_message(
             Meta(
@@ -25,6 +48,21 @@ class PBContext:
         )
         self.sent_end_message = True
 
+    def parse_message(self, message_class, payload):
+        '''Parse `payload` as `message_class`.
+
+        :class:`Compressed` payloads are queued as is, and parsed once
+        decompressed in threads by :meth:`recv_message`.
+        '''
+        if isinstance(payload, Compressed):
+            return payload
+        self.check_message_size(payload)
+        return message_class.FromString(payload)
+
+    async def parse_compressed(self, message_class, payload: Compressed):
+        data = await payload.decompress_async(self.max_message_size)
+        return message_class.FromString(data)
+
     async def shutdown(self):
         await self.conn.send_message(
             Meta(
@@ -52,7 +90,7 @@ class PBInboundContext(PBContext, InboundContext):
             )
         if payload:
             self.request_queue.append(
-                self.method.request_class.FromString(payload)
+                self.parse_message(self.method.request_class, payload)
             )
         if meta.packet_flags & Meta.PacketFlag.END:
             self.request_queue.append(None)
@@ -60,6 +98,14 @@ class PBInboundContext(PBContext, InboundContext):
         if self.waiter and not self.waiter.done():
             self.waiter.set_result(True)
 
+    async def recv_message(self):
+        request = await super().recv_message()
+        if isinstance(request, Compressed):
+            request = await self.parse_compressed(
+                self.method.request_class, request
+            )
+        return request
+
     async def send_message(
         self, response=None, *, end: bool = False, **kwargs
     ):
@@ -101,23 +147,32 @@ class PBOutboundContext(PBContext, OutboundContext):
                     'transmission_id': self.transmission_id,
                 }
             )
-
         if meta.is_failed or meta.is_cancelled:
             assert payload, 'should return error message'
+            if isinstance(payload, Compressed):
+                payload = payload.decompress(self.max_message_size)
+            self.check_message_size(payload)
             err = ErrorMessage.FromString(payload)
-            ex = ErrorManager.assemble(
-                err.code, err.message, err.data and loads(err.data) or {}
-            )
+            # data is json decoded by assemble
+            ex = ErrorManager.assemble(err.code, err.message, err.data)
             self.response_queue.append(ex)
         elif payload:
             self.response_queue.append(
-                self.method.response_class.FromString(payload)
+                self.parse_message(self.method.response_class, payload)
             )
         if meta.packet_flags & Meta.PacketFlag.END:
             self.response_queue.append(None)
         if self.waiter and not self.waiter.done():
             self.waiter.set_result(True)
 
+    async def recv_message(self):
+        response = await super().recv_message()
+        if isinstance(response, Compressed):
+            response = await self.parse_compressed(
+                self.method.response_class, response
+            )
+        return response
+
     async def send_message(self, request=None, *, end: bool = False, **kwargs):
         '''Send request to transport layer'''
         if self.request_sent_count > 0 and not self.method.client_streaming:
@@ -145,5 +200,6 @@ class PBOutboundContext(PBContext, OutboundContext):
 
 class ContextManager(ContextManager):
 
+    MAX_TRANSMISSION_ID = HELLO_TRANSMISSION_ID - 1
     INBOUND_CONTEXT_CLASS = PBInboundContext
     OUTBOUND_CONTEXT_CLASS = PBOutboundContext
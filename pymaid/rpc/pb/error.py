@@ -5,3 +5,6 @@ PBError = RPCError.create_manager('PBError')
 PBError.add_error('RPCNotFound', 'rpc not found')
 PBError.add_error('InvalidTransmissionID', 'transmission_id value is invalid')
 PBError.add_error('InvalidPacketType', 'cannot handle unknown packet')
+PBError.add_error('PacketTooLarge', 'packet is too large')
+PBError.add_error('InvalidMeta', 'meta of packet is invalid')
+PBError.add_error('InvalidPayload', 'payload of packet is invalid')
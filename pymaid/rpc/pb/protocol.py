@@ -1,54 +1,231 @@
+'''Framing of rpc messages over protocol buffer.
+
+Every frame starts with a `!HH` header of meta size and payload size,
+followed by meta and payload.
+
+* v1 meta is :class:`Context` serialized by protocol buffer
+* v2 meta is a fixed `COMPACT_STRUCT` of transmission id, packet type,
+  flags and method id, marked by `COMPACT_FLAG` in meta size; the name of
+  a method follows it only the first time it is sent, peer interns it by
+  the method id for the rest of the connection
+* v3 splits payloads larger than `FRAGMENT_SIZE` into v2 frames flagged
+  by `FRAGMENT`, and by `MORE_FRAGMENTS` but the last one, peer reassembles
+  them up to `settings.pymaid.MAX_MESSAGE_SIZE` bytes; frames of other
+  contexts can be sent between them
+* v4 compresses payloads of at least `settings.pymaid.COMPRESSION_THRESHOLD`
+  bytes by the first of `settings.pymaid.COMPRESSION` accepted by peer, its
+  id is sent in `COMPRESSION_MASK` of packet_flags, see `.compression`;
+  payloads of at least `settings.pymaid.COMPRESSION_OFFLOAD_SIZE` bytes once
+  decompressed are passed to contexts as :class:`Compressed`
+
+Connections start with v1 and advertise their version by field `version`
+of the v1 meta, unknown to and ignored by old peers, v4 advertises
+compressions accepted by field `accepted_compressions` along with it.
+Frames are sent in the highest version both peers understand once peer is
+known, see :class:`Codec`.
+
+Accepted connections advertise first by a hello, a v1 response of
+`HELLO_TRANSMISSION_ID` with empty payload, so that the first request of
+peer may be fragmented, old peers drop it as an unknown response.
+'''
+
 import struct
-from typing import Optional, Sequence, Tuple, TypeVar
+from typing import (
+    Callable, Iterator, Optional, Sequence, Tuple, TypeVar, Union,
+)
 
 from google.protobuf.message import Message
 
+from pymaid.conf import settings
+from pymaid.core import (
+    TimeoutError, get_running_loop, run_in_threadpool, shield, wait_for,
+)
 from pymaid.net.protocol import DataType, Protocol
 
+from .compression import Compression, get_compressions
 from .error import PBError
 from .pymaid_pb2 import Context as Meta
 
 
 Message = TypeVar('Message', bound=Message)
 
+COMPACT_FLAG = 0x8000
+# packet_flags of every fragment, and of fragments but the last one,
+# both are stripped before reaching contexts
+FRAGMENT = 0x40
+MORE_FRAGMENTS = 0x80
+# packet_flags of compressed payloads, id of compression << COMPRESSION_SHIFT
+COMPRESSION_SHIFT = 3
+COMPRESSION_MASK = 0x38
+# set in bits of compact meta by peers of v3 and later
+FRAGMENTS_SUPPORTED = 0x40
+# set in bits of compact meta by peers of v4 and later, followed by a byte of
+# compressions accepted ahead of method name, sent once to peers of v4 which
+# have not seen the v1 meta
+EXTENDED = 0x80
+# transmission_id, packet_type | priority << 2 | is_cancelled << 4
+# | is_failed << 5, packet_flags, method_id
+COMPACT_STRUCT = struct.Struct('!IBBH')
+MAX_METHOD_ID = 0xffff
+MAX_COMPACT_SIZE = COMPACT_FLAG - 1
+# reserved for hello, never used by contexts
+HELLO_TRANSMISSION_ID = 0xffffffff
+
+
+class Header:
+    '''Meta decoded from v2 frames, with the same fields as :class:`Meta`.'''
+
+    __slots__ = (
+        'transmission_id', 'packet_type', 'packet_flags', 'priority',
+        'service_method', 'is_cancelled', 'is_failed',
+    )
+
+    def __init__(
+        self,
+        transmission_id: int = 0,
+        packet_type: int = 0,
+        packet_flags: int = 0,
+        priority: int = 0,
+        service_method: str = '',
+        is_cancelled: bool = False,
+        is_failed: bool = False,
+    ):
+        self.transmission_id = transmission_id
+        self.packet_type = packet_type
+        self.packet_flags = packet_flags
+        self.priority = priority
+        self.service_method = service_method
+        self.is_cancelled = is_cancelled
+        self.is_failed = is_failed
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'transmission_id={self.transmission_id} '
+            f'packet_type={self.packet_type} '
+            f'packet_flags={self.packet_flags} '
+            f'service_method={self.service_method!r} '
+            f'is_failed={self.is_failed}>'
+        )
+
+
+class Compressed:
+    '''Payload left compressed by :class:`Codec`, too large to decompress in
+    the event loop, contexts decompress it in threads.
+    '''
+
+    __slots__ = ('compression', 'data', 'size')
+
+    def __init__(self, compression: Compression, data: bytes, size: int):
+        self.compression = compression
+        self.data = data
+        # decompressed size, estimated by some compressions
+        self.size = size
+
+    def decompress(self, max_size: int) -> bytes:
+        return self.compression.decompress(self.data, max_size)
+
+    async def decompress_async(self, max_size: int) -> bytes:
+        return await run_in_threadpool(self.decompress, args=(max_size,))
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} compression={self.compression!r} '
+            f'size={len(self.data)}/{self.size}>'
+        )
+
+
+MetaType = Union[Meta, Header]
+PayloadType = Union[memoryview, bytes, Compressed]
+
+
+def feed_frames(
+    decode: Callable, data: DataType,
+) -> Tuple[int, Sequence[Tuple[MetaType, PayloadType]]]:
+    data = memoryview(data)
+    messages = []
+
+    used_size = 0
+    try:
+        while 1:
+            consumed, meta, payload = decode(data)
+            if not consumed:
+                break
+            # None for fragments of incomplete messages
+            if meta is not None:
+                messages.append((meta, payload))
+            used_size += consumed
+            data = data[consumed:]
+    finally:
+        data.release()
+
+    return used_size, messages
+
 
 class Protocol(Protocol):
+    '''Stateless v1 codec, connections use :meth:`for_connection`.'''
 
     HEADER_FORMAT = '!HH'
     HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
 
     MAX_PACKET_LENGTH = 8 * 1024
+    # payload size per fragment, no more than MAX_PACKET_LENGTH of peer
+    FRAGMENT_SIZE = 8 * 1024
+    # highest wire version advertised to peers, 1 to stick to v1
+    VERSION = 4
+    # seconds to wait for hello of peer before sending a payload larger than
+    # MAX_PACKET_LENGTH, see Codec.wait_hello
+    HELLO_TIMEOUT = 1
+    # dictionary of zstd compression, peer must use the same one
+    ZSTD_DICTIONARY = None
 
     header_size = HEADER_STRUCT.size
     pack_header = HEADER_STRUCT.pack
     unpack_header = HEADER_STRUCT.unpack
 
     @classmethod
-    def feed_data(cls, data: DataType) -> Tuple[int, Sequence[Message]]:
-        data = memoryview(data)
-        messages = []
+    def for_connection(cls) -> 'Codec':
+        return Codec(cls)
 
-        used_size = 0
-        try:
-            while 1:
-                consumed, meta, payload = cls.decode(data)
-                if not consumed:
-                    break
-                messages.append((meta, payload))
-                used_size += consumed
-                data = data[consumed:]
-        finally:
-            data.release()
+    @classmethod
+    def get_compressions(cls):
+        return get_compressions(cls.ZSTD_DICTIONARY)
 
-        return used_size, messages
+    @classmethod
+    def feed_data(
+        cls, data: DataType,
+    ) -> Tuple[int, Sequence[Tuple[Meta, memoryview]]]:
+        return feed_frames(cls.decode, data)
 
     @classmethod
     def encode(cls, meta: Meta, message: Message) -> bytes:
-        return (
-            cls.pack_header(meta.ByteSize(), message.ByteSize())
-            + meta.SerializeToString()
-            + message.SerializeToString()
-        )
+        return b''.join(cls.encode_segments(meta, message))
+
+    @classmethod
+    def encode_segments(
+        cls, meta: Meta, message: Message,
+    ) -> Tuple[bytes, bytes, bytes]:
+        '''Encode as segments of header, meta and payload.
+
+        Each part is serialized once, sizes are taken from the serialized
+        data instead of `ByteSize`, which serializes the message again.
+        Segments are meant for vectored writes, e.g. `Stream.writelines`,
+        so they are never concatenated.
+        '''
+        meta_data = meta.SerializeToString()
+        payload = message.SerializeToString()
+        header = cls.pack_header(len(meta_data), len(payload))
+        return header, meta_data, payload
+
+    @classmethod
+    def frame_size(cls, data: DataType) -> int:
+        '''Return size of the first frame, header size if it is partial.'''
+        header_size = cls.header_size
+        if len(data) < header_size:
+            return header_size
+        meta_size, payload_size = cls.unpack_header(data[:header_size])
+        # meta size of compact meta is flagged
+        return header_size + (meta_size & MAX_COMPACT_SIZE) + payload_size
 
     @classmethod
     def decode(
@@ -73,3 +250,407 @@ class Protocol(Protocol):
             Meta.FromString(data[header_size:header_size + meta_size]),
             data[header_size + meta_size: used_size],
         )
+
+
+class Codec:
+    '''Per connection state of `protocol`, negotiates version with peer.
+
+    Frames are sent in v1 with field `version` until version of peer is
+    known, i.e. it has sent a frame with the field or in v2, which tells
+    v3 by `FRAGMENTS_SUPPORTED`. Frames of all versions are always accepted.
+    Method ids are interned separately for each direction.
+
+    Payloads are compressed once both peers have advertised compressions
+    accepted, by v1 meta or by `EXTENDED` compact meta.
+
+    Payloads larger than `MAX_PACKET_LENGTH` wait for a frame of peer, i.e.
+    its hello, before they are encoded, they can be sent only as fragments.
+
+    Fragments pending reassembly are bounded by `MAX_MESSAGE_SIZE` per
+    message and `MAX_FRAGMENTS_SIZE` in all, and dropped by
+    :meth:`discard_pending` once their context is released.
+    '''
+
+    __slots__ = (
+        'protocol', 'peer_version', 'send_methods', 'recv_methods',
+        'fragments', 'fragments_size', 'compressions', 'peer_compressions',
+        'advertised', 'advertisement', 'heard', 'hello_waiter',
+    )
+
+    def __init__(self, protocol: Protocol):
+        self.protocol = protocol
+        self.peer_version = 1
+        self.send_methods = {}
+        self.recv_methods = {}
+        # (transmission_id, packet_type) -> payload reassembled so far
+        self.fragments = {}
+        # bytes of all fragments
+        self.fragments_size = 0
+        # id -> compression
+        self.compressions = {}
+        # bits of compression ids accepted by peer
+        self.peer_compressions = 0
+        # compressions accepted are told to peer
+        self.advertised = False
+        advertisement = Meta()
+        if protocol.VERSION >= 4:
+            self.compressions = protocol.get_compressions()
+            advertisement.accepted_compressions = self.accepted_compressions
+        if protocol.VERSION >= 2:
+            advertisement.version = protocol.VERSION
+        # appended to serialized v1 meta, peer merges it into the meta
+        self.advertisement = advertisement.SerializeToString()
+        # any frame is received from peer, its version is known since then
+        self.heard = False
+        self.hello_waiter = None
+
+    @property
+    def accepted_compressions(self) -> int:
+        '''Bits of compression ids accepted.'''
+        accepted = 0
+        for compression_id in self.compressions:
+            accepted |= 1 << compression_id
+        return accepted
+
+    @property
+    def version(self) -> int:
+        '''Wire version used to send frames.'''
+        return min(self.protocol.VERSION, self.peer_version)
+
+    def feed_data(
+        self, data: DataType,
+    ) -> Tuple[int, Sequence[Tuple[MetaType, PayloadType]]]:
+        return feed_frames(self.decode, data)
+
+    def frame_size(self, data: DataType) -> int:
+        return self.protocol.frame_size(data)
+
+    def discard_pending(self, transmission_id: int):
+        fragments = self.fragments
+        if not fragments:
+            return
+        for packet_type in (Meta.REQUEST, Meta.RESPONSE):
+            buffer = fragments.pop((transmission_id, packet_type), None)
+            if buffer is not None:
+                self.fragments_size -= len(buffer)
+
+    def encode(self, meta: MetaType, message: Message) -> bytes:
+        return b''.join(self.encode_segments(meta, message))
+
+    def encode_hello(self) -> bytes:
+        if not self.advertisement:
+            return b''
+        meta_data = Meta(
+            transmission_id=HELLO_TRANSMISSION_ID, packet_type=Meta.RESPONSE,
+        ).SerializeToString() + self.advertisement
+        self.advertised = True
+        return self.protocol.pack_header(len(meta_data), 0) + meta_data
+
+    async def wait_hello(self):
+        '''Wait for the first frame of peer for up to `HELLO_TIMEOUT`.'''
+        if self.heard:
+            return
+        waiter = self.hello_waiter
+        if waiter is None:
+            waiter = self.hello_waiter = get_running_loop().create_future()
+        try:
+            # shared by contexts, must not be cancelled by their timeout
+            await wait_for(shield(waiter), self.protocol.HELLO_TIMEOUT)
+        except TimeoutError:
+            pass
+
+    def encode_segments(
+        self, meta: MetaType, message: Message,
+    ) -> Tuple[DataType, ...]:
+        segments = []
+        for frame in self.encode_frames(meta, message):
+            segments.extend(frame)
+        return tuple(segments)
+
+    def encode_frames(
+        self, meta: MetaType, message: Message,
+    ) -> Iterator[Tuple[DataType, ...]]:
+        '''Encode as segments of each frame.
+
+        Payloads larger than `FRAGMENT_SIZE` are split into fragments in v3,
+        which are encoded lazily, one frame per fragment.
+        '''
+        payload = message.SerializeToString()
+        packet_flags = meta.packet_flags
+        compression = self.get_compression(len(payload))
+        if compression is not None:
+            payload, packet_flags = self._compressed(
+                compression, payload, packet_flags,
+                compression.compress(payload),
+            )
+        return self._encode_frames(meta, payload, packet_flags)
+
+    async def encode_frames_async(
+        self, meta: MetaType, message: Message,
+    ) -> Iterator[Tuple[DataType, ...]]:
+        '''Asynchronized version of :meth:`encode_frames`.
+
+        Payloads of at least `settings.pymaid.COMPRESSION_OFFLOAD_SIZE` bytes
+        are compressed in threads.
+        '''
+        payload = message.SerializeToString()
+        if (len(payload) > self.protocol.MAX_PACKET_LENGTH
+                and not self.heard):
+            await self.wait_hello()
+        packet_flags = meta.packet_flags
+        compression = self.get_compression(len(payload))
+        if compression is not None:
+            if len(payload) >= settings.pymaid.COMPRESSION_OFFLOAD_SIZE:
+                compressed = await run_in_threadpool(
+                    compression.compress, args=(payload,)
+                )
+            else:
+                compressed = compression.compress(payload)
+            payload, packet_flags = self._compressed(
+                compression, payload, packet_flags, compressed,
+            )
+        return self._encode_frames(meta, payload, packet_flags)
+
+    def get_compression(self, size: int) -> Optional[Compression]:
+        '''Return compression for payload of `size` bytes, None for raw.'''
+        if (self.version < 4 or not self.peer_compressions
+                or size < settings.pymaid.COMPRESSION_THRESHOLD):
+            return None
+        for name in settings.pymaid.COMPRESSION:
+            for compression in self.compressions.values():
+                if (compression.name == name
+                        and self.peer_compressions & 1 << compression.id):
+                    return compression
+        return None
+
+    def _compressed(
+        self,
+        compression: Compression,
+        payload: bytes,
+        packet_flags: int,
+        compressed: bytes,
+    ) -> Tuple[bytes, int]:
+        if len(compressed) >= len(payload):
+            # incompressible
+            return payload, packet_flags
+        return compressed, packet_flags | compression.id << COMPRESSION_SHIFT
+
+    def _encode_frames(
+        self, meta: MetaType, payload: bytes, packet_flags: int,
+    ) -> Iterator[Tuple[DataType, ...]]:
+        fragment_size = self.protocol.FRAGMENT_SIZE
+        payload_size = len(payload)
+        if self.version < 3 or payload_size <= fragment_size:
+            yield self._encode(meta, payload, packet_flags)
+            return
+
+        payload = memoryview(payload)
+        flags = packet_flags | FRAGMENT
+        for start in range(0, payload_size, fragment_size):
+            end = start + fragment_size
+            yield self._encode(
+                meta,
+                payload[start:end],
+                flags | MORE_FRAGMENTS if end < payload_size else flags,
+            )
+
+    def _encode(
+        self, meta: MetaType, payload: DataType, packet_flags: int,
+    ) -> Tuple[DataType, ...]:
+        protocol = self.protocol
+        if self.version < 2:
+            if len(payload) > protocol.MAX_PACKET_LENGTH:
+                # peer of v1, or not heard yet
+                raise PBError.PacketTooLarge(data={
+                    'max': protocol.MAX_PACKET_LENGTH, 'size': len(payload),
+                })
+            meta_data = meta.SerializeToString() + self.advertisement
+            self.advertised = True
+            header = protocol.pack_header(len(meta_data), len(payload))
+            return header, meta_data, payload
+
+        method_id = 0
+        name = None
+        service_method = meta.service_method
+        if service_method:
+            send_methods = self.send_methods
+            method_id = send_methods.get(service_method)
+            if method_id is None:
+                name = service_method.encode()
+                method_id = 0
+                if len(send_methods) < MAX_METHOD_ID:
+                    method_id = send_methods[service_method] = (
+                        len(send_methods) + 1
+                    )
+        meta_size = COMPACT_STRUCT.size
+        if name is not None:
+            meta_size += len(name)
+            if meta_size > MAX_COMPACT_SIZE:
+                raise ValueError(f'service_method too long: {service_method}')
+        bits = (
+            meta.packet_type | meta.priority << 2
+            | meta.is_cancelled << 4 | meta.is_failed << 5
+        )
+        if protocol.VERSION >= 3:
+            bits |= FRAGMENTS_SUPPORTED
+        extension = b''
+        if not self.advertised and self.version >= 4:
+            bits |= EXTENDED
+            extension = bytes((self.accepted_compressions,))
+            meta_size += 1
+            self.advertised = True
+        header = protocol.pack_header(
+            COMPACT_FLAG | meta_size, len(payload)
+        ) + COMPACT_STRUCT.pack(
+            meta.transmission_id, bits, packet_flags, method_id,
+        ) + extension
+        if name is None:
+            return header, payload
+        return header, name, payload
+
+    def decode(
+        self, data: DataType,
+    ) -> Tuple[int, Optional[MetaType], Optional[PayloadType]]:
+        '''Decode one frame, meta is None for fragments but the last one.'''
+        protocol = self.protocol
+        header_size = protocol.header_size
+        if len(data) < header_size:
+            return 0, None, None
+
+        meta_size, payload_size = protocol.unpack_header(data[:header_size])
+        if not meta_size & COMPACT_FLAG:
+            return self._decode_v1(data)
+
+        meta_size &= MAX_COMPACT_SIZE
+        meta_end = header_size + meta_size
+        used_size = meta_end + payload_size
+        if used_size > len(data):
+            return 0, None, None
+        if payload_size > protocol.MAX_PACKET_LENGTH:
+            raise PBError.PacketTooLarge(
+                data={'max': protocol.MAX_PACKET_LENGTH, 'size': payload_size}
+            )
+        if meta_size < COMPACT_STRUCT.size:
+            raise PBError.InvalidMeta(data={'size': meta_size})
+
+        transmission_id, bits, packet_flags, method_id = \
+            COMPACT_STRUCT.unpack_from(data, header_size)
+        name_start = header_size + COMPACT_STRUCT.size
+        if bits & EXTENDED:
+            if meta_size <= COMPACT_STRUCT.size:
+                raise PBError.InvalidMeta(data={'size': meta_size})
+            self.peer_compressions = data[name_start]
+            self.peer_version = max(self.peer_version, 4)
+            name_start += 1
+        service_method = ''
+        if meta_end > name_start:
+            service_method = str(data[name_start:meta_end], 'utf-8')
+            if method_id:
+                self.recv_methods[method_id] = service_method
+        elif method_id:
+            service_method = self.recv_methods.get(method_id)
+            if service_method is None:
+                raise PBError.InvalidMeta(data={'method_id': method_id})
+        self.peer_version = max(
+            self.peer_version, 3 if bits & FRAGMENTS_SUPPORTED else 2
+        )
+        if not self.heard:
+            self._heard()
+        payload = data[meta_end:used_size]
+        if packet_flags & FRAGMENT:
+            payload = self._reassemble(
+                (transmission_id, bits & 3), packet_flags, payload
+            )
+            if payload is None:
+                return used_size, None, None
+            packet_flags &= ~(FRAGMENT | MORE_FRAGMENTS)
+        if packet_flags & COMPRESSION_MASK:
+            payload = self._decompress(
+                (packet_flags & COMPRESSION_MASK) >> COMPRESSION_SHIFT, payload
+            )
+            packet_flags &= ~COMPRESSION_MASK
+        return (
+            used_size,
+            Header(
+                transmission_id,
+                bits & 3,
+                packet_flags,
+                bits >> 2 & 3,
+                service_method,
+                bool(bits & 16),
+                bool(bits & 32),
+            ),
+            payload,
+        )
+
+    def _decode_v1(
+        self, data: DataType,
+    ) -> Tuple[int, Optional[Meta], Optional[memoryview]]:
+        used_size, meta, payload = self.protocol.decode(data)
+        if not used_size:
+            return used_size, meta, payload
+        if self.peer_version < 2 and meta.version >= 2:
+            self.peer_version = meta.version
+            if meta.version >= 4:
+                self.peer_compressions = meta.accepted_compressions
+        if not self.heard:
+            self._heard()
+        if (meta.transmission_id == HELLO_TRANSMISSION_ID
+                and meta.packet_type == Meta.RESPONSE):
+            return used_size, None, None
+        return used_size, meta, payload
+
+    def _heard(self):
+        self.heard = True
+        waiter = self.hello_waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _reassemble(
+        self, key: Tuple[int, int], packet_flags: int, payload: memoryview,
+    ) -> Optional[memoryview]:
+        fragments = self.fragments
+        buffer = fragments.get(key)
+        if buffer is None:
+            buffer = fragments[key] = bytearray()
+        size = len(buffer) + len(payload)
+        max_size = settings.pymaid.MAX_MESSAGE_SIZE
+        if size > max_size:
+            self.discard_pending(key[0])
+            raise PBError.PacketTooLarge(data={'max': max_size, 'size': size})
+        total_size = self.fragments_size + len(payload)
+        max_size = settings.pymaid.MAX_FRAGMENTS_SIZE
+        if total_size > max_size:
+            self.discard_pending(key[0])
+            raise PBError.PacketTooLarge(
+                data={'max': max_size, 'size': total_size}
+            )
+        buffer.extend(payload)
+        if packet_flags & MORE_FRAGMENTS:
+            self.fragments_size = total_size
+            return None
+        del fragments[key]
+        self.fragments_size = total_size - size
+        return memoryview(buffer)
+
+    def _decompress(
+        self, compression_id: int, payload: memoryview,
+    ) -> Union[bytes, Compressed]:
+        compression = self.compressions.get(compression_id)
+        if compression is None:
+            raise PBError.InvalidPayload(
+                data={'compression_id': compression_id}
+            )
+        size = compression.content_size(payload)
+        if size >= settings.pymaid.COMPRESSION_OFFLOAD_SIZE:
+            # payload may refer to the read buffer, which is reused
+            return Compressed(compression, bytes(payload), size)
+        return compression.decompress(
+            payload, settings.pymaid.MAX_MESSAGE_SIZE
+        )
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} version={self.version} '
+            f'methods={len(self.send_methods)}/{len(self.recv_methods)}>'
+        )
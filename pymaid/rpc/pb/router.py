@@ -7,11 +7,16 @@ from pymaid.rpc.method import UnaryUnaryMethod, UnaryStreamMethod
 from pymaid.rpc.method import StreamUnaryMethod, StreamStreamMethod
 from pymaid.rpc.method import UnaryUnaryMethodStub, UnaryStreamMethodStub
 from pymaid.rpc.method import StreamUnaryMethodStub, StreamStreamMethodStub
+from pymaid.rpc.context import OutboundContext
+from pymaid.rpc.error import RPCError
 from pymaid.rpc.router import Router, RouterStub
 
 from .error import PBError
 from .pymaid_pb2 import Context as Meta, Void, ErrorMessage
 
+# contexts never use 0, messages of it are for the whole connection
+CONNECTION_TRANSMISSION_ID = 0
+
 
 class PBRouter(Router):
 
@@ -43,6 +48,9 @@ class PBRouter(Router):
                     'flags': Meta.PacketFlag.NULL,
                     'void_request': issubclass(request_class, Void),
                     'void_response': issubclass(response_class, Void),
+                    'max_message_size': getattr(
+                        service, 'MAX_MESSAGE_SIZE', None
+                    ),
                 },
             )
 
@@ -61,11 +69,20 @@ class PBRouter(Router):
                 conn.context_manager.contexts[meta.transmission_id] \
                     .feed_message(meta, payload)
                 continue
+            if meta.transmission_id == CONNECTION_TRANSMISSION_ID:
+                self.feed_connection_error(conn, meta, payload)
+                continue
 
             if meta.packet_type == Request:
                 name = meta.service_method
                 rpc = get_route(name)
-                if rpc is None:
+                if conn.is_draining:
+                    task = self.handle_error(
+                        conn,
+                        meta,
+                        RPCError.RPCShutdown(data={'reason': 'draining'}),
+                    )
+                elif rpc is None:
                     task = self.handle_error(
                         meta, PBError.RPCNotFound(data={'name': name})
                     )
@@ -96,6 +113,30 @@ class PBRouter(Router):
             tasks.append(task)
         return tasks
 
+    def feed_connection_error(self, conn, meta, payload):
+        '''Fail all outbound contexts by error of the whole connection.'''
+        self.logger.warning(
+            f'{self!r} connection error: '
+            f'{ErrorMessage.FromString(payload)!r}'
+        )
+        for context in list(conn.context_manager.contexts.values()):
+            if isinstance(context, OutboundContext):
+                context.feed_message(meta, payload)
+
+    def encode_connection_error(self, protocol, error):
+        packet = ErrorMessage(code=error.code, message=error.message)
+        if error.data:
+            packet.data = dumps(error.data)
+        return protocol.encode(
+            Meta(
+                transmission_id=CONNECTION_TRANSMISSION_ID,
+                packet_type=Meta.PacketType.RESPONSE,
+                packet_flags=Meta.PacketFlag.END,
+                is_failed=True,
+            ),
+            packet,
+        )
+
     async def handle_error(self, conn, meta, error):
         meta.is_failed = True
         meta.packet_type = Meta.PacketType.RESPONSE
@@ -130,5 +171,8 @@ class PBRouterStub(RouterStub):
                     'flags': Meta.PacketFlag.NULL,
                     'void_request': issubclass(request_class, Void),
                     'void_response': issubclass(response_class, Void),
+                    'max_message_size': getattr(
+                        stub, 'MAX_MESSAGE_SIZE', None
+                    ),
                 },
             )
@@ -1,10 +1,11 @@
-from typing import Coroutine, List, Sequence
+from typing import Coroutine, List, Optional, Sequence
 
 from pymaid.utils.logger import logger_wrapper
 
 from .types import RouterType, ServiceType
 
 
+@logger_wrapper(name='pymaid.Router')
 class Router:
 
     def __init__(
@@ -43,6 +44,13 @@ class Router:
     def feed_messages(self, messages) -> List[Coroutine]:
         raise NotImplementedError('feed_messages')
 
+    def encode_connection_error(self, protocol, error) -> Optional[bytes]:
+        '''Encode `error` of the whole connection, e.g. load shedding.
+
+        None if the protocol has no way to tell the peer.
+        '''
+        return None
+
 
 @logger_wrapper(name='pymaid.RouterStub')
 class RouterStub:
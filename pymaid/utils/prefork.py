@@ -0,0 +1,416 @@
+'''Prefork server mode.
+
+:class:`Supervisor` forks `count` workers running the same entry, pins them
+to cpus, restarts the crashed ones and replaces all of them gracefully on
+reload.
+
+Listeners of `bind` addresses are bound once by the master before forking,
+workers get them from :func:`pymaid.net.raw.sock_listen` for the same
+address, then the kernel shares one accept queue among the workers.
+Addresses not pre-bound are bound by every worker with `REUSE_PORT`,
+then the kernel balances connections among their accept queues.
+
+With `steer_by_cpu`, master binds one `REUSE_PORT` listener per worker for
+each of `bind` instead, in order of workers, and steers connections to the
+listener of the worker pinned to the cpu handling them, e.g. the cpu of the
+nic queue, see :func:`pymaid.net.raw.steer_by_cpu`. Restarted workers get
+the same listeners, so the order of the group never changes.
+
+Signals of master:
+
+* SIGTERM/SIGINT: stop workers gracefully, then exit
+* SIGHUP: reload, fork new workers and stop the old ones gracefully
+* SIGUSR1: log status of workers
+
+Workers are stopped by SIGTERM, listening channels stop accepting and drain
+their connections, e.g. rpc connections finish the contexts in flight, then
+`pymaid.run` cancels the tasks; workers still alive after `GRACEFUL_TIMEOUT`
+seconds are killed.
+'''
+
+import os
+import select
+import signal
+import sys
+import time
+
+from typing import Callable, Dict, List, Optional, Sequence
+
+from pymaid.conf import settings
+from pymaid.core import (
+    create_task, gather, set_sigterm_handler, sig_interrupt,
+)
+from pymaid.net.channel import get_listening_channels
+from pymaid.net.raw import inherit_listeners, sock_listen_sync
+from pymaid.net.utils.uri import parse_uri
+from pymaid.utils.logger import get_logger
+
+logger = get_logger('pymaid')
+
+HAS_AFFINITY = hasattr(os, 'sched_setaffinity')
+
+# index of current worker, None in master or without prefork
+worker_index = None
+
+
+def get_cpus() -> List[int]:
+    if HAS_AFFINITY:
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def exit_code(status: int) -> int:
+    '''Exit code from `os.waitpid` status, negative signal if killed.'''
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class Worker:
+
+    __slots__ = (
+        'index', 'cpu', 'pid', 'started_at', 'restarts', 'restart_delay',
+        'restart_at', 'last_exit', 'listeners',
+    )
+
+    def __init__(self, index: int, cpu: Optional[int]):
+        self.index = index
+        self.cpu = cpu
+        self.pid = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_delay = 0.
+        self.restart_at = None
+        self.last_exit = None
+        # (net, address) -> listeners of this worker only
+        self.listeners = {}
+
+    def status(self) -> dict:
+        return {
+            'index': self.index,
+            'cpu': self.cpu,
+            'pid': self.pid,
+            'uptime': (
+                time.monotonic() - self.started_at
+                if self.pid is not None else 0.
+            ),
+            'restarts': self.restarts,
+            'last_exit': self.last_exit,
+        }
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} '
+            f'index={self.index} cpu={self.cpu} pid={self.pid} '
+            f'restarts={self.restarts}>'
+        )
+
+
+class Supervisor:
+    '''Master process of prefork mode.
+
+    :param entry: called in every worker, the worker exits when it returns
+    :param count: number of workers, default to number of usable cpus
+    :param bind: uris to bind by master and shared by the workers,
+        e.g. `tcp://0.0.0.0:8888`
+    :param cpu_affinity: pin worker `i` to the `i`-th usable cpu
+    :param steer_by_cpu: bind listeners per worker and steer connections by
+        cpu, requires `cpu_affinity`
+    '''
+
+    # workers exiting within MIN_UPTIME seconds are restarted with delay,
+    # doubled for every consecutive fast exit, up to MAX_RESTART_DELAY
+    MIN_UPTIME = 1.
+    MAX_RESTART_DELAY = 30.
+    # max seconds master sleeps between checks
+    TICK = 1.
+
+    SIGNALS = (
+        signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1,
+        signal.SIGCHLD,
+    )
+
+    def __init__(
+        self,
+        entry: Callable,
+        count: Optional[int] = None,
+        *,
+        bind: Sequence[str] = (),
+        cpu_affinity: bool = True,
+        steer_by_cpu: bool = False,
+        graceful_timeout: Optional[float] = None,
+    ):
+        cpus = get_cpus()
+        count = count or len(cpus)
+        if count < 1:
+            raise ValueError(f'count should be positive, got {count}')
+        if steer_by_cpu and (not cpu_affinity or count > len(cpus)):
+            raise ValueError(
+                'steer_by_cpu requires cpu_affinity and a cpu per worker'
+            )
+        self.entry = entry
+        self.bind = bind
+        self.steer_by_cpu = steer_by_cpu
+        self.graceful_timeout = (
+            graceful_timeout if graceful_timeout is not None
+            else settings.pymaid.GRACEFUL_TIMEOUT
+        )
+        self.workers = [
+            Worker(index, cpus[index % len(cpus)] if cpu_affinity else None)
+            for index in range(count)
+        ]
+        # pid -> deadline, workers being stopped
+        self.retiring: Dict[int, float] = {}
+        self.listeners = []
+        self.stopping = False
+        self._wakeup = None
+        self._old_handlers = {}
+
+    def run(self) -> int:
+        '''Run until stopped by signal, blocks.'''
+        self.bind_listeners()
+        self._install_signals()
+        try:
+            for worker in self.workers:
+                self.spawn(worker)
+            while not self.stopping or self.alive():
+                self._wait()
+                self._reap()
+                self._tick()
+        finally:
+            self._restore_signals()
+            for sock in self.listeners:
+                sock.close()
+        logger.info(f'{self!r} exit')
+        return 0
+
+    def bind_listeners(self):
+        for address in self.bind:
+            uri = parse_uri(address)
+            # unix sockets cannot share the path
+            if self.steer_by_cpu and uri.scheme != 'unix':
+                self._bind_steered(uri)
+                logger.info(f'{self!r} bound {address} steered by cpu')
+                continue
+            sockets = sock_listen_sync(uri.scheme, uri.address)
+            inherit_listeners(uri.scheme, uri.address, sockets)
+            self.listeners.extend(sockets)
+            logger.info(f'{self!r} bound {address}')
+
+    def _bind_steered(self, uri):
+        cpus = [worker.cpu for worker in self.workers]
+        for worker in self.workers:
+            sockets = sock_listen_sync(
+                uri.scheme,
+                uri.address,
+                reuse_port=True,
+                incoming_cpu=worker.cpu,
+                # the program is shared by the group, attached once
+                reuseport_cpus=None if worker.index else cpus,
+            )
+            worker.listeners[(uri.scheme, uri.address)] = sockets
+            self.listeners.extend(sockets)
+
+    def alive(self) -> bool:
+        return bool(self.retiring) or any(
+            worker.pid is not None for worker in self.workers
+        )
+
+    def spawn(self, worker: Worker):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(worker)
+        worker.pid = pid
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logger.info(f'{self!r} spawned {worker!r}')
+
+    def reload(self):
+        '''Replace all workers, old ones are stopped gracefully.'''
+        logger.info(f'{self!r} reload')
+        for worker in self.workers:
+            if worker.pid is not None:
+                self._retire(worker.pid)
+                worker.pid = None
+            worker.restart_delay = 0.
+            self.spawn(worker)
+
+    def stop(self):
+        '''Stop all workers gracefully, run returns when they exited.'''
+        if self.stopping:
+            return
+        logger.info(f'{self!r} stop')
+        self.stopping = True
+        for worker in self.workers:
+            if worker.pid is not None:
+                self._retire(worker.pid)
+                worker.pid = None
+            worker.restart_at = None
+
+    def status(self) -> List[dict]:
+        return [worker.status() for worker in self.workers]
+
+    def _retire(self, pid: int):
+        self.retiring[pid] = time.monotonic() + self.graceful_timeout
+        self._kill(pid, signal.SIGTERM)
+
+    def _kill(self, pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _run_worker(self, worker: Worker):
+        global worker_index
+        code = 0
+        try:
+            worker_index = worker.index
+            self._reset_signals()
+            set_sigterm_handler(self._drain_worker)
+            if worker.cpu is not None and HAS_AFFINITY:
+                os.sched_setaffinity(0, {worker.cpu})
+            for (net, address), sockets in worker.listeners.items():
+                inherit_listeners(net, address, sockets)
+            self.entry()
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else 1
+        except BaseException:
+            logger.exception(f'worker {worker.index} failed')
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _drain_worker(self):
+        create_task(self._drain_channels())
+
+    async def _drain_channels(self):
+        channels = get_listening_channels()
+        logger.info(
+            f'worker {worker_index} draining {len(channels)} channels'
+        )
+        await gather(*(
+            ch.drain(self.graceful_timeout, 'worker stopped')
+            for ch in channels
+        ))
+        sig_interrupt()
+
+    def _install_signals(self):
+        rfd, wfd = os.pipe()
+        os.set_blocking(rfd, False)
+        os.set_blocking(wfd, False)
+        self._wakeup = (rfd, wfd)
+        signal.set_wakeup_fd(wfd)
+        for sig in self.SIGNALS:
+            # wakeup fd is written only with a python handler installed,
+            # signals are handled by reading it
+            self._old_handlers[sig] = signal.signal(sig, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        pass
+
+    def _reset_signals(self):
+        signal.set_wakeup_fd(-1)
+        for sig, handler in self._old_handlers.items():
+            signal.signal(sig, handler)
+        for fd in self._wakeup:
+            os.close(fd)
+
+    def _restore_signals(self):
+        self._reset_signals()
+        self._old_handlers.clear()
+        self._wakeup = None
+
+    def _wait(self):
+        now = time.monotonic()
+        deadlines = [
+            worker.restart_at for worker in self.workers
+            if worker.restart_at is not None
+        ]
+        deadlines.extend(self.retiring.values())
+        timeout = self.TICK
+        if deadlines:
+            timeout = max(0, min(timeout, min(deadlines) - now))
+        rfd = self._wakeup[0]
+        try:
+            readable, _, _ = select.select([rfd], [], [], timeout)
+        except InterruptedError:
+            return
+        if not readable:
+            return
+        try:
+            signals = os.read(rfd, 64)
+        except BlockingIOError:
+            return
+        for signum in signals:
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                self.stop()
+            elif signum == signal.SIGHUP and not self.stopping:
+                self.reload()
+            elif signum == signal.SIGUSR1:
+                logger.info(f'{self!r} status: {self.status()}')
+
+    def _reap(self):
+        while 1:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            code = exit_code(status)
+            if self.retiring.pop(pid, None) is not None:
+                logger.info(f'{self!r} worker {pid} retired, exit={code}')
+                continue
+            for worker in self.workers:
+                if worker.pid == pid:
+                    self._worker_exited(worker, code)
+                    break
+
+    def _worker_exited(self, worker: Worker, code: int):
+        now = time.monotonic()
+        uptime = now - worker.started_at
+        worker.pid = None
+        worker.last_exit = code
+        if self.stopping:
+            return
+        if uptime < self.MIN_UPTIME:
+            worker.restart_delay = min(
+                max(worker.restart_delay * 2, self.MIN_UPTIME),
+                self.MAX_RESTART_DELAY,
+            )
+        else:
+            worker.restart_delay = 0.
+        worker.restarts += 1
+        worker.restart_at = now + worker.restart_delay
+        logger.error(
+            f'{self!r} {worker!r} exited unexpectedly, exit={code} '
+            f'uptime={uptime:.3f}, restart in {worker.restart_delay} seconds'
+        )
+
+    def _tick(self):
+        now = time.monotonic()
+        for pid, deadline in self.retiring.items():
+            if now >= deadline:
+                logger.warning(
+                    f'{self!r} worker {pid} not exited in '
+                    f'{self.graceful_timeout} seconds, killed'
+                )
+                self._kill(pid, signal.SIGKILL)
+                # reaped later, never killed again
+                self.retiring[pid] = float('inf')
+        if self.stopping:
+            return
+        for worker in self.workers:
+            if worker.restart_at is not None and now >= worker.restart_at:
+                self.spawn(worker)
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} pid={os.getpid()} '
+            f'workers={len(self.workers)} retiring={len(self.retiring)} '
+            f'stopping={self.stopping}>'
+        )
@@ -0,0 +1,234 @@
+'''Hierarchical timing wheel.
+
+Lots of long timers which are mostly cancelled or rescheduled before firing,
+e.g. heartbeat, idle and rpc timeouts, churn the timer heap of the event loop
+by `call_later`, which costs O(log n) for every schedule and cancel.
+
+:class:`TimerWheel` keeps them in buckets of `tick` seconds instead, schedule
+and cancel are O(1), and all timers due in a tick are fired by one loop timer.
+Timers are fired at tick granularity, never early, at most `tick` seconds
+late, so it fits timeouts rather than precise scheduling.
+
+Wheel of level `n` covers `slots ** (n + 1)` ticks, timers of higher levels
+are cascaded down once the lower level wraps around.
+'''
+
+import weakref
+
+from math import ceil
+from typing import Any, Callable
+
+from pymaid.conf import settings
+from pymaid.core import get_running_loop
+
+__all__ = ('TimerHandle', 'TimerWheel', 'get_timer_wheel')
+
+
+class TimerHandle:
+
+    __slots__ = (
+        'when', 'expires', 'callback', 'args', 'cancelled', '_wheel',
+        '_bucket',
+    )
+
+    def __init__(
+        self,
+        wheel: 'TimerWheel',
+        when: float,
+        callback: Callable,
+        args: tuple,
+    ):
+        self._wheel = wheel
+        self.when = when
+        # tick the timer expires at
+        self.expires = 0
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._bucket = None
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        bucket = self._bucket
+        if bucket is not None:
+            bucket.discard(self)
+            self._bucket = None
+            self._wheel.count -= 1
+        self._wheel = self.callback = self.args = None
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} when={self.when} '
+            f'callback={self.callback} cancelled={self.cancelled}>'
+        )
+
+
+class TimerWheel:
+    '''Timing wheel of `levels` wheels with `slots` buckets each.
+
+    :param tick: seconds per bucket of the lowest wheel
+    :param slots: buckets per wheel, rounded up to power of 2
+    :param levels: timers later than `slots ** levels` ticks are parked in
+        the highest wheel and rescheduled when reached
+    '''
+
+    def __init__(self, tick: float = 0.1, slots: int = 256, levels: int = 4):
+        if tick <= 0:
+            raise ValueError(f'tick must be positive: {tick}')
+        if levels < 1:
+            raise ValueError(f'levels must be positive: {levels}')
+        self.loop = get_running_loop()
+        self.tick = tick
+        self.bits = max(slots - 1, 1).bit_length()
+        self.slots = 1 << self.bits
+        self.mask = self.slots - 1
+        self.levels = levels
+        self.max_ticks = (1 << (self.bits * levels)) - 1
+        self.wheels = [
+            [set() for _ in range(self.slots)] for _ in range(levels)
+        ]
+        self.started_at = self.loop.time()
+        # ticks processed
+        self.ticks = 0
+        # timers scheduled
+        self.count = 0
+        self._tick_handle = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def call_later(
+        self, delay: float, callback: Callable, *args: Any,
+    ) -> TimerHandle:
+        '''Call `callback(*args)` after `delay` seconds, rounded up to tick.'''
+        return self.call_at(self.loop.time() + delay, callback, *args)
+
+    def call_at(
+        self, when: float, callback: Callable, *args: Any,
+    ) -> TimerHandle:
+        if not self.count:
+            # nothing to cascade, skip the ticks passed while idle
+            self.ticks = max(self.ticks, int(
+                (self.loop.time() - self.started_at) / self.tick
+            ))
+        handle = TimerHandle(self, when, callback, args)
+        expires = ceil((when - self.started_at) / self.tick)
+        # the current tick is processed already
+        handle.expires = max(expires, self.ticks + 1)
+        self._insert(handle)
+        self.count += 1
+        if self._tick_handle is None:
+            self._schedule_tick()
+        return handle
+
+    def close(self):
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+        for wheel in self.wheels:
+            for bucket in wheel:
+                for handle in bucket:
+                    handle._bucket = None
+                    handle.cancel()
+                bucket.clear()
+        self.count = 0
+
+    def _insert(self, handle: TimerHandle):
+        delta = handle.expires - self.ticks
+        if delta > self.max_ticks:
+            # parked, rescheduled once reached
+            handle.expires = self.ticks + self.max_ticks
+            delta = self.max_ticks
+        bits = self.bits
+        level = 0
+        while delta >> (bits * (level + 1)) and level < self.levels - 1:
+            level += 1
+        bucket = self.wheels[level][(handle.expires >> (bits * level))
+                                    & self.mask]
+        bucket.add(handle)
+        handle._bucket = bucket
+
+    def _schedule_tick(self):
+        self._tick_handle = self.loop.call_at(
+            self.started_at + (self.ticks + 1) * self.tick, self._run,
+        )
+
+    def _run(self):
+        self._tick_handle = None
+        target = int((self.loop.time() - self.started_at) / self.tick)
+        while self.ticks < target:
+            self.ticks += 1
+            self._cascade()
+            self._fire(self.wheels[0][self.ticks & self.mask])
+        if self._tick_handle is None and self.count:
+            self._schedule_tick()
+
+    def _cascade(self):
+        ticks = self.ticks
+        bits = self.bits
+        for level in range(1, self.levels):
+            if ticks & ((1 << (bits * level)) - 1):
+                break
+            bucket = self.wheels[level][(ticks >> (bits * level)) & self.mask]
+            if not bucket:
+                continue
+            handles = list(bucket)
+            bucket.clear()
+            for handle in handles:
+                # no later than current tick, fired right after
+                handle.expires = max(handle.expires, ticks)
+                self._insert(handle)
+
+    def _fire(self, bucket: set):
+        if not bucket:
+            return
+        handles = list(bucket)
+        bucket.clear()
+        now = self.loop.time()
+        for handle in handles:
+            handle._bucket = None
+            if handle.when > now:
+                # parked beyond the range of wheels
+                handle.expires = max(
+                    ceil((handle.when - self.started_at) / self.tick),
+                    self.ticks + 1,
+                )
+                self._insert(handle)
+                continue
+            callback, args = handle.callback, handle.args
+            self.count -= 1
+            handle.cancel()
+            try:
+                callback(*args)
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except BaseException as exc:
+                self.loop.call_exception_handler({
+                    'message': f'Exception in timer callback {callback!r}',
+                    'exception': exc,
+                })
+
+    def __repr__(self):
+        return (
+            f'<{self.__class__.__name__} tick={self.tick} '
+            f'slots={self.slots} levels={self.levels} timers={len(self)}>'
+        )
+
+
+_timer_wheels = weakref.WeakKeyDictionary()
+
+
+def get_timer_wheel() -> TimerWheel:
+    '''Return the timer wheel shared in running loop.
+
+    Tick is `settings.pymaid.TIMER_WHEEL_TICK` seconds.
+    '''
+    loop = get_running_loop()
+    wheel = _timer_wheels.get(loop)
+    if wheel is None:
+        wheel = _timer_wheels[loop] = TimerWheel(
+            settings.pymaid.TIMER_WHEEL_TICK
+        )
+    return wheel
@@ -79,6 +79,7 @@ if __name__ == '__main__':
             'backend': [
                 'requests==2.25.1', 'PyYAML==5.4.1', 'xmltodict==0.12.0'
             ],
+            'compression': ['zstandard>=0.16.0', 'lz4>=3.1.3'],
         },
         ext_modules=[
             Extension(
@@ -0,0 +1,107 @@
+import pytest
+
+from pymaid.core import gather, sleep
+from pymaid.ext.pools.connection import ConnectionPool
+from pymaid.net import serve_stream
+
+from tests.common.models import _TestStreamChannel, _TestStream
+
+
+async def _serve(port):
+    return await serve_stream(
+        f'tcp4://localhost:{port}',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_least_loaded():
+    server = await _serve(8907)
+    async with ConnectionPool(
+        'tcp4://localhost:8907', size=3, prewarm=2, max_inflight=2,
+    ) as pool:
+        assert len(pool.connections) == 2
+        conn1, conn2 = pool.connections
+
+        conn1.context_manager.contexts[1] = None
+        assert await pool.get() is conn2
+        conn2.context_manager.contexts[1] = None
+        conn2.context_manager.contexts[3] = None
+        assert await pool.get() is conn1
+
+        # all busy, concurrent callers share one new connection
+        conn1.context_manager.contexts[3] = None
+        conns = await gather(pool.get(), pool.get())
+        assert conns[0] is conns[1]
+        assert len(pool.connections) == 3
+        conn3 = conns[0]
+
+        # capped by size
+        conn3.context_manager.contexts[1] = None
+        conn3.context_manager.contexts[3] = None
+        assert await pool.get() in (conn1, conn2, conn3)
+        assert len(pool.connections) == 3
+        assert pool.get_stats()['inflight'] == 6
+
+        for conn in pool.connections:
+            conn.context_manager.contexts.clear()
+    assert pool.is_closed
+    assert not pool.connections
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_evict():
+    server = await _serve(8908)
+    pool = ConnectionPool('tcp4://localhost:8908', size=2, prewarm=2)
+    await pool.start()
+    conn1, conn2 = pool.connections
+
+    conn1.close()
+    await sleep(0.001)
+    assert pool.connections == [conn2]
+
+    # peer shut down its write side
+    for stream in list(server.transports.values()):
+        stream.shutdown()
+    await sleep(0.01)
+    conn = await pool.get()
+    assert conn is not conn2
+    assert pool.connections == [conn]
+    stats = pool.get_stats()
+    assert stats['dialed'] == 3
+    assert stats['evicted'] == 2
+
+    # evicted with contexts in flight, closed once they are done
+    conn.context_manager.contexts[1] = None
+    pool._evict(conn)
+    conn4 = await pool.get()
+    assert pool.connections == [conn4]
+    assert pool.retiring == {conn}
+    assert conn.state < conn.STATE.CLOSING
+    del conn.context_manager.contexts[1]
+    for cb in conn.context_manager.on_idle:
+        cb(conn.context_manager)
+    assert not pool.retiring
+    assert conn.state >= conn.STATE.CLOSING
+
+    # retiring ones are closed with the pool
+    conn4.context_manager.contexts[1] = None
+    pool._evict(conn4)
+    assert pool.retiring == {conn4}
+    pool.close()
+    assert not pool.retiring
+    assert conn4.state >= conn4.STATE.CLOSING
+    server.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_pool_dial_error():
+    pool = ConnectionPool('tcp4://localhost:8909', prewarm=0)
+    with pytest.raises(OSError):
+        await pool.get()
+    assert pool.get_stats()['dial_errors'] == 1
+    pool.close()
+    with pytest.raises(RuntimeError):
+        await pool.get()
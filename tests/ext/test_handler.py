@@ -164,3 +164,35 @@ async def test_parallel_handler_close_on_exception():
 
     assert d['count'] == 0
     assert d['deltas'] == []
+
+
+@pytest.mark.asyncio
+async def test_handler_pending_limits():
+    with pytest.raises(ValueError):
+        SerialHandler(max_pending=4, low_pending=4)
+    with pytest.raises(ValueError):
+        ParallelHandler(max_pending=4, low_pending=4)
+    handler = ParallelHandler(max_pending=8, low_pending=2)
+    assert (handler.max_pending, handler.low_pending) == (8, 2)
+    handler.close()
+
+    handler = SerialHandler(max_pending=4)
+    assert handler.low_pending == 1
+    events = []
+    handler.on_saturated.append(lambda h: events.append('saturated'))
+    handler.on_drained.append(lambda h: events.append('drained'))
+    d = {'count': 0, 'deltas': []}
+
+    async with handler:
+        for delta in range(3):
+            handler.submit(async_inc, d, delta)
+        assert not handler.saturated
+        handler.submit(async_inc, d, 3)
+        assert handler.saturated
+        handler.submit(async_inc, d, 4)
+        assert events == ['saturated']
+        await sleep(0.001)
+        assert not handler.saturated
+
+    assert events == ['saturated', 'drained']
+    assert d['deltas'] == [0, 1, 2, 3, 4]
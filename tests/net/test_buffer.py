@@ -0,0 +1,93 @@
+import socket
+
+import pytest
+
+from pymaid.net.buffer import RecvSizer, WriteBuffer, WriteQueue
+
+
+def test_write_buffer_send():
+    sock1, sock2 = socket.socketpair()
+    buf = WriteBuffer()
+    buf.extend(b'from ')
+    buf.extend(b'pymaid')
+    assert buf.send(sock1) == 11
+    assert not buf
+    assert sock2.recv(1024) == b'from pymaid'
+    sock1.close()
+    sock2.close()
+
+
+def test_write_queue_does_not_copy_immutable_data():
+    data = b'a' * 1024
+    queue = WriteQueue()
+    queue.extend(data)
+    assert len(queue) == 1024
+    assert queue.buffers[0].obj is data
+
+
+def test_write_queue_copies_mutable_data():
+    data = bytearray(b'from pymaid')
+    queue = WriteQueue()
+    queue.extend(data)
+    data[:4] = b'xxxx'
+    assert bytes(queue.buffers[0]) == b'from pymaid'
+
+
+def test_write_queue_ignores_empty_data():
+    queue = WriteQueue()
+    queue.extend(b'')
+    assert not queue
+    assert not queue.buffers
+
+
+def test_write_queue_consume():
+    queue = WriteQueue()
+    queue.extend(b'abc')
+    queue.extend(b'def')
+    queue.extend(b'ghi')
+
+    queue.consume(2)
+    assert len(queue) == 7
+    assert [bytes(b) for b in queue.buffers] == [b'c', b'def', b'ghi']
+
+    queue.consume(4)
+    assert len(queue) == 3
+    assert [bytes(b) for b in queue.buffers] == [b'ghi']
+
+    queue.consume(3)
+    assert not queue
+    assert not queue.buffers
+
+
+def test_write_queue_send():
+    sock1, sock2 = socket.socketpair()
+    queue = WriteQueue()
+    queue.extend(b'from ')
+    queue.extend(memoryview(b'pymaid'))
+    assert queue.send(sock1) == 11
+    assert not queue
+    assert sock2.recv(1024) == b'from pymaid'
+    sock1.close()
+    sock2.close()
+
+
+def test_recv_sizer_bounds():
+    with pytest.raises(ValueError):
+        RecvSizer(1024, 2048, 4096, 0.25)
+    with pytest.raises(ValueError):
+        RecvSizer(1024, 512, 4096, 0)
+
+
+def test_recv_sizer_grows_and_shrinks():
+    sizer = RecvSizer(1024, 512, 4096, 0.5)
+    # full reads, grow until maximum
+    for _ in range(5):
+        sizer.update(sizer.size)
+    assert sizer.size == 4096
+    assert sizer.grows == 2
+
+    # small reads, shrink until minimum
+    for _ in range(20):
+        sizer.update(10)
+    assert sizer.size == 512
+    assert sizer.shrinks == 3
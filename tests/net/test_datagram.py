@@ -0,0 +1,100 @@
+import socket
+
+import pytest
+
+from pymaid.core import sleep, Queue
+from pymaid.net import dial_datagram, serve_datagram
+from pymaid.net.datagram import Datagram, split_gso_batches, UDP_MAX_SEGMENTS
+
+
+class Echo(Datagram):
+
+    def datagram_received(self, data, addr):
+        self.sendto(data, addr)
+
+
+class Client(Datagram):
+
+    def init(self):
+        self.received = Queue()
+
+    def datagram_received(self, data, addr):
+        self.received.put_nowait((data, addr))
+
+
+def test_split_gso_batches():
+    assert split_gso_batches([b'a' * 4, b'b' * 4, b'c' * 2, b'd' * 4]) == [
+        [b'a' * 4, b'b' * 4, b'c' * 2], [b'd' * 4],
+    ]
+    assert split_gso_batches([b'a' * 2, b'b' * 4]) == [[b'a' * 2], [b'b' * 4]]
+    batches = split_gso_batches([b'a'] * (UDP_MAX_SEGMENTS + 1))
+    assert [len(batch) for batch in batches] == [UDP_MAX_SEGMENTS, 1]
+    batches = split_gso_batches([b'a' * 30000] * 3)
+    assert [len(batch) for batch in batches] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_datagram_channel_udp4():
+    server = await serve_datagram(
+        'udp4://127.0.0.1:8910', transport_class=Echo,
+    )
+    assert len(server.transports) == 1
+
+    client = await dial_datagram(
+        'udp4://127.0.0.1:8910', transport_class=Client,
+    )
+    assert client.family == socket.AF_INET
+    assert client.peername == ('127.0.0.1', 8910)
+    client.sendto(b'from pymaid')
+    data, addr = await client.received.get()
+    assert data == b'from pymaid'
+    assert addr == ('127.0.0.1', 8910)
+
+    # datagrams keep their boundaries, sent by gso if supported
+    datagrams = [b'a' * 100, b'b' * 100, b'c' * 10]
+    client.sendto_many(datagrams)
+    for expected in datagrams:
+        data, _ = await client.received.get()
+        assert data == expected
+    stats = client.get_stats()
+    assert stats['sent'] == 4
+    assert stats['received'] == 4
+    if client.gso:
+        assert stats['gso_sends'] == 1
+
+    server.pause()
+    client.sendto(b'paused')
+    await sleep(0.01)
+    assert client.received.empty()
+    server.start()
+    data, _ = await client.received.get()
+    assert data == b'paused'
+
+    client.close()
+    await client.wait_closed()
+    server.close()
+    await server.wait_closed()
+    assert not server.transports
+
+
+@pytest.mark.asyncio
+async def test_datagram_error_received():
+    errors = []
+
+    class Refused(Client):
+
+        def error_received(self, exc):
+            errors.append(exc)
+
+    # nobody is serving, refused by icmp
+    client = await dial_datagram(
+        'udp4://127.0.0.1:8911', transport_class=Refused,
+    )
+    client.sendto(b'ping')
+    await sleep(0.01)
+    client.sendto(b'ping')
+    await sleep(0.01)
+    assert errors
+    assert isinstance(errors[0], ConnectionRefusedError)
+    assert client.state == client.STATE.CONNECTED
+    client.close()
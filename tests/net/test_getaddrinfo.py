@@ -2,8 +2,13 @@ import socket
 
 import pytest
 
+from pymaid.core import gather
+from pymaid.net import raw
 from pymaid.net.raw import getaddrinfo, HAS_IPv6_FAMILY, HAS_UNIX_FAMILY
+from pymaid.net.raw import resolve_address
 from pymaid.net.raw import STREAM_OPTS, DATAGRAM_OPTS, NET_OPTS
+from pymaid.net.utils import dns
+from pymaid.net.utils.dns import DNSCache
 
 
 @pytest.mark.asyncio
@@ -147,3 +152,79 @@ async def test_getaddrinfo_any_unix():
         assert info[0] == socket.AF_UNIX, infos
         assert info[1] in (socket.SOCK_STREAM, socket.SOCK_DGRAM), infos
         assert info[-1] == '/localhost:8888', infos
+
+
+@pytest.fixture
+def dns_cache(monkeypatch):
+    cache = DNSCache(size=2, ttl=60, negative_ttl=60)
+    monkeypatch.setattr(raw, '_dns_cache', cache)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_getaddrinfo_cached(dns_cache, monkeypatch):
+    calls = []
+
+    def resolve(*args):
+        calls.append(args)
+        return resolve_address(*args)
+
+    monkeypatch.setattr(raw, 'resolve_address', resolve)
+    infos = await gather(*(
+        getaddrinfo('localhost:8888', *STREAM_OPTS['tcp4'])
+        for _ in range(3)
+    ))
+    # concurrent lookups share one resolving
+    assert len(calls) == 1
+    assert infos[0] == infos[1] == infos[2]
+    cached = await getaddrinfo('localhost:8888', *STREAM_OPTS['tcp4'])
+    assert cached == infos[0]
+    assert len(calls) == 1
+    assert dns_cache.hits == 1
+
+    # ip literal never reaches the cache
+    await getaddrinfo('127.0.0.1:8888', *STREAM_OPTS['tcp4'])
+    assert len(dns_cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_getaddrinfo_negative_cached(dns_cache, monkeypatch):
+    calls = []
+
+    def resolve(*args):
+        calls.append(args)
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+    monkeypatch.setattr(raw, 'resolve_address', resolve)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror):
+            await getaddrinfo('pymaid.invalid:8888', *STREAM_OPTS['tcp'])
+    assert len(calls) == 1
+
+
+def test_dns_cache_expire_and_evict(monkeypatch):
+    now = [100.]
+    monkeypatch.setattr(dns.time, 'monotonic', lambda: now[0])
+    cache = DNSCache(size=2, ttl=10, negative_ttl=1)
+    cache.set('a', [1])
+    cache.set('b', [2])
+    assert cache.get('a') == [1]
+    cache.set('c', [3])
+    # b is the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == [1]
+
+    error = socket.gaierror(socket.EAI_NONAME, 'failed')
+    cache.set_error('d', error)
+    for _ in range(2):
+        with pytest.raises(socket.gaierror) as exc_info:
+            cache.get('d')
+        assert exc_info.value is not error
+        assert exc_info.value.errno == socket.EAI_NONAME
+    assert error.__traceback__ is None
+    now[0] += 1
+    assert cache.get('d') is None
+    now[0] += 9
+    assert cache.get('a') is None
+    assert cache.get('c') is None
+    assert not cache
@@ -0,0 +1,79 @@
+import os
+import socket
+
+import pytest
+
+from pymaid.core import Event, run_in_threadpool, sleep
+from pymaid.net import raw, serve_stream
+from pymaid.net.handoff import HandoffServer, recv_fds, send_fds, take_over
+
+from tests.common.models import _TestStreamChannel, _TestStream
+
+
+def test_send_recv_fds():
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX)
+    rfd, wfd = os.pipe()
+    send_fds(sock1, b'from pymaid', [wfd])
+    data, fds = recv_fds(sock2, 1024, 1)
+    assert data == b'from pymaid'
+    assert len(fds) == 1 and fds[0] != wfd
+    os.write(fds[0], b'through fd')
+    assert os.read(rfd, 1024) == b'through fd'
+    for fd in (rfd, wfd, fds[0]):
+        os.close(fd)
+    sock1.close()
+    sock2.close()
+
+
+def test_take_over_without_server():
+    assert not take_over('/tmp/pymaid_test_handoff_missing.sock')
+
+
+@pytest.mark.asyncio
+async def test_hot_restart():
+    path = '/tmp/pymaid_test_handoff.sock'
+    old = await serve_stream(
+        'tcp4://localhost:8904',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    client = socket.create_connection(('127.0.0.1', 8904))
+    await sleep(0.001)
+    assert len(old.transports) == 1
+
+    drained = Event()
+    server = HandoffServer(path, on_drained=drained.set, graceful_timeout=1)
+    server.start()
+    try:
+        assert await run_in_threadpool(take_over, args=(path,))
+        await sleep(0.001)
+        assert old.state == old.STATE.DRAINING
+        assert server.sock is None
+
+        # new generation listens on the inherited socket
+        new = await serve_stream(
+            'tcp4://localhost:8904',
+            channel_class=_TestStreamChannel,
+            transport_class=_TestStream,
+        )
+        assert new.listeners[0].getsockname() == ('127.0.0.1', 8904)
+        client2 = socket.create_connection(('127.0.0.1', 8904))
+        await sleep(0.001)
+        assert len(new.transports) == 1
+        assert len(old.transports) == 1
+
+        # old generation exits once its connections are gone
+        client.close()
+        await drained.wait()
+        assert old.state == old.STATE.CLOSED
+
+        client2.close()
+        new.close()
+        await new.wait_closed()
+    finally:
+        server.close()
+        for sockets in raw._inherited_listeners.values():
+            for sock in sockets:
+                sock.close()
+        raw._inherited_listeners.clear()
+        os.unlink(path)
@@ -3,8 +3,10 @@ import socket
 
 import pytest
 
-from pymaid.core import sleep
-from pymaid.net.raw import sock_connect, sock_listen
+from pymaid.core import get_running_loop, sleep
+from pymaid.net import raw
+from pymaid.net.raw import inherit_listeners, sock_listen_sync
+from pymaid.net.raw import sock_accept, sock_connect, sock_listen
 from pymaid.net.raw import HAS_IPv6_FAMILY, HAS_UNIX_FAMILY
 
 
@@ -143,3 +145,136 @@ async def test_sock_connect_unix_stream():
         sock.close()
 
     os.unlink('/tmp/pymaid_test_connect.sock')
+
+
+@pytest.mark.asyncio
+async def test_sock_accept():
+    sockets = await sock_listen('tcp4', 'localhost:8995')
+    listen_sock = sockets[0]
+    with pytest.raises(BlockingIOError):
+        sock_accept(listen_sock)
+
+    sock = await sock_connect('tcp4', 'localhost:8995')
+    await sleep(0.001)
+    peer = sock_accept(listen_sock)
+    assert peer.family == socket.AF_INET
+    assert peer.type == socket.SOCK_STREAM
+    assert peer.gettimeout() == 0
+    assert not os.get_inheritable(peer.fileno())
+    assert peer.getpeername() == sock.getsockname()
+
+    peer.close()
+    sock.close()
+    listen_sock.close()
+
+
+@pytest.mark.asyncio
+async def test_sock_listen_inherited():
+    sockets = sock_listen_sync('tcp4', 'localhost:8996')
+    inherit_listeners('tcp4', 'localhost:8996', sockets)
+    try:
+        listeners = await sock_listen('tcp4', 'localhost:8996')
+        assert len(listeners) == 1
+        assert listeners[0].fileno() != sockets[0].fileno()
+        assert listeners[0].getsockname() == sockets[0].getsockname()
+        listeners[0].close()
+    finally:
+        raw._inherited_listeners.clear()
+        for sock in sockets:
+            sock.close()
+
+
+@pytest.mark.asyncio
+async def test_sock_connect_happy_eyeballs(monkeypatch):
+    sockets = sock_listen_sync('tcp4', '127.0.0.1:8997')
+    live = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 8997))
+    hanging = (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', 8997, 0, 0))
+    refused = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 1))
+    connect_addr = raw._connect_addr
+    cancelled = []
+
+    async def fake_connect_addr(loop, addr_info):
+        if addr_info is hanging:
+            try:
+                await sleep(10)
+            except BaseException:
+                cancelled.append(addr_info)
+                raise
+        return await connect_addr(loop, addr_info)
+
+    async def fake_getaddrinfo(*args):
+        return addr_infos
+
+    monkeypatch.setattr(raw, '_connect_addr', fake_connect_addr)
+    monkeypatch.setattr(raw, 'getaddrinfo', fake_getaddrinfo)
+    try:
+        # interleaved by family: refused, hanging, live
+        addr_infos = [refused, live, hanging]
+        loop = get_running_loop()
+        started = loop.time()
+        sock = await sock_connect(
+            'tcp', 'localhost:8997', happy_eyeballs_delay=0.05,
+        )
+        assert sock.getpeername() == ('127.0.0.1', 8997)
+        assert loop.time() - started < 1
+        assert cancelled == [hanging]
+        sock.close()
+
+        addr_infos = [refused]
+        with pytest.raises(ConnectionRefusedError):
+            await sock_connect('tcp', 'localhost:8997')
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def test_reuseport_cpu_cbpf():
+    program = raw.reuseport_cpu_cbpf([3, 1])
+    # ld cpu, (jeq, ret) per cpu, mod, ret a
+    assert len(program) == 7 * raw.BPF_INSN.size
+    assert raw.BPF_INSN.unpack_from(program, 8) == (
+        raw.BPF_JMP_JEQ_K, 0, 1, 3,
+    )
+    assert raw.BPF_INSN.unpack_from(program, 16) == (raw.BPF_RET_K, 0, 0, 0)
+    assert raw.BPF_INSN.unpack_from(program, 40) == (
+        raw.BPF_ALU_MOD_K, 0, 0, 2,
+    )
+    with pytest.raises(ValueError):
+        raw.reuseport_cpu_cbpf([])
+
+
+@pytest.mark.skipif(
+    not hasattr(os, 'sched_setaffinity'), reason='requires linux'
+)
+def test_sock_listen_steer_by_cpu():
+    with pytest.raises(ValueError):
+        sock_listen_sync('tcp4', '127.0.0.1:8914', reuseport_cpus=[0])
+
+    affinity = os.sched_getaffinity(0)
+    cpu = min(affinity)
+    # loopback connections are handled by the cpu of the connecting thread
+    os.sched_setaffinity(0, {cpu})
+    first = second = []
+    try:
+        # program of the group overrides incoming cpu of the sockets
+        first = sock_listen_sync(
+            'tcp4', '127.0.0.1:8914', reuse_port=True,
+            incoming_cpu=cpu, reuseport_cpus=[cpu + 1, cpu],
+        )
+        assert first[0].getsockopt(
+            socket.SOL_SOCKET, raw.SO_INCOMING_CPU
+        ) == cpu
+        second = sock_listen_sync('tcp4', '127.0.0.1:8914', reuse_port=True)
+        clients = [
+            socket.create_connection(('127.0.0.1', 8914)) for _ in range(8)
+        ]
+        with pytest.raises(BlockingIOError):
+            sock_accept(first[0])
+        for _ in clients:
+            sock_accept(second[0]).close()
+        for client in clients:
+            client.close()
+    finally:
+        os.sched_setaffinity(0, affinity)
+        for sock in first + second:
+            sock.close()
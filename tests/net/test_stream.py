@@ -1,11 +1,16 @@
+import io
 import os
 import socket
+import tempfile
 
 import pytest
 
-from pymaid.core import sleep
+from pymaid.core import create_task, get_running_loop, sleep
 from pymaid.net.raw import HAS_IPv6_FAMILY
+from pymaid.net.buffer import WriteQueue
+from pymaid.net import stream as stream_module
 from pymaid.net.stream import Stream
+from pymaid.types import DataType
 
 from tests.common.models import _TestStream
 
@@ -64,3 +69,374 @@ async def test_stream_data_received_overrided():
 
     with pytest.raises(TypeError):
         Stream(sock1)
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_write_queue():
+
+    class QueuedStream(_TestStream):
+
+        BUFFER_FACTORY = WriteQueue
+
+        def init(self):
+            super().init()
+            self.received = bytearray()
+
+        def data_received(self, data: DataType):
+            self.received.extend(data)
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1, s2 = QueuedStream(sock1), QueuedStream(sock2)
+    assert isinstance(s1.write_buffer, WriteQueue)
+
+    chunks = [bytes([idx]) * 8192 for idx in range(64)]
+    for chunk in chunks:
+        s1.write_sync(chunk)
+    assert s1.write_buffer, 'should be under backpressure'
+    await s1.wait_write_all()
+    assert not s1.write_buffer
+    while len(s2.received) < 8192 * 64:
+        await sleep(0.001)
+    assert s2.received == b''.join(chunks)
+    s1.close()
+    s2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_recv_into():
+
+    class RecvIntoStream(_TestStream):
+
+        RECV_INTO = True
+
+        def data_received(self, data: DataType):
+            assert isinstance(data, memoryview)
+            # the view is only valid during this callback
+            super().data_received(bytes(data))
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1, s2 = RecvIntoStream(sock1), RecvIntoStream(sock2)
+    await s1.write(b'from pymaid')
+    await s2.data_received_event.wait()
+    assert s2.received_data == b'from pymaid'
+
+    s2.data_received_event.clear()
+    await s1.write(b'again')
+    await s2.data_received_event.wait()
+    assert s2.received_data == b'again'
+    s1.close()
+    s2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_corked_writes():
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = _TestStream(sock1)
+
+    with s1.corked_writes():
+        for _ in range(10):
+            s1.write_sync(b'a' * 10)
+        assert len(s1.write_buffer) == 100
+    # flushed on exit
+    assert not s1.write_buffer
+    assert sock2.recv(1024) == b'a' * 100
+
+    s1.cork()
+    for _ in range(10):
+        await s1.write(b'b' * 10)
+    assert len(s1.write_buffer) == 100
+    # flushed at the end of current loop iteration
+    await sleep(0)
+    assert not s1.write_buffer
+    assert sock2.recv(1024) == b'b' * 100
+
+    s1.write_sync(b'c' * s1.CORK_THRESHOLD)
+    # flushed since reached threshold
+    assert len(s1.write_buffer) < s1.CORK_THRESHOLD
+    s1.uncork()
+    await s1.wait_write_all()
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.parametrize('buffer_factory', [None, WriteQueue])
+@pytest.mark.asyncio
+async def test_stream_writelines(buffer_factory):
+
+    class LinesStream(_TestStream):
+
+        if buffer_factory is not None:
+            BUFFER_FACTORY = buffer_factory
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    sock2.setblocking(False)
+    s1 = LinesStream(sock1)
+
+    # sent by one vectored send
+    assert s1.writelines_sync([b'head', b'', bytearray(b'body')])
+    assert sock2.recv(1024) == b'headbody'
+
+    # kept in order behind buffered data, partial sends are resumed
+    segments = [bytes([idx]) * 100000 for idx in range(8)]
+    s1.write_sync(b'first')
+    writing = create_task(s1.writelines(segments))
+    received = bytearray()
+    while len(received) < 800005:
+        try:
+            received.extend(sock2.recv(1 << 20))
+        except BlockingIOError:
+            await sleep(0.001)
+    await writing
+    assert received == b'first' + b''.join(segments)
+    assert not s1.write_buffer
+
+    with s1.corked_writes():
+        s1.writelines_sync([b'a', b'b'])
+        s1.write_sync(b'c')
+        assert len(s1.write_buffer) == 3
+    assert sock2.recv(1024) == b'abc'
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_write_flow_control():
+
+    class FlowStream(_TestStream):
+
+        def init(self):
+            super().init()
+            self.events = []
+
+        def pause_writing(self):
+            self.events.append('pause')
+
+        def resume_writing(self):
+            self.events.append('resume')
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = FlowStream(sock1)
+    with pytest.raises(ValueError):
+        s1.set_write_buffer_limits(high=1, low=2)
+    s1.set_write_buffer_limits(high=4096)
+    assert s1.get_write_buffer_limits() == (1024, 4096)
+
+    # fill up the kernel buffer first
+    while not s1.write_buffer:
+        s1.write_sync(b'a' * 65536)
+    s1.write_sync(b'a' * 4096)
+    assert s1.get_write_buffer_size() > 4096
+    assert s1.writing_paused
+    assert s1.events == ['pause']
+
+    drain = create_task(s1.drain())
+    await sleep(0.001)
+    assert not drain.done()
+
+    sock2.setblocking(False)
+    while not drain.done():
+        try:
+            sock2.recv(65536)
+        except BlockingIOError:
+            pass
+        await sleep(0)
+    assert s1.get_write_buffer_size() <= 1024
+    assert not s1.writing_paused
+    assert s1.events == ['pause', 'resume']
+    # not paused, return immediately
+    await s1.drain()
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_pause_reading():
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1, s2 = _TestStream(sock1), _TestStream(sock2)
+
+    s2.pause_reading()
+    assert s2.reading_paused
+    await s1.write(b'from pymaid')
+    await sleep(0.001)
+    assert not s2.data_received_event.is_set()
+
+    s2.resume_reading()
+    await s2.data_received_event.wait()
+    assert s2.received_data == b'from pymaid'
+    s1.close()
+    s2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_graceful_shutdown():
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = _TestStream(sock1)
+    sent = 0
+    while not s1.write_buffer:
+        s1.write_sync(b'a' * 65536)
+        sent += 65536
+
+    s1.graceful_shutdown('test')
+    assert s1.write_shutdown
+    # buffered data is sent before eof
+    received = await _recv_exactly(sock2, sent)
+    assert received == b'a' * sent
+    loop = get_running_loop()
+    assert await loop.sock_recv(sock2, 1) == b''
+    s1.close()
+    sock2.close()
+
+
+async def _recv_exactly(sock, size):
+    sock.setblocking(False)
+    loop = get_running_loop()
+    received = bytearray()
+    while len(received) < size:
+        received.extend(await loop.sock_recv(sock, size - len(received)))
+    return bytes(received)
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.parametrize('native', [True, False])
+@pytest.mark.asyncio
+async def test_stream_sendfile(monkeypatch, native):
+    if not native:
+        monkeypatch.setattr(stream_module, 'HAS_SENDFILE', False)
+    content = os.urandom(1024 * 1024)
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = _TestStream(sock1)
+
+    with tempfile.TemporaryFile() as fp:
+        fp.write(content)
+        fp.flush()
+        receiving = create_task(_recv_exactly(sock2, len(content) + 6))
+        s1.write_sync(b'head')
+        sending = create_task(s1.sendfile(fp))
+        await sleep(0)
+        # deferred until file sent
+        s1.write_sync(b'ok')
+        assert await sending == len(content)
+        assert fp.tell() == len(content)
+        assert await receiving == b'head' + content + b'ok'
+
+        receiving = create_task(_recv_exactly(sock2, 100))
+        assert await s1.sendfile(fp, offset=1000, count=100) == 100
+        assert fp.tell() == 1100
+        assert await receiving == content[1000:1100]
+        assert await s1.sendfile(fp, offset=len(content)) == 0
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_sendfile_backpressure():
+    content = os.urandom(1024 * 1024)
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = _TestStream(sock1)
+    s1.set_write_buffer_limits(high=1024)
+
+    with tempfile.TemporaryFile() as fp:
+        fp.write(content)
+        fp.flush()
+        sending = create_task(s1.sendfile(fp))
+        await sleep(0)
+        # deferred data counts, write waits until the file is sent
+        writing = create_task(s1.write(b'a' * 4096))
+        await sleep(0.01)
+        assert s1.get_write_buffer_size() >= 4096
+        assert s1.writing_paused
+        assert not writing.done()
+        received = await _recv_exactly(sock2, len(content) + 4096)
+        assert await sending == len(content)
+        await writing
+        assert received == content + b'a' * 4096
+        assert not s1.writing_paused
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_sendfile_unmappable():
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = _TestStream(sock1)
+    fp = io.BytesIO(b'0123456789' * 1000)
+    receiving = create_task(_recv_exactly(sock2, 5000))
+    assert await s1.sendfile(fp, offset=10, count=5000) == 5000
+    assert await receiving == fp.getvalue()[10:5010]
+    s1.close()
+    sock2.close()
+
+
+@pytest.mark.skipif(
+    not getattr(socket, 'AF_UNIX', None),
+    reason='does not support unix domain sock'
+)
+@pytest.mark.asyncio
+async def test_stream_adaptive_recv():
+
+    class AdaptiveStream(_TestStream):
+
+        ADAPTIVE_RECV = True
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1, s2 = _TestStream(sock1), AdaptiveStream(sock2)
+    initial = s2.recv_size
+    assert s1.get_recv_stats() == {
+        'recv_size': s1.MAX_SIZE, 'reads': 0, 'bytes_read': 0,
+    }
+
+    for _ in range(10):
+        s2.data_received_event.clear()
+        await s1.write(b'x')
+        await s2.data_received_event.wait()
+    stats = s2.get_recv_stats()
+    assert stats['reads'] == 10
+    assert stats['bytes_read'] == 10
+    assert stats['shrinks'] > 0
+    assert s2.recv_size < initial
+
+    s2.data_received_event.clear()
+    await s1.write(b'x' * s2.recv_size)
+    await s2.data_received_event.wait()
+    assert s2.get_recv_stats()['grows'] == 1
+    s1.close()
+    s2.close()
@@ -3,7 +3,8 @@ import socket
 
 import pytest
 
-from pymaid.core import sleep
+from pymaid.conf import settings
+from pymaid.core import create_task, sleep, wait_for
 from pymaid.net import dial_stream, serve_stream, create_channel
 from pymaid.net.raw import HAS_IPv6_FAMILY, HAS_UNIX_FAMILY
 
@@ -113,3 +114,205 @@ async def test_channel_serve_forever_should_be_nursed():
 
     with pytest.raises(RuntimeError):
         await ch.serve_forever()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_accept_batch(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'MAX_ACCEPT', 2)
+    server = await serve_stream(
+        'tcp4://localhost:8901',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        start_serving=False,
+    )
+    assert server.max_accept == 2
+    socks = [socket.create_connection(('127.0.0.1', 8901)) for _ in range(5)]
+    await sleep(0.001)
+
+    listen_sock = server.listeners[0]
+    server.read_from_listener(listen_sock)
+    assert len(server.transports) == 2
+    server.read_from_listener(listen_sock)
+    server.read_from_listener(listen_sock)
+    assert len(server.transports) == 5
+    server.read_from_listener(listen_sock)
+
+    stats = server.get_accept_stats()
+    assert stats['accepted'] == 5
+    assert stats['batches'] == 4
+    assert stats['limited'] == 2
+    assert stats['errors'] == 0
+
+    for sock in socks:
+        sock.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_accept_until_full(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'MAX_CONNECTIONS', 3)
+    server = await serve_stream(
+        'tcp4://localhost:8902',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        start_serving=True,
+    )
+    socks = [socket.create_connection(('127.0.0.1', 8902)) for _ in range(5)]
+    await sleep(0.01)
+    assert len(server.transports) == 3
+    assert server.state == server.STATE.PAUSED
+
+    server.connected_stream.close()
+    await sleep(0.01)
+    assert len(server.transports) == 3
+    assert server.accepted == 4
+
+    for sock in socks:
+        sock.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_drain_timeout():
+    server = await serve_stream(
+        'tcp4://localhost:8905',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    sock = socket.create_connection(('127.0.0.1', 8905))
+    await sleep(0.001)
+    assert len(server.transports) == 1
+
+    await server.drain(0.01)
+    assert server.state == server.STATE.CLOSED
+    assert not server.transports
+    assert server.get_drain_stats()['forced'] == 1
+    sock.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_drain_timeout_with_buffered_data():
+    server = await serve_stream(
+        'tcp4://localhost:8916',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    # never reads
+    sock = socket.create_connection(('127.0.0.1', 8916))
+    await sleep(0.001)
+    stream, = server.transports.values()
+    while not stream.write_buffer:
+        stream.write_sync(b'a' * 65536)
+
+    await wait_for(server.drain(0.05), 1)
+    assert server.state == server.STATE.CLOSED
+    assert stream.state == stream.STATE.CLOSED
+    assert server.get_drain_stats()['forced'] == 1
+    sock.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_drain_stats():
+    server = await serve_stream(
+        'tcp4://localhost:8912',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    assert server.get_drain_stats() == {'draining': False}
+
+    class KeepOpen(_TestStream):
+        KEEP_OPEN_ON_EOF = True
+
+        def eof_received(self):
+            self.data_received_event.set()
+            return super().eof_received()
+
+    stream = await dial_stream(
+        'tcp4://localhost:8912', transport_class=KeepOpen,
+    )
+    await sleep(0.001)
+
+    drain = create_task(server.drain(1))
+    # connections are shut down gracefully
+    await stream.data_received_event.wait()
+    stats = server.get_drain_stats()
+    assert stats['draining']
+    assert stats['connections'] == 1
+    assert stats['drained'] == 0
+    assert 0 < stats['remaining'] <= 1
+    stream.close()
+    await drain
+    stats = server.get_drain_stats()
+    assert not stats['draining']
+    assert stats['connections'] == 0
+    assert stats['drained'] == 1
+    assert stats['forced'] == 0
+    assert server.state == server.STATE.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_idle_reaper(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'IDLE_TIMEOUT', 0.02)
+    server = await serve_stream(
+        'tcp4://localhost:8913',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    idle = await dial_stream(
+        'tcp4://localhost:8913', transport_class=_TestStream,
+    )
+    active = await dial_stream(
+        'tcp4://localhost:8913', transport_class=_TestStream,
+    )
+    await sleep(0.001)
+    assert len(server.transports) == 2
+
+    for _ in range(8):
+        await active.write(b'ping')
+        await sleep(0.01)
+    await idle.wait_closed()
+    assert len(server.transports) == 1
+    assert server.reaped == 1
+    assert active.state < active.STATE.CLOSING
+
+    active.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_stream_channel_shed(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'MAX_CONNECTIONS', 2)
+    monkeypatch.setattr(settings.pymaid, 'HARD_MAX_CONNECTIONS', 3)
+    server = await serve_stream(
+        'tcp4://localhost:8906',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+    server.shed_message = lambda: b'busy'
+    socks = [socket.create_connection(('127.0.0.1', 8906)) for _ in range(4)]
+    await sleep(0.01)
+    assert len(server.transports) == 2
+    assert len(server.shedding) == 1
+    assert server.state == server.STATE.PAUSED
+
+    # shed connection got the message and eof
+    shed = socks[2]
+    shed.settimeout(1)
+    assert shed.recv(1024) == b'busy'
+    assert shed.recv(1024) == b''
+    shed.close()
+    await sleep(0.01)
+    # the 4th one is accepted after the shed one closed, and shed as well
+    assert server.shed == 2
+    stats = server.get_accept_stats()
+    assert stats['shed'] == 2
+    assert stats['shedding'] == 1
+
+    for sock in socks:
+        sock.close()
+    server.close()
+    await server.wait_closed()
+    assert not server.shedding
@@ -0,0 +1,157 @@
+import ssl
+from pathlib import Path
+
+import pytest
+
+from pymaid.net import dial_stream, serve_stream
+
+from tests.common.models import _TestStreamChannel, _TestStream
+
+CERT_FILE = str(Path(__file__).parent.parent / 'common' / 'ssl_cert.pem')
+KEY_FILE = str(Path(__file__).parent.parent / 'common' / 'ssl_key.pem')
+
+
+def server_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CERT_FILE, KEY_FILE)
+    return context
+
+
+def client_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(CERT_FILE)
+    return context
+
+
+@pytest.mark.asyncio
+async def test_tls_stream():
+    server = await serve_stream(
+        'tcp4://localhost:8895',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        ssl_context=server_context(),
+    )
+
+    stream = await dial_stream(
+        'tcp4://localhost:8895',
+        transport_class=_TestStream,
+        ssl_context=client_context(),
+    )
+    assert stream.ssl_object.version()
+
+    await stream.write(b'from pymaid')
+    await server.connected_stream.data_received_event.wait()
+    assert server.connected_stream.received_data == b'from pymaid'
+
+    server.connected_stream.write_sync(b'from server')
+    await stream.data_received_event.wait()
+    assert stream.received_data == b'from server'
+
+    stream.close()
+    server.connected_stream.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tls_stream_corked_writes():
+    server = await serve_stream(
+        'tcp4://localhost:8896',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        ssl_context=server_context(),
+    )
+
+    stream = await dial_stream(
+        'tcp4://localhost:8896',
+        transport_class=_TestStream,
+        ssl_context=client_context(),
+    )
+    with stream.corked_writes():
+        for _ in range(10):
+            stream.write_sync(b'a' * 10)
+        assert stream.get_write_buffer_size() == 100
+    await stream.wait_write_all()
+
+    received = server.connected_stream
+    await received.data_received_event.wait()
+    # encrypted and sent as a whole
+    assert received.received_data == b'a' * 100
+
+    stream.close()
+    server.connected_stream.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tls_session_resumption():
+    server = await serve_stream(
+        'tcp4://localhost:8897',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        ssl_context=server_context(),
+    )
+    context = client_context()
+
+    stream = await dial_stream(
+        'tcp4://localhost:8897', transport_class=_TestStream,
+        ssl_context=context,
+    )
+    assert not stream.ssl_object.session_reused
+    server.connected_stream.write_sync(b'from server')
+    # tls 1.3 session tickets arrived with application data
+    await stream.data_received_event.wait()
+    stream.close()
+    await stream.wait_closed()
+
+    stream = await dial_stream(
+        'tcp4://localhost:8897', transport_class=_TestStream,
+        ssl_context=context,
+    )
+    assert stream.ssl_object.session_reused
+    stream.close()
+    server.connected_stream.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tls_handshake_failed():
+    server = await serve_stream(
+        'tcp4://localhost:8898',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+        ssl_context=server_context(),
+    )
+
+    with pytest.raises(ssl.SSLError):
+        # does not trust the self signed certificate
+        await dial_stream(
+            'tcp4://localhost:8898',
+            transport_class=_TestStream,
+            ssl_context=ssl.create_default_context(),
+        )
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tls_handshake_timeout():
+    # plain server never answers the handshake
+    server = await serve_stream(
+        'tcp4://localhost:8899',
+        channel_class=_TestStreamChannel,
+        transport_class=_TestStream,
+    )
+
+    with pytest.raises(ConnectionAbortedError):
+        await dial_stream(
+            'tcp4://localhost:8899',
+            transport_class=_TestStream,
+            ssl_context=client_context(),
+            ssl_handshake_timeout=0.01,
+        )
+    server.connected_stream.close()
+    server.close()
+    await server.wait_closed()
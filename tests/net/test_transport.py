@@ -2,6 +2,8 @@ import socket
 
 import pytest
 
+from pymaid.net.stream import Stream
+from pymaid.net.transport import SocketAttribute
 from pymaid.rpc.connection import Connection
 
 from tests.common.models import _TestStream
@@ -40,3 +42,46 @@ def test_transport_pipeline():
 
     with pytest.raises(RuntimeError):
         Cls = Cls | Cls
+
+
+@pytest.mark.asyncio
+async def test_transport_slots():
+
+    class T(Stream):
+
+        __slots__ = ()
+
+        def data_received(self, data):
+            pass
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    s1 = T(sock1)
+    assert not hasattr(s1, '__dict__')
+    assert isinstance(T.family, SocketAttribute)
+    assert s1.family == socket.AF_UNIX
+    assert s1.getsockopt(socket.SOL_SOCKET, socket.SO_TYPE) == s1.type
+    # aliased at class level
+    assert T.write is T._write
+    assert T._data_received is T.data_received
+    s1.close()
+    assert s1.closed_event.is_set()
+    await s1.wait_closed()
+    sock2.close()
+
+
+def test_transport_wrap_methods():
+
+    class Overrided(_TestStream):
+
+        async def _write(self, data):
+            pass
+
+    class Defined(_TestStream):
+
+        async def write(self, data):
+            pass
+
+    assert Overrided.write is Overrided._write
+    assert Defined.write is not Defined._write
+    assert (_TestStream | Connection)._data_received is \
+        Connection.data_received
@@ -0,0 +1,152 @@
+import socket
+
+import pytest
+
+from pymaid.core import Event, sleep
+from pymaid.net import dial_stream, serve_stream
+from pymaid.net import uring
+from pymaid.net.buffer import WriteQueue
+from pymaid.net.uring import get_ring, UringStream, UringStreamChannel
+from pymaid.types import DataType
+
+
+class _EchoStream(UringStream):
+
+    def data_received(self, data: DataType):
+        self.write_sync(data)
+
+
+class _ClientStream(UringStream):
+
+    def init(self):
+        self.received = bytearray()
+        self.data_received_event = Event()
+
+    def data_received(self, data: DataType):
+        self.received.extend(data)
+        self.data_received_event.set()
+
+    async def read_exactly(self, size):
+        while len(self.received) < size:
+            self.data_received_event.clear()
+            await self.data_received_event.wait()
+        return bytes(self.received)
+
+
+@pytest.mark.asyncio
+async def test_uring_stream_channel():
+    if get_ring() is None:
+        pytest.skip('io_uring is not available')
+
+    server = await serve_stream(
+        'tcp4://localhost:8900',
+        channel_class=UringStreamChannel,
+        transport_class=_EchoStream,
+    )
+    streams = [
+        await dial_stream(
+            'tcp4://localhost:8900', transport_class=_ClientStream,
+        )
+        for _ in range(5)
+    ]
+    await sleep(0.001)
+    assert len(server.transports) == 5
+
+    payload = b'a' * 256 * 1024
+    for stream in streams:
+        assert stream._recv_op is not None
+        await stream.write(payload)
+    for stream in streams:
+        assert await stream.read_exactly(len(payload)) == payload
+
+    for stream in streams:
+        stream.close()
+    await sleep(0.01)
+    assert not server.transports
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_uring_stream_pause_reading():
+    if get_ring() is None:
+        pytest.skip('io_uring is not available')
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    stream = _ClientStream(sock1)
+    stream.pause_reading()
+    sock2.send(b'from pymaid')
+    await sleep(0.01)
+    assert not stream.received
+
+    stream.resume_reading()
+    assert await stream.read_exactly(11) == b'from pymaid'
+    stream.close()
+    sock2.close()
+
+
+@pytest.mark.asyncio
+async def test_uring_stream_fall_back(monkeypatch):
+    monkeypatch.setattr(uring, '_unavailable', OSError('not available'))
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    stream = _ClientStream(sock1)
+    assert stream._ring is None
+    await stream.write(b'from pymaid')
+    assert sock2.recv(1024) == b'from pymaid'
+    sock2.send(b'from peer')
+    assert await stream.read_exactly(9) == b'from peer'
+    stream.close()
+    sock2.close()
+
+
+@pytest.mark.asyncio
+async def test_uring_stream_fall_back_without_eventfd(monkeypatch):
+    # os.eventfd is added by python 3.10
+    monkeypatch.delattr(uring.os, 'eventfd', raising=False)
+    monkeypatch.setattr(uring, '_rings', {})
+    monkeypatch.setattr(uring, '_unavailable', None)
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    stream = _ClientStream(sock1)
+    assert stream._ring is None
+    assert isinstance(uring._unavailable, OSError)
+    await stream.write(b'from pymaid')
+    assert sock2.recv(1024) == b'from pymaid'
+    stream.close()
+    sock2.close()
+
+
+@pytest.mark.parametrize('buffer_factory', [None, WriteQueue])
+@pytest.mark.asyncio
+async def test_uring_stream_send_chunks(buffer_factory):
+    if get_ring() is None:
+        pytest.skip('io_uring is not available')
+
+    class ChunkStream(_ClientStream):
+
+        if buffer_factory is not None:
+            BUFFER_FACTORY = buffer_factory
+
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    sock2.setblocking(False)
+    stream = ChunkStream(sock1)
+    segments = [b'head', bytes(range(256)) * 1024, b'a' * 1000, b'tail']
+    for _ in range(4):
+        stream.writelines_sync(segments)
+    # bounded snapshot instead of the whole buffer
+    chunk = stream._send_chunk()
+    assert len(chunk) <= max(stream.SEND_SIZE, len(segments[1]))
+
+    expected = b''.join(segments) * 4
+    received = bytearray()
+    while len(received) < len(expected):
+        try:
+            received.extend(sock2.recv(1 << 20))
+        except BlockingIOError:
+            await sleep(0.001)
+    assert received == expected
+    await stream.wait_write_all()
+    assert not stream.write_buffer
+    stream.close()
+    sock2.close()
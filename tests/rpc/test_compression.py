@@ -0,0 +1,150 @@
+import json
+import random
+
+import pytest
+
+from pymaid.conf import settings
+from pymaid.rpc.pb.compression import get_compressions
+from pymaid.rpc.pb.error import PBError
+from pymaid.rpc.pb.protocol import Compressed, Protocol
+from pymaid.rpc.pb.pymaid_pb2 import Context as Meta, ErrorMessage, Void
+
+COMPRESSIONS = [
+    pytest.param(compression.name, id=compression.name)
+    for compression in get_compressions().values()
+]
+
+
+def negotiate(client, server):
+    meta = Meta(transmission_id=1, packet_type=Meta.REQUEST)
+    server.decode(client.encode(meta, Void()))
+    client.decode(server.encode(meta, Void()))
+
+
+def make_message(size):
+    records = []
+    while sum(map(len, records)) < size:
+        records.append(json.dumps({
+            'id': random.getrandbits(32),
+            'name': f'user-{random.getrandbits(16)}',
+            'active': True,
+        }))
+    return ErrorMessage(message=''.join(records))
+
+
+def feed_message(codec, data):
+    used_size, messages = codec.feed_data(data)
+    assert used_size == len(data)
+    assert len(messages) == 1
+    return messages[0]
+
+
+def test_codec_negotiates_compressions():
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    # client by v1 meta, server by extended compact meta
+    assert server.peer_compressions == client.accepted_compressions
+    assert client.peer_compressions == server.accepted_compressions
+    assert client.advertised and server.advertised
+
+
+@pytest.mark.parametrize('name', COMPRESSIONS)
+def test_codec_compresses_payloads(monkeypatch, name):
+    monkeypatch.setattr(settings.pymaid, 'COMPRESSION', (name,))
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    meta = Meta(
+        transmission_id=3,
+        packet_type=Meta.REQUEST,
+        packet_flags=Meta.PacketFlag.END,
+    )
+
+    # fragments of compressed payload
+    message = make_message(60000)
+    data = client.encode(meta, message)
+    assert len(data) < message.ByteSize() * 3 // 4
+    header, payload = feed_message(server, data)
+    assert header.packet_flags == Meta.END
+    assert ErrorMessage.FromString(payload) == message
+
+    # raw below threshold
+    message = make_message(settings.pymaid.COMPRESSION_THRESHOLD // 2)
+    data = client.encode(meta, message)
+    assert data.endswith(message.SerializeToString())
+    assert ErrorMessage.FromString(feed_message(server, data)[1]) == message
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('name', COMPRESSIONS)
+async def test_codec_compresses_in_threads(monkeypatch, name):
+    monkeypatch.setattr(settings.pymaid, 'COMPRESSION', (name,))
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    message = make_message(60000)
+    # size of zlib is estimated
+    monkeypatch.setattr(
+        settings.pymaid, 'COMPRESSION_OFFLOAD_SIZE', message.ByteSize() // 2
+    )
+    frames = await client.encode_frames_async(
+        Meta(transmission_id=3, packet_type=Meta.REQUEST), message,
+    )
+    data = b''.join(b''.join(frame) for frame in frames)
+    assert len(data) < message.ByteSize() * 3 // 4
+
+    # left to contexts, no longer refers to the read buffer
+    buffer = bytearray(data)
+    payload = feed_message(server, buffer)[1]
+    assert isinstance(payload, Compressed)
+    buffer[:] = bytes(len(buffer))
+    data = await payload.decompress_async(settings.pymaid.MAX_MESSAGE_SIZE)
+    assert ErrorMessage.FromString(data) == message
+    with pytest.raises(PBError.PacketTooLarge):
+        await payload.decompress_async(message.ByteSize() - 1)
+
+
+def test_codec_keeps_raw_with_v3_peers(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'COMPRESSION', ('zlib',))
+
+    class V3Protocol(Protocol):
+
+        VERSION = 3
+
+    new, old = Protocol.for_connection(), V3Protocol.for_connection()
+    negotiate(new, old)
+    assert new.version == old.version == 3
+    message = make_message(60000)
+    data = new.encode(Meta(transmission_id=3), message)
+    assert ErrorMessage.FromString(feed_message(old, data)[1]) == message
+    assert len(data) > message.ByteSize()
+
+
+def test_codec_limits_decompressed_size(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'COMPRESSION', ('zlib',))
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    data = client.encode(
+        Meta(transmission_id=3), ErrorMessage(message='x' * 20000)
+    )
+    monkeypatch.setattr(settings.pymaid, 'MAX_MESSAGE_SIZE', 10000)
+    with pytest.raises(PBError.PacketTooLarge):
+        server.feed_data(data)
+
+
+def test_codec_compresses_by_zstd_dictionary(monkeypatch):
+    pytest.importorskip('zstandard')
+    monkeypatch.setattr(settings.pymaid, 'COMPRESSION', ('zstd',))
+
+    class DictProtocol(Protocol):
+
+        ZSTD_DICTIONARY = make_message(4096).SerializeToString()
+
+    message = make_message(2000)
+    sizes = []
+    for protocol in (Protocol, DictProtocol):
+        client, server = protocol.for_connection(), protocol.for_connection()
+        negotiate(client, server)
+        data = client.encode(Meta(transmission_id=3), message)
+        payload = feed_message(server, data)[1]
+        assert ErrorMessage.FromString(payload) == message
+        sizes.append(len(data))
+    assert sizes[1] < sizes[0]
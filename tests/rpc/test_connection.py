@@ -0,0 +1,589 @@
+import socket
+
+import pytest
+
+from pymaid.conf import settings
+from pymaid.core import create_task, sleep
+from pymaid.ext.handler import SerialHandler
+from pymaid.rpc.connection import Connection
+from pymaid.rpc.error import RPCError
+from pymaid.rpc.method import UnaryStreamMethodStub, UnaryUnaryMethodStub
+from pymaid.rpc.pb.compression import get_compressions
+from pymaid.rpc.pb.context import ContextManager
+from pymaid.rpc.pb.error import PBError
+from pymaid.rpc.pb.protocol import Compressed, Protocol
+from pymaid.rpc.pb.router import PBRouter
+from pymaid.rpc.pb.pymaid_pb2 import Context as Meta, ErrorMessage, Void
+
+from tests.common.models import _TestStream
+
+
+class _Router:
+
+    def __init__(self):
+        self.messages = []
+
+    def feed_messages(self, conn, messages):
+        for meta, payload in messages:
+            self.messages.append((meta, bytes(payload)))
+        return []
+
+
+def make_connection(handler=None):
+    sock1, sock2 = socket.socketpair(socket.AF_UNIX.value)
+    conn = (_TestStream | Connection)(
+        sock1,
+        protocol=Protocol,
+        handler=handler or SerialHandler(),
+        router=_Router(),
+        context_manager=ContextManager(initiative=False),
+    )
+    return conn, sock2
+
+
+def make_packet(transmission_id):
+    return Protocol.encode(
+        Meta(transmission_id=transmission_id, packet_type=Meta.REQUEST),
+        ErrorMessage(code='code', message='message'),
+    )
+
+
+def test_protocol_encode_segments():
+    meta = Meta(transmission_id=1, packet_type=Meta.REQUEST)
+    message = ErrorMessage(code='code', message='message')
+    header, meta_data, payload = Protocol.encode_segments(meta, message)
+    assert header == Protocol.pack_header(meta.ByteSize(), message.ByteSize())
+    assert meta_data == meta.SerializeToString()
+    assert payload == message.SerializeToString()
+    assert Protocol.encode(meta, message) == header + meta_data + payload
+
+
+def test_codec_negotiates_compact_meta():
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    message = ErrorMessage(code='code')
+
+    def request(transmission_id):
+        return Meta(
+            transmission_id=transmission_id,
+            packet_type=Meta.REQUEST,
+            packet_flags=Meta.PacketFlag.END,
+            service_method='test.Echo',
+        )
+
+    # v1 with version marker, understood by old peers as well
+    frame = client.encode(request(1), message)
+    meta, payload = Protocol.feed_data(frame)[1][0]
+    assert meta.service_method == 'test.Echo'
+    assert server.decode(frame)[1] == meta
+    assert server.version == 4
+
+    frame = server.encode(
+        Meta(transmission_id=1, packet_type=Meta.RESPONSE, is_failed=True),
+        message,
+    )
+    meta, payload = client.decode(frame)[1:]
+    assert client.version == 4
+    assert (meta.transmission_id, meta.packet_type) == (1, Meta.RESPONSE)
+    assert meta.is_failed and not meta.is_cancelled
+    assert ErrorMessage.FromString(payload) == message
+
+    # method name is sent only the first time
+    first = client.encode(request(3), message)
+    second = client.encode(request(5), message)
+    assert len(second) == len(first) - len('test.Echo')
+    assert second.find(b'test.Echo') == -1
+    used_size, messages = server.feed_data(first + second)
+    assert used_size == len(first) + len(second)
+    assert [
+        (meta.transmission_id, meta.service_method, meta.packet_flags)
+        for meta, _ in messages
+    ] == [(3, 'test.Echo', Meta.END), (5, 'test.Echo', Meta.END)]
+
+    with pytest.raises(PBError.InvalidMeta):
+        Protocol.for_connection().decode(second)
+
+
+def test_codec_keeps_v1_with_old_peers():
+
+    class OldProtocol(Protocol):
+
+        VERSION = 1
+
+    new, old = Protocol.for_connection(), OldProtocol.for_connection()
+    meta = Meta(transmission_id=1, packet_type=Meta.REQUEST)
+    new.decode(old.encode(meta, Void()))
+    assert new.version == 1
+    old.decode(new.encode(meta, Void()))
+    assert old.version == 1
+    assert old.encode(meta, Void()) == Protocol.encode(meta, Void())
+    # void payload, the frame ends with meta
+    assert new.encode(meta, Void()).endswith(b'\x78\x04')
+
+
+def test_codec_reads_version_from_meta():
+    codec = Protocol.for_connection()
+    # ends with bytes of the advertisement, but within the method name
+    meta = Meta(transmission_id=1, service_method='test.x\x04')
+    codec.decode(Protocol.encode(meta, Void()))
+    assert codec.version == 1
+
+    meta = Meta(transmission_id=1, accepted_compressions=2, version=4)
+    codec.decode(Protocol.encode(meta, Void()))
+    assert codec.version == 4
+    assert codec.peer_compressions == 2
+
+
+def test_codec_hello():
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    hello = server.encode_hello()
+    # old peers take it as an unknown response
+    meta = Protocol.feed_data(hello)[1][0][0]
+    assert meta.packet_type == Meta.RESPONSE
+    assert client.decode(hello) == (len(hello), None, None)
+    assert client.version == 4
+    assert client.peer_compressions == server.accepted_compressions
+
+    # first request is fragmented already
+    message = ErrorMessage(message='x' * 20000)
+    frames = list(client.encode_frames(
+        Meta(transmission_id=1, packet_type=Meta.REQUEST), message,
+    ))
+    assert len(frames) > 1
+    data = b''.join(b''.join(frame) for frame in frames)
+    used_size, messages = server.feed_data(data)
+    assert used_size == len(data)
+    assert ErrorMessage.FromString(messages[0][1]) == message
+
+    # nothing to advertise by v1
+    class OldProtocol(Protocol):
+
+        VERSION = 1
+
+    assert OldProtocol.for_connection().encode_hello() == b''
+
+
+def test_codec_rejects_large_v1_payloads():
+    with pytest.raises(PBError.PacketTooLarge):
+        Protocol.for_connection().encode(
+            Meta(transmission_id=1, packet_type=Meta.REQUEST),
+            ErrorMessage(message='x' * 20000),
+        )
+
+
+def negotiate(client, server):
+    meta = Meta(transmission_id=1, packet_type=Meta.REQUEST)
+    server.decode(client.encode(meta, Void()))
+    client.decode(server.encode(meta, Void()))
+
+
+def test_codec_keeps_v2_with_v2_peers():
+
+    class V2Protocol(Protocol):
+
+        VERSION = 2
+
+    new, old = Protocol.for_connection(), V2Protocol.for_connection()
+    negotiate(new, old)
+    assert new.version == old.version == 2
+    meta = Meta(transmission_id=3, packet_type=Meta.REQUEST)
+    frames = list(new.encode_frames(meta, ErrorMessage(message='x' * 20000)))
+    assert len(frames) == 1
+
+
+def test_codec_fragments_large_messages():
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    message = ErrorMessage(message='x' * 20000)
+    meta = Meta(
+        transmission_id=3,
+        packet_type=Meta.REQUEST,
+        packet_flags=Meta.PacketFlag.END,
+        service_method='test.Echo',
+    )
+    frames = [b''.join(frame) for frame in client.encode_frames(meta, message)]
+    assert len(frames) == 3
+    assert all(
+        Protocol.unpack_header(frame[:Protocol.header_size])[1]
+        <= Protocol.FRAGMENT_SIZE
+        for frame in frames
+    )
+
+    # frames of other contexts may go between fragments
+    other = client.encode(
+        Meta(transmission_id=5, packet_type=Meta.REQUEST), Void()
+    )
+    data = frames[0] + other + frames[1] + frames[2]
+    used_size, messages = server.feed_data(data)
+    assert used_size == len(data)
+    assert [meta.transmission_id for meta, _ in messages] == [5, 3]
+    meta, payload = messages[1]
+    assert (meta.service_method, meta.packet_flags) == ('test.Echo', Meta.END)
+    assert ErrorMessage.FromString(payload) == message
+    assert not server.fragments
+
+
+def test_codec_limits_reassembled_size(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'MAX_MESSAGE_SIZE', 10000)
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    meta = Meta(transmission_id=3, packet_type=Meta.REQUEST)
+    data = client.encode(meta, ErrorMessage(message='x' * 20000))
+    with pytest.raises(PBError.PacketTooLarge):
+        server.feed_data(data)
+
+
+def test_codec_limits_pending_fragments(monkeypatch):
+    monkeypatch.setattr(settings.pymaid, 'MAX_FRAGMENTS_SIZE', 20000)
+    client, server = Protocol.for_connection(), Protocol.for_connection()
+    negotiate(client, server)
+    message = ErrorMessage(message='x' * 20000)
+
+    def first_fragment(transmission_id):
+        meta = Meta(transmission_id=transmission_id, packet_type=Meta.REQUEST)
+        return b''.join(next(client.encode_frames(meta, message)))
+
+    # messages never completed, each one within MAX_MESSAGE_SIZE
+    server.feed_data(first_fragment(3) + first_fragment(5))
+    assert len(server.fragments) == 2
+    with pytest.raises(PBError.PacketTooLarge):
+        server.feed_data(first_fragment(7))
+    assert server.fragments_size == Protocol.FRAGMENT_SIZE * 2
+
+    server.discard_pending(3)
+    server.discard_pending(9)
+    assert list(server.fragments) == [(5, Meta.REQUEST)]
+    assert server.fragments_size == Protocol.FRAGMENT_SIZE
+    server.feed_data(first_fragment(7))
+    assert server.fragments_size == Protocol.FRAGMENT_SIZE * 2
+
+
+@pytest.mark.asyncio
+async def test_connection_discards_fragments_of_released_contexts():
+    conn, peer = make_connection()
+    client = Protocol.for_connection()
+    negotiate(client, conn.protocol)
+    method = UnaryUnaryMethodStub(
+        'Echo', 'test.Echo', ErrorMessage, ErrorMessage,
+        options={'flags': 0},
+    )
+    context = conn.context_manager.new_outbound_context(
+        method=method, conn=conn,
+    )
+    meta = Meta(
+        transmission_id=context.transmission_id, packet_type=Meta.RESPONSE,
+    )
+    conn.data_received(b''.join(next(client.encode_frames(
+        meta, ErrorMessage(message='x' * 20000),
+    ))))
+    assert conn.protocol.fragments_size == Protocol.FRAGMENT_SIZE
+    conn.context_manager.release_context(context.transmission_id)
+    assert not conn.protocol.fragments
+    assert conn.protocol.fragments_size == 0
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_context_limits_message_size():
+    conn, peer = make_connection()
+    method = UnaryUnaryMethodStub(
+        'Echo', 'test.Echo', ErrorMessage, ErrorMessage,
+        options={'flags': 0, 'max_message_size': 16},
+    )
+    context = conn.context_manager.new_outbound_context(
+        method=method, conn=conn,
+    )
+    meta = Meta(transmission_id=context.transmission_id)
+    with pytest.raises(PBError.PacketTooLarge):
+        context.feed_message(
+            meta, ErrorMessage(message='x' * 32).SerializeToString()
+        )
+    context.feed_message(meta, ErrorMessage(message='x').SerializeToString())
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_context_decompresses_in_threads():
+    conn, peer = make_connection()
+    method = UnaryStreamMethodStub(
+        'Echo', 'test.Echo', ErrorMessage, ErrorMessage,
+        options={'flags': 0, 'max_message_size': 30000},
+    )
+    context = conn.context_manager.new_outbound_context(
+        method=method, conn=conn,
+    )
+    meta = Meta(transmission_id=context.transmission_id)
+    zlib = get_compressions()[1]
+    for size in (20000, 40000):
+        data = ErrorMessage(message='x' * size).SerializeToString()
+        context.feed_message(
+            meta, Compressed(zlib, zlib.compress(data), len(data)),
+        )
+    assert (await context.recv_message()).message == 'x' * 20000
+    with pytest.raises(PBError.PacketTooLarge):
+        await context.recv_message()
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_send_message_interleaves_fragments():
+    conn, peer = make_connection()
+    peer.setblocking(False)
+    server = Protocol.for_connection()
+    negotiate(conn.protocol, server)
+    large = create_task(conn.send_message(
+        Meta(transmission_id=3, packet_type=Meta.REQUEST),
+        ErrorMessage(message='x' * 20000),
+    ))
+    await sleep(0)
+    await conn.send_message(
+        Meta(transmission_id=5, packet_type=Meta.REQUEST), Void(),
+    )
+    await large
+
+    transmission_ids = []
+    data = peer.recv(65536)
+    while data:
+        used_size, meta, payload = server.decode(data)
+        assert used_size
+        if meta is not None:
+            transmission_ids.append(meta.transmission_id)
+        data = data[used_size:]
+    assert transmission_ids == [5, 3]
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_send_message_defines_method_first():
+    conn, peer = make_connection()
+    peer.setblocking(False)
+    server = Protocol.for_connection()
+    negotiate(conn.protocol, server)
+    # method id of the large one is interned once encoded, the small one
+    # refers to it, peer can decode it only after the first fragment
+    large = create_task(conn.send_message(
+        Meta(
+            transmission_id=3,
+            packet_type=Meta.REQUEST,
+            service_method='test.Echo',
+        ),
+        ErrorMessage(message='x' * 20000),
+    ))
+    await sleep(0)
+    await conn.send_message(
+        Meta(
+            transmission_id=5,
+            packet_type=Meta.REQUEST,
+            service_method='test.Echo',
+        ),
+        Void(),
+    )
+    await large
+
+    methods = []
+    data = peer.recv(65536)
+    while data:
+        used_size, meta, payload = server.decode(data)
+        assert used_size
+        if meta is not None:
+            methods.append((meta.transmission_id, meta.service_method))
+        data = data[used_size:]
+    assert sorted(methods) == [(3, 'test.Echo'), (5, 'test.Echo')]
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_send_message_waits_hello():
+    conn, peer = make_connection()
+    peer.setblocking(False)
+    server = Protocol.for_connection()
+    message = ErrorMessage(message='x' * 20000)
+    large = create_task(conn.send_message(
+        Meta(transmission_id=1, packet_type=Meta.REQUEST), message,
+    ))
+    await sleep(0.01)
+    assert not large.done()
+    conn.data_received(server.encode_hello())
+    await large
+
+    data = b''
+    while len(data) < len(message.message):
+        data += peer.recv(65536)
+    used_size, messages = server.feed_data(data)
+    assert used_size == len(data)
+    assert ErrorMessage.FromString(messages[0][1]) == message
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_send_message_without_hello(monkeypatch):
+    monkeypatch.setattr(Protocol, 'HELLO_TIMEOUT', 0.01)
+    conn, peer = make_connection()
+    with pytest.raises(PBError.PacketTooLarge):
+        await conn.send_message(
+            Meta(transmission_id=1, packet_type=Meta.REQUEST),
+            ErrorMessage(message='x' * 20000),
+        )
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_send_message():
+    conn, peer = make_connection()
+    await conn.send_message(
+        Meta(transmission_id=5, packet_type=Meta.RESPONSE),
+        ErrorMessage(code='code'),
+    )
+    meta, payload = Protocol.feed_data(peer.recv(65536))[1][0]
+    assert meta.transmission_id == 5
+    assert ErrorMessage.FromString(payload).code == 'code'
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_data_received_whole_frames():
+    conn, peer = make_connection()
+    conn.data_received(make_packet(1) + make_packet(3))
+
+    assert [meta.transmission_id for meta, _ in conn.router.messages] == [1, 3]
+    assert ErrorMessage.FromString(conn.router.messages[0][1]).code == 'code'
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_data_received_pending_frame():
+
+    class CountingProtocol:
+
+        def __init__(self, protocol):
+            self.protocol = protocol
+            self.feeds = 0
+
+        def feed_data(self, data):
+            self.feeds += 1
+            return self.protocol.feed_data(data)
+
+        def frame_size(self, data):
+            return self.protocol.frame_size(data)
+
+    conn, peer = make_connection()
+    conn.protocol = CountingProtocol(conn.protocol)
+    large = Protocol.encode(
+        Meta(transmission_id=1, packet_type=Meta.REQUEST),
+        ErrorMessage(message='x' * 8000),
+    )
+    data = large + make_packet(3)
+    for idx in range(0, len(data), 100):
+        conn.data_received(data[idx:idx + 100])
+
+    assert [
+        meta.transmission_id for meta, _ in conn.router.messages
+    ] == [1, 3]
+    assert ErrorMessage.FromString(conn.router.messages[0][1]).message == (
+        'x' * 8000
+    )
+    # decoded once the frame is complete, instead of once per read
+    assert conn.protocol.feeds < len(data) // 100 // 4
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_data_received_partial_frames():
+    conn, peer = make_connection()
+    data = make_packet(1) + make_packet(3) + make_packet(5)
+    # the received buffer may be reused by transport
+    received = bytearray(data)
+    view = memoryview(received)
+    for idx in range(0, len(data), 7):
+        conn.data_received(view[idx:idx + 7])
+    received[:] = b'\x00' * len(received)
+
+    assert [
+        meta.transmission_id for meta, _ in conn.router.messages
+    ] == [1, 3, 5]
+    assert all(
+        ErrorMessage.FromString(payload).message == 'message'
+        for _, payload in conn.router.messages
+    )
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_pause_reading_when_handler_saturated():
+    handler = SerialHandler(max_pending=2)
+    conn, peer = make_connection(handler)
+
+    async def slow():
+        await sleep(0.001)
+
+    handler.submit(slow)
+    assert not conn.reading_paused
+    handler.submit(slow)
+    assert conn.reading_paused
+    await sleep(0.01)
+    assert not handler.pending_tasks
+    assert not conn.reading_paused
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_error_fails_outbound_contexts():
+    conn, peer = make_connection()
+    conn.router = PBRouter()
+    method = UnaryUnaryMethodStub(
+        'Echo', 'test.Echo', ErrorMessage, ErrorMessage,
+        options={'flags': 0},
+    )
+    context = conn.context_manager.new_outbound_context(
+        method=method, conn=conn,
+    )
+    conn.data_received(
+        conn.router.encode_connection_error(
+            Protocol, RPCError.ConnectionLimit(data={'max_connections': 1}),
+        )
+    )
+    with pytest.raises(RPCError.ConnectionLimit):
+        await context.recv_message()
+    conn.close()
+    peer.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_graceful_shutdown_finishes_contexts():
+    conn, peer = make_connection()
+    conn.router = PBRouter()
+    peer.setblocking(False)
+    conn.context_manager.new_inbound_context(1, method=None, conn=conn)
+    assert conn.inflight == 1
+
+    conn.graceful_shutdown('test')
+    assert conn.is_draining
+    # new requests are rejected while draining
+    conn.data_received(make_packet(3))
+    await sleep(0.001)
+    meta, payload = Protocol.feed_data(peer.recv(65536))[1][0]
+    assert meta.transmission_id == 3
+    assert meta.is_failed
+    error = ErrorMessage.FromString(payload)
+    assert error.code == RPCError.RPCShutdown.code
+    with pytest.raises(BlockingIOError):
+        peer.recv(1)
+
+    # write side is shut down once contexts in flight are done
+    conn.context_manager.release_context(1)
+    assert conn.inflight == 0
+    await sleep(0.001)
+    assert peer.recv(1) == b''
+    conn.close()
+    peer.close()
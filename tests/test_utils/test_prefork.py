@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+import pymaid.rpc.pb
+
+from pymaid.core import create_task, run, sleep, wait_for
+from pymaid.ext.monitor.monitor_pb2 import MonitorService, MonitorService_Stub
+from pymaid.net.raw import get_inherited_listeners, SO_INCOMING_CPU
+from pymaid.rpc.pb.pymaid_pb2 import Void
+from pymaid.rpc.pb.router import PBRouterStub
+from pymaid.utils import prefork
+from pymaid.utils.prefork import Supervisor
+
+
+class _Supervisor(Supervisor):
+
+    MIN_UPTIME = 0.01
+    TICK = 0.01
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _started(path):
+    return {int(name) for name in os.listdir(path)}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # may be a zombie not reaped yet
+    with open(f'/proc/{pid}/stat') as fp:
+        return fp.read().split(')')[-1].split()[0] != 'Z'
+
+
+def _supervise(path, count, bind):
+    def entry():
+        listeners = get_inherited_listeners('tcp4', 'localhost:8903')
+        with open(f'{path}/{os.getpid()}', 'w') as fp:
+            fp.write(f'{prefork.worker_index} {listeners[0].getsockname()}')
+        time.sleep(60)
+    os._exit(_Supervisor(entry, count, bind=bind, graceful_timeout=1).run())
+
+
+def test_supervisor(tmp_path):
+    master = multiprocessing.get_context('fork').Process(
+        target=_supervise, args=(tmp_path, 2, ['tcp4://localhost:8903']),
+    )
+    master.start()
+    assert _wait_for(lambda: len(_started(tmp_path)) == 2)
+    workers = _started(tmp_path)
+    indexes = set()
+    for pid in workers:
+        index, sockname = (tmp_path / str(pid)).read_text().split(' ', 1)
+        indexes.add(int(index))
+        assert sockname == "('127.0.0.1', 8903)"
+    assert indexes == {0, 1}
+
+    # crashed worker is restarted
+    crashed = workers.pop()
+    os.kill(crashed, signal.SIGKILL)
+    assert _wait_for(lambda: len(_started(tmp_path)) == 3)
+    workers = _started(tmp_path) - {crashed}
+
+    # reload replaces all workers
+    os.kill(master.pid, signal.SIGHUP)
+    assert _wait_for(lambda: len(_started(tmp_path)) == 5)
+    assert _wait_for(lambda: not any(_alive(pid) for pid in workers))
+    workers = _started(tmp_path) - workers - {crashed}
+    assert all(_alive(pid) for pid in workers)
+
+    os.kill(master.pid, signal.SIGTERM)
+    master.join(5)
+    assert master.exitcode == 0
+    assert not any(_alive(pid) for pid in workers)
+
+
+class _SlowMonitor(MonitorService):
+
+    async def Ping(self, context):
+        await sleep(0.5)
+        await context.send_message()
+
+
+def _supervise_rpc(path):
+    async def main():
+        ch = await pymaid.rpc.pb.serve_stream(
+            'tcp4://localhost:8917', services=[_SlowMonitor()],
+        )
+        async with ch:
+            (path / str(os.getpid())).touch()
+            await ch.serve_forever()
+
+    def entry():
+        run(main())
+
+    os._exit(_Supervisor(
+        entry, 1, bind=['tcp4://localhost:8917'], graceful_timeout=5,
+    ).run())
+
+
+@pytest.mark.asyncio
+async def test_supervisor_reload_drains_workers(tmp_path):
+    master = multiprocessing.get_context('fork').Process(
+        target=_supervise_rpc, args=(tmp_path,),
+    )
+    master.start()
+    try:
+        assert _wait_for(lambda: len(_started(tmp_path)) == 1)
+        old = _started(tmp_path).pop()
+        stub = PBRouterStub(MonitorService_Stub(None))
+        conn = await pymaid.rpc.pb.dial_stream('tcp4://localhost:8917')
+        ping = create_task(stub.Ping(Void(), conn=conn))
+        await sleep(0.1)
+
+        # in flight ping is finished by the old worker
+        os.kill(master.pid, signal.SIGHUP)
+        await wait_for(ping, 3)
+        conn.close()
+        assert _wait_for(lambda: not _alive(old))
+        assert len(_started(tmp_path)) == 2
+    finally:
+        os.kill(master.pid, signal.SIGTERM)
+        master.join(5)
+    assert master.exitcode == 0
+
+
+def test_supervisor_restart_delay():
+    supervisor = _Supervisor(lambda: None, 1)
+    worker = supervisor.workers[0]
+    worker.started_at = time.monotonic()
+    supervisor._worker_exited(worker, 1)
+    assert worker.restart_delay == _Supervisor.MIN_UPTIME
+    worker.started_at = time.monotonic()
+    supervisor._worker_exited(worker, 1)
+    assert worker.restart_delay == _Supervisor.MIN_UPTIME * 2
+    assert worker.restarts == 2
+    assert worker.last_exit == 1
+
+    worker.started_at = time.monotonic() - 1
+    supervisor._worker_exited(worker, 0)
+    assert worker.restart_delay == 0
+
+
+def test_supervisor_steer_by_cpu():
+    cpus = prefork.get_cpus()
+    supervisor = _Supervisor(
+        lambda: None, 1, bind=['tcp4://127.0.0.1:8915'], steer_by_cpu=True,
+    )
+    try:
+        supervisor.bind_listeners()
+        worker = supervisor.workers[0]
+        sockets = worker.listeners[('tcp4', '127.0.0.1:8915')]
+        assert sockets == supervisor.listeners
+        assert sockets[0].getsockopt(
+            socket.SOL_SOCKET, SO_INCOMING_CPU
+        ) == cpus[0]
+    finally:
+        for sock in supervisor.listeners:
+            sock.close()
+
+    with pytest.raises(ValueError):
+        _Supervisor(lambda: None, len(cpus) + 1, steer_by_cpu=True)
+    with pytest.raises(ValueError):
+        _Supervisor(lambda: None, 1, steer_by_cpu=True, cpu_affinity=False)
@@ -0,0 +1,74 @@
+import pytest
+
+from pymaid.core import get_running_loop, sleep
+from pymaid.utils.timer import TimerWheel, get_timer_wheel
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_fire_and_cancel():
+    wheel = TimerWheel(tick=0.005, slots=4, levels=2)
+    loop = get_running_loop()
+    fired = []
+    started = loop.time()
+
+    def fire(name):
+        fired.append((name, loop.time() - started))
+
+    wheel.call_later(0.01, fire, 'a')
+    wheel.call_later(0.001, fire, 'b')
+    cancelled = wheel.call_later(0.005, fire, 'c')
+    # cascaded from level 1
+    wheel.call_later(0.05, fire, 'd')
+    assert len(wheel) == 4
+    cancelled.cancel()
+    assert cancelled.cancelled
+    assert len(wheel) == 3
+
+    await sleep(0.08)
+    assert [name for name, _ in fired] == ['b', 'a', 'd']
+    # never early, at most one tick late plus loop latency
+    for (name, elapsed), delay in zip(fired, (0.001, 0.01, 0.05)):
+        assert delay <= elapsed < delay + 0.02, (name, elapsed)
+    assert not len(wheel)
+    # stops ticking when empty
+    assert wheel._tick_handle is None
+    wheel.close()
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_beyond_range():
+    # covers 4 ** 2 ticks only
+    wheel = TimerWheel(tick=0.001, slots=4, levels=2)
+    fired = []
+    wheel.call_later(0.04, fired.append, 'late')
+    await sleep(0.03)
+    assert not fired
+    await sleep(0.03)
+    assert fired == ['late']
+    wheel.close()
+
+
+@pytest.mark.asyncio
+async def test_timer_wheel_callback_error():
+    wheel = TimerWheel(tick=0.001)
+    errors = []
+    loop = get_running_loop()
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    fired = []
+
+    def fail():
+        raise ValueError('fail')
+
+    wheel.call_later(0.001, fail)
+    wheel.call_later(0.001, fired.append, 'ok')
+    await sleep(0.01)
+    assert fired == ['ok']
+    assert isinstance(errors[0]['exception'], ValueError)
+    loop.set_exception_handler(None)
+
+
+@pytest.mark.asyncio
+async def test_get_timer_wheel():
+    wheel = get_timer_wheel()
+    assert get_timer_wheel() is wheel
+    assert wheel.loop is get_running_loop()